@@ -0,0 +1,88 @@
+"""
+Индекс активных анкет в памяти процесса
+
+Список активных анкет меняется только в моменты старта и окончания анкет или при изменении
+анкет администратором. Индекс помнит ближайший такой момент и до него отдаёт список из памяти.
+Изменения администратора отмечаются сменой версии в кэше Django, чтобы их видели все процессы.
+"""
+import threading
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from .models import QuestionSet
+from .serializers import QuestionSetSerializer
+from .routers import use_primary
+
+VERSION_KEY = 'questionnaire:active_question_sets_version'
+
+# Предельный срок жизни индекса на случай изменения анкет в обход API
+INDEX_TIMEOUT = getattr(settings, 'QUESTIONNAIRE_ACTIVE_INDEX_TIMEOUT', 60)
+
+
+class ActiveQuestionSetIndex:
+    """
+    Активные анкеты: с датой старта не позже текущего момента и неистекшей датой окончания
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _get_state(self):
+        now = timezone.now()
+        version = cache.get(VERSION_KEY)
+        state = self._state
+        if state is None or state['version'] != version or now >= state['valid_until']:
+            with self._lock:
+                state = self._state
+                if state is None or state['version'] != version or now >= state['valid_until']:
+                    state = self._build(now, version)
+                    self._state = state
+        return state
+
+    @use_primary()
+    def _build(self, now, version):
+        # Достаточно неистекших анкет: среди них и активные, и ещё не начавшиеся
+        question_sets = list(QuestionSet.objects.filter(
+            Q(end_date__isnull=True) | Q(end_date__gte=now)
+        ).order_by('id'))
+        active = [question_set for question_set in question_sets if question_set.start_date <= now]
+        boundaries = [now + timedelta(seconds=INDEX_TIMEOUT)]
+        boundaries.extend(question_set.start_date for question_set in question_sets \
+            if question_set.start_date > now)
+        boundaries.extend(question_set.end_date for question_set in active \
+            if question_set.end_date is not None)
+        return {
+            'version': version,
+            'valid_until': min(boundaries),
+            'ids': frozenset(question_set.id for question_set in active),
+            'end_dates': {question_set.id: question_set.end_date for question_set in active},
+            'data': list(QuestionSetSerializer(active, many=True).data),
+        }
+
+    def get_data(self):
+        """
+        Сериализованный список активных анкет
+        """
+        return self._get_state()['data']
+
+    def is_active(self, question_set_id):
+        return question_set_id in self._get_state()['ids']
+
+    def get_end_date(self, question_set_id):
+        """
+        Дата окончания активной анкеты (None - бессрочная или уже неактивная)
+        """
+        return self._get_state()['end_dates'].get(question_set_id)
+
+
+active_question_sets = ActiveQuestionSetIndex()
+
+
+def invalidate_active_question_sets():
+    """
+    Сброс индекса активных анкет во всех процессах
+    """
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
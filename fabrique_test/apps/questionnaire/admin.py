@@ -1,8 +1,362 @@
-from django.contrib import admin
-from .models import QuestionSet, Question, AnswerVariant, Interview, Answer
-
-admin.site.register(QuestionSet)
-admin.site.register(Question)
-admin.site.register(AnswerVariant)
-admin.site.register(Interview)
-admin.site.register(Answer)
\ No newline at end of file
+"""
+Админка на большие таблицы
+
+Списки не считают COUNT(*) по всей таблице (EstimatedCountPaginator), связанные объекты читаются
+в том же запросе (list_select_related), внешние ключи редактируются полем с кодом (raw_id_fields),
+а не списком всех строк, фильтры и сортировка - только по проиндексированным полям. Подтверждение
+удаления не собирает все связанные ответы, а удаление и действия работают с QuerySet без загрузки объектов.
+Изменения анкет, вопросов и вариантов сбрасывают те же кэши, что и API администратора.
+"""
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin import actions as admin_actions, helpers
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Max
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.translation import gettext as _
+from . import results
+from .answers import delete_answers, delete_interviews, delete_question_sets, delete_questions, \
+    update_completion
+from .archive import archive_question_set, is_archived
+from .models import QuestionSet, Question, AnswerVariant, AnswerVariantResult, Interview, Answer
+from .snapshots import invalidate_question_sets
+
+# До скольки строк список считается точно; дальше количество оценивается по статистике таблицы
+EXACT_COUNT_LIMIT = getattr(settings, 'QUESTIONNAIRE_ADMIN_EXACT_COUNT_LIMIT', 10000)
+
+
+def estimate_table_rows(model, using):
+    """
+    Оценка количества строк таблицы без её обхода: статистика PostgreSQL, статистика ANALYZE
+    в SQLite или наибольший код строки
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            if row and row[0] > 0:
+                return int(row[0])
+        elif connection.vendor == 'sqlite':
+            try:
+                # Таблица статистики появляется после первого ANALYZE
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s AND idx IS NULL', [table])
+                row = cursor.fetchone()
+            except DatabaseError:
+                row = None
+            if row:
+                return int(row[0].split()[0])
+    return model._default_manager.using(using).aggregate(Max('pk'))['pk__max'] or 0
+
+def count_rows(queryset):
+    """
+    Количество строк, но не больше EXACT_COUNT_LIMIT + 1: точный COUNT(*) большой таблицы - её полный обход
+    """
+    return queryset[:EXACT_COUNT_LIMIT + 1].count()
+
+def format_count(count):
+    return 'больше %d' % EXACT_COUNT_LIMIT if count > EXACT_COUNT_LIMIT else str(count)
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Считает строки списка точно, только пока их не больше EXACT_COUNT_LIMIT. Для большего списка
+    без фильтров количество - оценка по таблице, с фильтрами - EXACT_COUNT_LIMIT
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        count = count_rows(queryset)
+        if count <= EXACT_COUNT_LIMIT:
+            return count
+        if not queryset.query.has_filters():
+            return max(estimate_table_rows(queryset.model, queryset.db), count)
+        return EXACT_COUNT_LIMIT
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Сортировка по полям без индекса на больших таблицах - полный обход
+    sortable_by = ('id',)
+    actions = ['delete_rows']
+    delete_selected_confirmation_template = 'admin/questionnaire/delete_rows_confirmation.html'
+
+    def get_actions(self, request):
+        # Стандартное удаление загружает и журналирует каждый выбранный объект, его заменяет delete_rows
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def delete_rows(self, request, queryset):
+        """
+        Удаление выбранных строк: подтверждение как у стандартного действия, но само удаление - delete_queryset
+        без загрузки и журналирования каждого объекта. Строки считаются не дальше EXACT_COUNT_LIMIT
+        """
+        if not request.POST.get('post'):
+            return self.delete_rows_confirmation(request, queryset)
+        if not self.has_delete_permission(request):
+            raise PermissionDenied
+        count = count_rows(queryset)
+        self.delete_queryset(request, queryset)
+        self.message_user(request, 'Удалено: %s' % format_count(count), messages.SUCCESS)
+    delete_rows.allowed_permissions = ('delete',)
+    delete_rows.short_description = admin_actions.delete_selected.short_description
+
+    def delete_rows_confirmation(self, request, queryset):
+        """
+        Страница подтверждения стандартного действия; стандартное действие считает выбранные строки
+        точным COUNT(*), а здесь количество ограничено, как в списке
+        """
+        deletable_objects, model_count, perms_needed, protected = self.get_deleted_objects(queryset, request)
+        context = dict(self.admin_site.each_context(request),
+            title=_('Cannot delete %(name)s') % {'name': self.opts.verbose_name_plural} if perms_needed \
+                else _('Are you sure?'),
+            objects_name=str(self.opts.verbose_name_plural),
+            deletable_objects=[deletable_objects],
+            model_count=model_count.items(),
+            queryset=queryset,
+            perms_lacking=perms_needed,
+            protected=protected,
+            opts=self.opts,
+            action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
+            media=self.media,
+        )
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, self.delete_selected_confirmation_template, context)
+
+    def get_deleted_objects(self, objs, request):
+        """
+        Подтверждение удаления без сбора всех связанных объектов: только удаляемые объекты (первые 100)
+        и их количество
+        """
+        has_delete_permission = self.has_delete_permission(request)
+        perms_needed = set() if has_delete_permission else {self.model._meta.verbose_name}
+        if isinstance(objs, list):
+            count = len(objs)
+        else:
+            count = count_rows(objs)
+            if self.list_select_related and not isinstance(self.list_select_related, bool):
+                objs = objs.select_related(*self.list_select_related)
+        return [str(obj) for obj in objs[:100]], {self.model._meta.verbose_name_plural: format_count(count)}, \
+            perms_needed, []
+
+def detach_renamed_variants(variant_ids):
+    """
+    Ответы переименованных вариантов остаются текстом прежнего варианта, как при изменении вариантов через API,
+    где переименование - удаление варианта и создание нового. Вызывается до сохранения нового текста
+    """
+    if variant_ids:
+        Answer.objects.filter(variant__in=variant_ids).detach_variants()
+        AnswerVariantResult.objects.filter(variant__in=variant_ids).update(answers=0)
+
+class InvalidateQuestionSetAdmin(ScalableAdmin):
+    """
+    Сброс закэшированных данных анкет при изменении их администратором, как в InvalidateQuestionSetMixin API
+    """
+    def get_question_set_ids(self, queryset):
+        return list(queryset.values_list('id', flat=True))
+
+    def get_question_ids(self, queryset):
+        return []
+
+    def invalidate(self, queryset):
+        invalidate_question_sets(self.get_question_set_ids(queryset), self.get_question_ids(queryset))
+
+    def save_related(self, request, form, formsets, change):
+        # Вызывается после сохранения объекта и вложенных форм
+        super().save_related(request, form, formsets, change)
+        self.invalidate(self.model.objects.filter(pk=form.instance.pk))
+        if change and 'question_set' in form.changed_data:
+            invalidate_question_sets([form.initial['question_set']])
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, self.model.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        question_set_ids = self.get_question_set_ids(queryset)
+        question_ids = self.get_question_ids(queryset)
+        self.delete_data(queryset)
+        invalidate_question_sets(question_set_ids, question_ids)
+
+    def delete_data(self, queryset):
+        with transaction.atomic():
+            self.detach_variants(queryset)
+            queryset.delete()
+
+    def detach_variants(self, queryset):
+        pass
+
+    def save_formset(self, request, form, formset, change):
+        """
+        Вложенные формы сохраняются пачкой: новые объекты одной вставкой, изменённые одним обновлением
+        """
+        instances = formset.save(commit=False)
+        model = formset.model
+        if formset.deleted_objects:
+            deleted = model.objects.filter(pk__in=[obj.pk for obj in formset.deleted_objects])
+            if model is AnswerVariant:
+                Answer.objects.filter(variant__in=deleted).detach_variants()
+            if model is Question:
+                # Ответы на вопросы вычитаются из итогов и прогресса интервью
+                delete_questions([obj.pk for obj in formset.deleted_objects])
+            else:
+                deleted.delete()
+        created = [obj for obj in instances if obj.pk is None]
+        model.objects.bulk_create(created)
+        if model is Question and created:
+            update_completion([form.instance.pk])
+        if model is AnswerVariant:
+            detach_renamed_variants([obj.pk for obj, fields in formset.changed_objects if 'answer_text' in fields])
+        changed_fields = {field for obj, fields in formset.changed_objects for field in fields}
+        if changed_fields:
+            model.objects.bulk_update([obj for obj, fields in formset.changed_objects], changed_fields)
+        formset.save_m2m()
+
+
+class QuestionInline(admin.TabularInline):
+    model = Question
+    fields = ('question_text', 'answer_type')
+    extra = 0
+    show_change_link = True
+
+class AnswerVariantInline(admin.TabularInline):
+    model = AnswerVariant
+    fields = ('answer_text',)
+    extra = 0
+
+
+@admin.register(QuestionSet)
+class QuestionSetAdmin(InvalidateQuestionSetAdmin):
+    list_display = ('id', 'title', 'start_date', 'end_date')
+    sortable_by = ('id', 'start_date', 'end_date')
+    list_filter = ('start_date', 'end_date')
+    search_fields = ('title',)
+    inlines = [QuestionInline]
+    actions = ['delete_rows', 'rebuild_results', 'archive']
+
+    def get_question_ids(self, queryset):
+        return list(Question.objects.filter(question_set__in=queryset).values_list('id', flat=True))
+
+    def delete_data(self, queryset):
+        # Интервью с ответами удаляются порциями, а не сборщиком удаляемых объектов вместе с анкетой
+        delete_question_sets(self.get_question_set_ids(queryset))
+
+    def rebuild_results(self, request, queryset):
+        # Пересчёт идёт прямо в запросе и на это время останавливает запись ответов: запускать на тихих анкетах.
+        # Итоги архивных анкет окончательные, их интервью уже нет в рабочих таблицах
+        question_sets = [question_set for question_set in queryset.order_by('id') \
+            if not is_archived(question_set.id)]
+        for question_set in question_sets:
+            results.rebuild_results(question_set)
+        self.message_user(request, 'Итоги пересчитаны: %d анкет' % len(question_sets))
+    rebuild_results.short_description = 'Пересчитать итоги (останавливает запись ответов)'
+
+    def archive(self, request, queryset):
+        ended = queryset.filter(end_date__lt=timezone.now())
+        question_set_ids = self.get_question_set_ids(ended)
+        for question_set_id in question_set_ids:
+            archive_question_set(question_set_id)
+        self.message_user(request, 'В архив перенесены интервью %d закончившихся анкет' % len(question_set_ids))
+        if queryset.exclude(id__in=question_set_ids).exists():
+            self.message_user(request, 'Незакончившиеся анкеты пропущены', messages.WARNING)
+    archive.short_description = 'Перенести интервью в архив'
+
+@admin.register(Question)
+class QuestionAdmin(InvalidateQuestionSetAdmin):
+    list_display = ('id', 'question_text', 'answer_type', 'question_set')
+    list_select_related = ('question_set',)
+    list_filter = ('question_set', 'answer_type')
+    raw_id_fields = ('question_set',)
+    inlines = [AnswerVariantInline]
+
+    def get_question_set_ids(self, queryset):
+        return list(queryset.values_list('question_set_id', flat=True).distinct())
+
+    def get_question_ids(self, queryset):
+        return list(queryset.values_list('id', flat=True))
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if not change:
+            # Новый вопрос не отвечен ни в одном интервью анкеты
+            update_completion([form.instance.question_set_id])
+
+    def delete_data(self, queryset):
+        delete_questions(self.get_question_ids(queryset))
+
+@admin.register(AnswerVariant)
+class AnswerVariantAdmin(InvalidateQuestionSetAdmin):
+    list_display = ('id', 'answer_text', 'question')
+    list_select_related = ('question',)
+    raw_id_fields = ('question',)
+
+    def get_question_set_ids(self, queryset):
+        return list(queryset.values_list('question__question_set_id', flat=True).distinct())
+
+    def get_question_ids(self, queryset):
+        return list(queryset.values_list('question_id', flat=True).distinct())
+
+    def detach_variants(self, queryset):
+        # Ответы с удаляемыми вариантами сохраняются как текстовые
+        Answer.objects.filter(variant__in=queryset).detach_variants()
+
+    def save_model(self, request, obj, form, change):
+        if change and {'answer_text', 'question'} & set(form.changed_data):
+            detach_renamed_variants([obj.pk])
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change and 'question' in form.changed_data:
+            question = Question.objects.get(pk=form.initial['question'])
+            invalidate_question_sets([question.question_set_id], [question.id])
+
+
+class AnswerDataAdmin(ScalableAdmin):
+    """
+    Интервью и ответы в админке только просматриваются и удаляются: их запись идёт через API
+    вместе со счётчиками итогов и прогрессом интервью
+    """
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, self.model.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        # Удалённое сразу вычитается из итогов анкет и прогресса интервью
+        self.delete_data(queryset)
+
+@admin.register(Interview)
+class InterviewAdmin(AnswerDataAdmin):
+    list_display = ('id', 'question_set', 'interviewee_id', 'loggedin_user', 'start_date', \
+        'answered_questions', 'completed', 'last_activity')
+    list_select_related = ('question_set', 'loggedin_user')
+    # Оба фильтра обслуживает индекс (question_set, completed, last_activity)
+    list_filter = ('question_set', 'completed')
+    raw_id_fields = ('question_set', 'loggedin_user')
+
+    def delete_data(self, queryset):
+        delete_interviews(list(queryset.values_list('id', flat=True)))
+
+@admin.register(Answer)
+class AnswerAdmin(AnswerDataAdmin):
+    list_display = ('id', 'interview_id', 'question', 'answer')
+    list_select_related = ('question', 'variant')
+    list_filter = ('question__question_set',)
+    raw_id_fields = ('interview', 'question', 'variant')
+
+    def answer(self, obj):
+        return str(obj)
+    answer.short_description = 'ответ'
+
+    def delete_data(self, queryset):
+        delete_answers(queryset)
@@ -0,0 +1,301 @@
+"""
+Аналитика ответов анкеты: таблицы сопряжённости двух вопросов, сегменты и доля завершённых интервью
+
+Ответы анкеты один раз загружаются в столбцы: для каждого варианта ответа и для каждого вопроса - множество
+интервью, которые его выбрали (ответили на вопрос), в виде битовой маски по номерам интервью. Сегмент
+("интервью, выбравшие X и Y") - пересечение масок, ячейка таблицы сопряжённости - количество интервью
+в пересечении маски сегмента и масок двух вариантов, поэтому каждая операция проходит по всем интервью
+сразу, а не по ответам. Если установлен NumPy, маски - упакованные массивы битов NumPy, иначе - целые
+числа Python с побитовыми операциями; в обоих случаях маска занимает бит на интервью.
+
+Загруженные столбцы хранятся в памяти процесса, посчитанные итоги - в кэше Django; и те и другие
+действительны, пока не изменились анкета (её версия из snapshots) или ответы на неё (версия ответов,
+которая меняется при старте интервью, каждой записи ответов и при переносе в архив). Архивные интервью загружаются
+вместе с рабочими.
+"""
+import hashlib
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import Answer, AnswerVariant, ArchivedInterview, Interview, Question
+from .routers import use_primary
+from .snapshots import get_question_set_version
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ANSWERS_VERSION_KEY = 'questionnaire:answers_version:%s'
+RESULT_KEY = 'questionnaire:analytics:%s:%s:%s:%s'
+
+RESULT_TIMEOUT = getattr(settings, 'QUESTIONNAIRE_ANALYTICS_TIMEOUT', 60 * 60)
+
+# Сколько анкет держать загруженными в памяти процесса
+MAX_LOADED = getattr(settings, 'QUESTIONNAIRE_ANALYTICS_MAX_LOADED', 4)
+
+# Порция чтения ответов при загрузке
+CHUNK_SIZE = 10000
+
+
+def get_answers_version(question_set_id):
+    """
+    Текущая версия ответов анкеты. Если версии в кэше нет, заводим новую
+    """
+    key = ANSWERS_VERSION_KEY % question_set_id
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+def invalidate_answers(question_set_ids):
+    """
+    Смена версии ответов анкет. Версия меняется сразу и ещё раз после фиксации транзакции:
+    иначе ответы, прочитанные другим процессом до фиксации, остались бы в кэше под новой версией
+    """
+    def change_versions():
+        cache.set_many({ANSWERS_VERSION_KEY % question_set_id: uuid.uuid4().hex \
+            for question_set_id in question_set_ids}, None)
+    change_versions()
+    transaction.on_commit(change_versions)
+
+
+class BitMasks:
+    """
+    Маски интервью - целые числа Python, бит i - интервью с номером i
+    """
+    def __init__(self, size):
+        self.size = size
+
+    def full(self):
+        return (1 << self.size) - 1
+
+    def from_positions(self, positions):
+        bits = bytearray((self.size + 7) // 8)
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(bytes(bits), 'little')
+
+    if hasattr(int, 'bit_count'):
+        def count(self, mask):
+            return mask.bit_count()
+    else:
+        def count(self, mask):
+            return bin(mask).count('1')
+
+if numpy is not None:
+    # Количество единичных битов каждого байта, для NumPy без bitwise_count
+    BYTE_BITS = numpy.array([bin(value).count('1') for value in range(256)], dtype=numpy.uint8)
+
+    class NumpyMasks:
+        """
+        Маски интервью - массивы NumPy из 64-битных слов, по биту на интервью: миллион интервью - 125 КБ на маску
+        """
+        def __init__(self, size):
+            self.size = size
+            self.words = (size + 63) // 64
+
+        def pack(self, bits):
+            return numpy.packbits(bits, bitorder='little').view(numpy.uint64)
+
+        def full(self):
+            bits = numpy.zeros(self.words * 64, dtype=bool)
+            bits[:self.size] = True
+            return self.pack(bits)
+
+        def from_positions(self, positions):
+            bits = numpy.zeros(self.words * 64, dtype=bool)
+            bits[numpy.fromiter(positions, dtype=numpy.int64, count=len(positions))] = True
+            return self.pack(bits)
+
+        if hasattr(numpy, 'bitwise_count'):
+            def count(self, mask):
+                return int(numpy.bitwise_count(mask).sum())
+        else:
+            def count(self, mask):
+                return int(BYTE_BITS[mask.view(numpy.uint8)].sum())
+else:
+    NumpyMasks = None
+
+
+class AnswerColumns:
+    """
+    Ответы анкеты по столбцам: маски интервью для каждого варианта ответа (variants), для каждого вопроса
+    (respondents) и для завершённых интервью (completed)
+    """
+    def __init__(self, question_set_id):
+        self.question_set_id = question_set_id
+        with use_primary():
+            self.load()
+
+    def load(self):
+        self.questions = OrderedDict((question_id, {'id': question_id, 'question_text': question_text, \
+            'answer_type': answer_type, 'answer_variants': OrderedDict()}) \
+            for question_id, question_text, answer_type in Question.objects.filter(\
+            question_set=self.question_set_id).order_by('id').values_list('id', 'question_text', 'answer_type'))
+        variant_ids = {}
+        for variant_id, question_id, answer_text in AnswerVariant.objects.filter(\
+            question__question_set=self.question_set_id).order_by('id')\
+            .values_list('id', 'question_id', 'answer_text'):
+            self.questions[question_id]['answer_variants'][variant_id] = answer_text
+            variant_ids.setdefault(question_id, {}).setdefault(answer_text, variant_id)
+        positions = {}
+        completed = []
+        variant_positions = {variant_id: [] for question in self.questions.values() \
+            for variant_id in question['answer_variants']}
+        respondent_positions = {question_id: [] for question_id in self.questions}
+        # Номер интервью - порядковый номер по коду: сначала рабочие интервью, за ними архивные
+        for interview_id, is_completed in Interview.objects.filter(question_set=self.question_set_id)\
+            .order_by('id').values_list('id', 'completed').iterator(chunk_size=CHUNK_SIZE):
+            if is_completed:
+                completed.append(len(positions))
+            positions[interview_id] = len(positions)
+        for interview_id, question_id, variant_id in Answer.objects.filter(\
+            question__question_set=self.question_set_id).values_list('interview_id', 'question_id', 'variant_id')\
+            .iterator(chunk_size=CHUNK_SIZE):
+            # Интервью и варианты, появившиеся во время загрузки, войдут в следующую версию
+            position = positions.get(interview_id)
+            if position is None or question_id not in respondent_positions:
+                continue
+            respondent_positions[question_id].append(position)
+            if variant_id in variant_positions:
+                variant_positions[variant_id].append(position)
+        size = len(positions)
+        for is_completed, answers in ArchivedInterview.objects.filter(question_set=self.question_set_id)\
+            .order_by('id').values_list('completed', 'answers').iterator(chunk_size=CHUNK_SIZE):
+            if is_completed:
+                completed.append(size)
+            for question_id, texts in json.loads(answers).items():
+                question_id = int(question_id)
+                if question_id not in respondent_positions:
+                    continue
+                respondent_positions[question_id].append(size)
+                for text in texts:
+                    variant_id = variant_ids.get(question_id, {}).get(text)
+                    if variant_id is not None:
+                        variant_positions[variant_id].append(size)
+            size += 1
+        self.masks = (NumpyMasks if numpy is not None else BitMasks)(size)
+        self.all = self.masks.full()
+        self.completed = self.masks.from_positions(completed)
+        self.variants = {variant_id: self.masks.from_positions(variant_positions[variant_id]) \
+            for variant_id in variant_positions}
+        self.respondents = {question_id: self.masks.from_positions(respondent_positions[question_id]) \
+            for question_id in respondent_positions}
+
+    def get_segment(self, variant_ids):
+        """
+        Маска интервью, выбравших все варианты variant_ids
+        """
+        segment = self.all
+        for variant_id in variant_ids:
+            segment = segment & self.variants[variant_id]
+        return segment
+
+    def get_summary(self, segment):
+        """
+        Количество интервью сегмента, доля завершённых и ответы на каждый вопрос
+        """
+        count = self.masks.count
+        interviews = count(segment)
+        completed = count(segment & self.completed)
+        questions = []
+        for question in self.questions.values():
+            respondents = count(segment & self.respondents[question['id']])
+            questions.append(OrderedDict([
+                ('id', question['id']),
+                ('question_text', question['question_text']),
+                ('answer_type', question['answer_type']),
+                ('respondents', respondents),
+                ('response_rate', respondents / interviews if interviews else 0.0),
+                ('answer_variants', [OrderedDict([
+                    ('id', variant_id),
+                    ('answer_text', answer_text),
+                    ('answers', count(segment & self.variants[variant_id])),
+                ]) for variant_id, answer_text in question['answer_variants'].items()]),
+            ]))
+        return OrderedDict([
+            ('interviews', interviews),
+            ('completed', completed),
+            ('completion_rate', completed / interviews if interviews else 0.0),
+            ('questions', questions),
+        ])
+
+    def get_crosstab(self, segment, row_question_id, column_question_id):
+        """
+        Таблица сопряжённости: сколько интервью сегмента выбрали вариант строки и вариант столбца
+        """
+        count = self.masks.count
+        rows = self.questions[row_question_id]['answer_variants']
+        columns = self.questions[column_question_id]['answer_variants']
+        column_masks = [self.variants[variant_id] for variant_id in columns]
+        counts = []
+        for variant_id in rows:
+            row = segment & self.variants[variant_id]
+            counts.append([count(row & column) for column in column_masks])
+        return OrderedDict([
+            ('rows', row_question_id),
+            ('columns', column_question_id),
+            ('row_variants', [OrderedDict([('id', variant_id), ('answer_text', answer_text)]) \
+                for variant_id, answer_text in rows.items()]),
+            ('column_variants', [OrderedDict([('id', variant_id), ('answer_text', answer_text)]) \
+                for variant_id, answer_text in columns.items()]),
+            ('counts', counts),
+        ])
+
+
+_loaded = OrderedDict()
+_lock = threading.Lock()
+
+def get_answer_columns(question_set_id):
+    """
+    Загруженные ответы анкеты текущих версий; загрузка повторяется после изменения анкеты или ответов
+    """
+    version = (get_question_set_version(question_set_id), get_answers_version(question_set_id))
+    with _lock:
+        loaded = _loaded.get(question_set_id)
+        if loaded is not None and loaded[0] == version:
+            _loaded.move_to_end(question_set_id)
+            return loaded[1]
+    columns = AnswerColumns(question_set_id)
+    with _lock:
+        _loaded[question_set_id] = (version, columns)
+        _loaded.move_to_end(question_set_id)
+        while len(_loaded) > MAX_LOADED:
+            _loaded.popitem(last=False)
+    return columns
+
+def get_question_set_analytics(question_set_id, segment=(), rows=None, columns=None):
+    """
+    Итоги сегмента анкеты (интервью, выбравших все варианты segment) и, если заданы вопросы rows и columns,
+    таблица сопряжённости их вариантов. Неизвестные анкете вопросы и варианты - ValueError
+    """
+    segment = sorted(set(segment))
+    parameters = json.dumps([segment, rows, columns])
+    key = RESULT_KEY % (question_set_id, get_question_set_version(question_set_id), \
+        get_answers_version(question_set_id), hashlib.md5(parameters.encode('utf-8')).hexdigest())
+    result = cache.get(key)
+    if result is not None:
+        return result
+    answer_columns = get_answer_columns(question_set_id)
+    unknown_variants = [variant_id for variant_id in segment if variant_id not in answer_columns.variants]
+    if unknown_variants:
+        raise ValueError('Варианты ответа не из этой анкеты: %s' % ', '.join(map(str, unknown_variants)))
+    if (rows is None) != (columns is None):
+        raise ValueError('Для таблицы сопряжённости нужны оба вопроса: rows и columns')
+    unknown_questions = [question_id for question_id in (rows, columns) \
+        if question_id is not None and question_id not in answer_columns.questions]
+    if unknown_questions:
+        raise ValueError('Вопросы не из этой анкеты: %s' % ', '.join(map(str, unknown_questions)))
+    mask = answer_columns.get_segment(segment)
+    result = answer_columns.get_summary(mask)
+    result['segment'] = segment
+    if rows is not None:
+        result['crosstab'] = answer_columns.get_crosstab(mask, rows, columns)
+    cache.set(key, result, RESULT_TIMEOUT)
+    return result
@@ -0,0 +1,200 @@
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+from .analytics import invalidate_answers
+from .archive import delete_archived_interviews
+from .interview_context import INTERVIEW_KEY, get_question_set_questions
+from .models import Answer, Interview, PendingAnswer, Question, QuestionSet
+from .results import ResultChanges
+from .sqlite import retry_on_lock
+
+# Порция интервью при удалении ответов и интервью: каждая удаляется в своей транзакции
+DELETE_CHUNK_SIZE = 1000
+
+
+def replace_answers(interview, answers_by_question, variant_ids):
+    """
+    Заменяет ответы интервью на перечисленные вопросы.
+    interview - интервью или его контекст (нужны id и question_set_id)
+    answers_by_question - словарь {код вопроса: список ответов без повторов}
+    variant_ids - словарь {код вопроса: {текст варианта: код варианта}}
+    """
+    replace_answers_many({interview.id: interview.question_set_id}, \
+        {(interview.id, question_id): answers for question_id, answers in answers_by_question.items()}, variant_ids)
+
+@retry_on_lock
+def replace_answers_many(interviews, answers, variant_ids):
+    """
+    Заменяет ответы нескольких интервью в одной транзакции одной вставкой и обновляет счётчики итогов анкет
+    и прогресс интервью.
+    interviews - словарь {код интервью: код анкеты}
+    answers - словарь {(код интервью, код вопроса): список ответов без повторов}
+    variant_ids - словарь {код вопроса: {текст варианта: код варианта}}
+    """
+    question_ids_by_interview = {}
+    for interview_id, question_id in answers:
+        question_ids_by_interview.setdefault(interview_id, []).append(question_id)
+    # Ответ из перечня вариантов сохраняем ссылкой на вариант, остальные - текстом
+    new_variants = {key: [variant_ids.get(key[1], {}).get(answer) for answer in texts] \
+        for key, texts in answers.items()}
+    new_answers = [ Answer(interview_id=interview_id, question_id=question_id, variant_id=variant_id, \
+        answer_text=answer if variant_id is None else None) for (interview_id, question_id), texts in answers.items() \
+        for answer, variant_id in zip(texts, new_variants[(interview_id, question_id)]) ]
+    answered_before = dict(Answer.objects.filter(interview_id__in=question_ids_by_interview)\
+        .values_list('interview_id').annotate(Count('question_id', distinct=True)).order_by())
+    old_answers = {}
+    for interview_id, question_id, variant_id in Answer.objects.filter(\
+        interview_id__in=question_ids_by_interview, question_id__in={key[1] for key in answers})\
+        .values_list('interview_id', 'question_id', 'variant_id'):
+        if (interview_id, question_id) in answers:
+            old_answers.setdefault(interview_id, {}).setdefault(question_id, []).append(variant_id)
+    for interview_id, question_ids in question_ids_by_interview.items():
+        Answer.objects.filter(interview_id=interview_id, question_id__in=question_ids).delete()
+    Answer.objects.bulk_create(new_answers)
+    changes = ResultChanges()
+    progress = {}
+    for interview_id, question_ids in question_ids_by_interview.items():
+        answered_after = changes.add_answers_change(interviews[interview_id], answered_before.get(interview_id, 0), \
+            old_answers.get(interview_id, {}), \
+            {question_id: new_variants[(interview_id, question_id)] for question_id in question_ids})
+        progress.setdefault((answered_after, interviews[interview_id]), []).append(interview_id)
+    changes.save()
+    invalidate_answers(set(interviews.values()))
+    # Число вопросов анкеты берём из кэша контекста интервью, чтобы не читать вопросы при каждой записи
+    question_counts = {question_set_id: len(get_question_set_questions(question_set_id)) \
+        for question_set_id in set(interviews.values())}
+    now = timezone.now()
+    for (answered_questions, question_set_id), interview_ids in progress.items():
+        Interview.objects.filter(id__in=interview_ids).update(answered_questions=answered_questions, \
+            completed=answered_questions >= question_counts[question_set_id] > 0, last_activity=now)
+
+def get_answered_questions(interview_ids):
+    """
+    Ответы интервью: {код интервью: {код вопроса: список кодов выбранных вариантов}}, текстовым ответам
+    соответствует None
+    """
+    answered = {}
+    for interview_id, question_id, variant_id in Answer.objects.filter(interview_id__in=interview_ids)\
+        .values_list('interview_id', 'question_id', 'variant_id'):
+        answered.setdefault(interview_id, {}).setdefault(question_id, []).append(variant_id)
+    return answered
+
+def update_progress(progress):
+    """
+    Прогресс интервью после изменения ответов. progress - словарь {(отвеченных вопросов, код анкеты): [коды интервью]}
+    """
+    question_counts = {question_set_id: len(get_question_set_questions(question_set_id)) \
+        for _, question_set_id in progress}
+    for (answered_questions, question_set_id), interview_ids in progress.items():
+        Interview.objects.filter(id__in=interview_ids).update(answered_questions=answered_questions, \
+            completed=answered_questions >= question_counts[question_set_id] > 0)
+
+def delete_answers(answers):
+    """
+    Удаляет ответы answers (QuerySet) порциями интервью и вычитает их из счётчиков итогов анкет
+    и прогресса интервью
+    """
+    interview_ids = sorted(set(answers.values_list('interview_id', flat=True)))
+    for start in range(0, len(interview_ids), DELETE_CHUNK_SIZE):
+        _delete_answers(answers, interview_ids[start:start + DELETE_CHUNK_SIZE])
+
+@retry_on_lock
+def _delete_answers(answers, interview_ids):
+    interviews = dict(Interview.objects.filter(id__in=interview_ids).values_list('id', 'question_set_id'))
+    touched = {}
+    for interview_id, question_id in answers.filter(interview_id__in=interview_ids)\
+        .values_list('interview_id', 'question_id'):
+        touched.setdefault(interview_id, set()).add(question_id)
+    old_answers = get_answered_questions(interview_ids)
+    answers.filter(interview_id__in=interview_ids).delete()
+    new_answers = get_answered_questions(interview_ids)
+    changes = ResultChanges()
+    progress = {}
+    for interview_id, question_set_id in interviews.items():
+        old = old_answers.get(interview_id, {})
+        new = new_answers.get(interview_id, {})
+        answered_after = changes.add_answers_change(question_set_id, len(old), \
+            {question_id: old.get(question_id, []) for question_id in touched.get(interview_id, ())}, \
+            {question_id: new.get(question_id, []) for question_id in touched.get(interview_id, ())})
+        progress.setdefault((answered_after, question_set_id), []).append(interview_id)
+    changes.save()
+    update_progress(progress)
+    invalidate_answers(set(interviews.values()))
+
+def delete_interviews(interview_ids):
+    """
+    Удаляет интервью вместе с ответами порциями и вычитает их из счётчиков итогов и воронки анкет
+    """
+    interview_ids = sorted(interview_ids)
+    for start in range(0, len(interview_ids), DELETE_CHUNK_SIZE):
+        _delete_interviews(interview_ids[start:start + DELETE_CHUNK_SIZE])
+    cache.delete_many([INTERVIEW_KEY % interview_id for interview_id in interview_ids])
+
+@retry_on_lock
+def _delete_interviews(interview_ids):
+    interviews = dict(Interview.objects.filter(id__in=interview_ids).values_list('id', 'question_set_id'))
+    old_answers = get_answered_questions(interview_ids)
+    changes = ResultChanges()
+    for interview_id, question_set_id in interviews.items():
+        old = old_answers.get(interview_id, {})
+        changes.add_interview_removal(question_set_id, len(old), old)
+    # Зависимые ответы удаляются заранее одним запросом, сборщику удаляемых объектов остаются только интервью
+    Answer.objects.filter(interview_id__in=interview_ids).delete()
+    PendingAnswer.objects.filter(interview_id__in=interview_ids).delete()
+    Interview.objects.filter(id__in=interview_ids).delete()
+    changes.save()
+    invalidate_answers(set(interviews.values()))
+
+def update_completion(question_set_ids):
+    """
+    Завершённость интервью анкет после добавления или удаления вопросов: завершено интервью, ответившее
+    на все вопросы анкеты. Воронка итогов считается по числу отвеченных вопросов и от этого не меняется
+    """
+    for question_set_id in set(question_set_ids):
+        question_count = Question.objects.filter(question_set=question_set_id).count()
+        interviews = Interview.objects.filter(question_set=question_set_id)
+        if question_count:
+            interviews.filter(completed=False, answered_questions__gte=question_count).update(completed=True)
+            interviews.filter(completed=True, answered_questions__lt=question_count).update(completed=False)
+        else:
+            interviews.filter(completed=True).update(completed=False)
+
+def delete_questions(question_ids):
+    """
+    Удаляет вопросы. Их ответы сначала удаляются порциями через delete_answers с вычитанием из итогов
+    и прогресса интервью, затем в одной транзакции удаляются вопросы и пересчитывается завершённость
+    интервью их анкет
+    """
+    question_ids = list(question_ids)
+    delete_answers(Answer.objects.filter(question_id__in=question_ids))
+    _delete_questions(question_ids)
+
+@retry_on_lock
+def _delete_questions(question_ids):
+    question_set_ids = set(Question.objects.filter(id__in=question_ids).values_list('question_set_id', flat=True))
+    # Ответы, записанные после удаления порций
+    delete_answers(Answer.objects.filter(question_id__in=question_ids))
+    Question.objects.filter(id__in=question_ids).delete()
+    update_completion(question_set_ids)
+
+def delete_question_sets(question_set_ids):
+    """
+    Удаляет анкеты. Их интервью с ответами сначала удаляются порциями через delete_interviews, поэтому
+    удаление самих анкет не собирает в память все интервью и ответы: остаются вопросы, варианты и итоги.
+    Архивные интервью удаляются в базе архива до анкеты, чтобы прерванное удаление можно было повторить
+    """
+    for question_set_id in question_set_ids:
+        while True:
+            interview_ids = list(Interview.objects.filter(question_set=question_set_id).order_by('id')\
+                .values_list('id', flat=True)[:DELETE_CHUNK_SIZE])
+            if not interview_ids:
+                break
+            delete_interviews(interview_ids)
+    delete_archived_interviews(question_set_ids, DELETE_CHUNK_SIZE)
+    _delete_question_sets(question_set_ids)
+
+@retry_on_lock
+def _delete_question_sets(question_set_ids):
+    # Интервью, начатые после удаления порций
+    delete_interviews(Interview.objects.filter(question_set__in=question_set_ids).values_list('id', flat=True))
+    QuestionSet.objects.filter(id__in=question_set_ids).delete()
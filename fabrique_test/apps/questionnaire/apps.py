@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class QuestionnaireConfig(AppConfig):
     name = 'questionnaire'
+
+    def ready(self):
+        from .sqlite import configure_connection
+        connection_created.connect(configure_connection, dispatch_uid='questionnaire_sqlite')
+        from .search import restore_index_after_migrate
+        post_migrate.connect(restore_index_after_migrate, sender=self, dispatch_uid='questionnaire_search')
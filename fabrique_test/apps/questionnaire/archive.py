@@ -0,0 +1,92 @@
+"""
+Архив интервью прошедших анкет
+
+Интервью анкеты, закончившейся больше QUESTIONNAIRE_ARCHIVE_AFTER_DAYS дней назад, вместе с ответами
+переносятся в ArchivedInterview - по одной строке на интервью с ответами в JSON - и удаляются из рабочих
+таблиц, поэтому размер Interview и Answer определяется только текущими опросами. Анкета, вопросы
+и накопленные итоги остаются на месте, а ArchivedQuestionSet отмечает, что интервью анкеты в архиве.
+
+Перенос идёт порциями: порция сначала фиксируется в архиве, затем удаляется из рабочих таблиц в транзакции,
+которая держит блокировку записи, поэтому ответ, пришедший во время переноса, не теряется. Прерванный
+перенос можно продолжить: уже перенесённые интервью повторно не записываются. Архивные интервью удаляются
+вместе с анкетой: ссылка на анкету в архиве без внешнего ключа и сама база не чистится.
+"""
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models import F
+from django.utils import timezone
+from .analytics import invalidate_answers
+from .interview_context import INTERVIEW_KEY
+from .models import Answer, ArchivedInterview, ArchivedQuestionSet, Interview, PendingAnswer, QuestionSet
+
+ARCHIVE_AFTER_DAYS = getattr(settings, 'QUESTIONNAIRE_ARCHIVE_AFTER_DAYS', 30)
+
+ARCHIVED_FIELDS = ('id', 'question_set_id', 'loggedin_user_id', 'interviewee_id', 'start_date', \
+    'answered_questions', 'completed', 'last_activity')
+
+
+def get_question_sets_to_archive(now=None):
+    """
+    Анкеты, закончившиеся больше ARCHIVE_AFTER_DAYS дней назад и ещё не перенесённые в архив полностью
+    """
+    now = now or timezone.now()
+    return QuestionSet.objects.filter(end_date__lt=now - timedelta(days=ARCHIVE_AFTER_DAYS))\
+        .exclude(archive__finished__isnull=False).order_by('id')
+
+def archive_batch(question_set_id, batch_size):
+    """
+    Переносит в архив до batch_size интервью анкеты. Возвращает (интервью, ответов)
+    """
+    with transaction.atomic():
+        interviews = list(Interview.objects.filter(question_set_id=question_set_id).order_by('id')\
+            .values(*ARCHIVED_FIELDS)[:batch_size])
+        if not interviews:
+            return 0, 0
+        interview_ids = [interview['id'] for interview in interviews]
+        answers = {}
+        for interview_id, question_id, text in Answer.objects.with_text().filter(interview_id__in=interview_ids)\
+            .order_by('id').values_list('interview_id', 'question_id', 'text'):
+            answers.setdefault(interview_id, {}).setdefault(str(question_id), []).append(text)
+        # Архив фиксируется раньше удаления: если база архива отдельная и удаление не пройдёт,
+        # повторный запуск найдёт интервью в архиве и просто удалит их
+        with transaction.atomic(using=router.db_for_write(ArchivedInterview)):
+            ArchivedInterview.objects.bulk_create([ArchivedInterview(answers=json.dumps(\
+                answers.get(interview['id'], {}), ensure_ascii=False), **interview) for interview in interviews], \
+                ignore_conflicts=True)
+        answer_count = Answer.objects.filter(interview_id__in=interview_ids).delete()[0]
+        PendingAnswer.objects.filter(interview_id__in=interview_ids).delete()
+        Interview.objects.filter(id__in=interview_ids).delete()
+        ArchivedQuestionSet.objects.filter(question_set_id=question_set_id).update(\
+            interviews=F('interviews') + len(interview_ids), answers=F('answers') + answer_count)
+        invalidate_answers([question_set_id])
+    cache.delete_many([INTERVIEW_KEY % interview_id for interview_id in interview_ids])
+    return len(interview_ids), answer_count
+
+def archive_question_set(question_set_id, batch_size=500):
+    """
+    Переносит в архив все интервью анкеты. Возвращает отметку об архивировании
+    """
+    ArchivedQuestionSet.objects.get_or_create(question_set_id=question_set_id)
+    while archive_batch(question_set_id, batch_size)[0]:
+        pass
+    ArchivedQuestionSet.objects.filter(question_set_id=question_set_id).update(finished=timezone.now())
+    return ArchivedQuestionSet.objects.get(question_set_id=question_set_id)
+
+def is_archived(question_set_id):
+    return ArchivedQuestionSet.objects.filter(question_set_id=question_set_id).exists()
+
+def delete_archived_interviews(question_set_ids, batch_size=1000):
+    """
+    Удаляет порциями архивные интервью анкет в базе архива. Возвращает число удалённых интервью
+    """
+    using = router.db_for_write(ArchivedInterview)
+    deleted = 0
+    while True:
+        interview_ids = list(ArchivedInterview.objects.using(using).filter(question_set__in=question_set_ids)\
+            .order_by('id').values_list('id', flat=True)[:batch_size])
+        if not interview_ids:
+            return deleted
+        deleted += ArchivedInterview.objects.using(using).filter(id__in=interview_ids).delete()[0]
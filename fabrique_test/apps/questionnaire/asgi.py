@@ -0,0 +1,197 @@
+"""
+ASGI-приложение поверх WSGI-обработчика Django
+
+Django 2.2 не умеет ни ASGI, ни асинхронных представлений и ORM, поэтому представления выполняются
+в пуле из QUESTIONNAIRE_ASGI_THREADS потоков, а приём тела запроса и отправка ответа идут в цикле
+событий. Поток занят только на время работы представления, и медленные клиенты не исчерпывают пул.
+Потоковый ответ (выгрузка) читается в одном потоке от начала до конца, потому что курсор базы
+принадлежит соединению этого потока; готовые куски передаются в цикл событий через ограниченную очередь.
+
+Тело запроса собирается в памяти, поэтому запрос с телом больше QUESTIONNAIRE_ASGI_MAX_BODY_SIZE
+(по умолчанию DATA_UPLOAD_MAX_MEMORY_SIZE) отклоняется с 413 сразу по заголовку Content-Length
+или как только принятая часть превысит предел, не дожидаясь проверки в Django.
+"""
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+THREADS = getattr(settings, 'QUESTIONNAIRE_ASGI_THREADS', 16)
+
+# Наибольший размер тела запроса в байтах; None - без ограничения
+MAX_BODY_SIZE = getattr(settings, 'QUESTIONNAIRE_ASGI_MAX_BODY_SIZE', settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+
+# Сколько кусков потокового ответа может ждать отправки клиенту
+STREAM_QUEUE_SIZE = 16
+
+
+def build_environ(scope, body):
+    """
+    Окружение WSGI для HTTP-запроса ASGI
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # Строки окружения WSGI - байты в latin-1, Django сам декодирует путь из UTF-8
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').lower()
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        # HTTP/2 передаёт куки отдельными заголовками, а Django разбирает их через "; "
+        separator = '; ' if key == 'HTTP_COOKIE' else ','
+        environ[key] = environ[key] + separator + value if key in environ else value
+    # Тело уже принято целиком, а при передаче частями (chunked) заголовка длины нет
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+def get_content_length(scope):
+    """
+    Длина тела из заголовка Content-Length; None, если заголовка нет или он не число
+    """
+    for name, value in scope.get('headers', []):
+        if name.lower() == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class WsgiToAsgi:
+    """
+    ASGI-приложение (протокол ASGI 3) из WSGI-приложения
+    """
+    def __init__(self, wsgi_application, threads=THREADS, max_body_size=MAX_BODY_SIZE):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(threads)
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Поддерживаются только HTTP-запросы, получен %s.' % scope['type'])
+        if self.is_too_large(get_content_length(scope)):
+            return await self.send_too_large(send)
+        body = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.is_too_large(size):
+                return await self.send_too_large(send)
+            body.append(chunk)
+            if not message.get('more_body'):
+                break
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(STREAM_QUEUE_SIZE)
+        state = {'disconnected': False}
+        worker = loop.run_in_executor(self.executor, self.run, build_environ(scope, b''.join(body)), \
+            loop, queue, state)
+        error = None
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+            if error is None:
+                try:
+                    await send(message)
+                except Exception as e:
+                    # Клиент отключился: поток перестанет читать потоковый ответ на следующем куске,
+                    # а очередь дочитываем, чтобы он не ждал места в ней
+                    state['disconnected'] = True
+                    error = e
+        await worker
+        if error is not None:
+            raise error
+
+    def is_too_large(self, size):
+        return self.max_body_size is not None and size is not None and size > self.max_body_size
+
+    async def send_too_large(self, send):
+        await send({
+            'type': 'http.response.start',
+            'status': 413,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({'type': 'http.response.body', \
+            'body': json.dumps({'detail': 'Слишком большое тело запроса.'}).encode('utf-8')})
+
+    def run(self, environ, loop, queue, state):
+        """
+        Выполняется в потоке пула: вызывает Django и передаёт сообщения ASGI в цикл событий
+        """
+        def put(message):
+            asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        result = None
+        try:
+            result = self.wsgi_application(environ, start_response)
+            if getattr(result, 'streaming', False):
+                self.put_start(put, started)
+                for chunk in result:
+                    if state['disconnected']:
+                        break
+                    if chunk:
+                        put({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                put({'type': 'http.response.body', 'body': b''})
+            else:
+                content = b''.join(result)
+                self.put_start(put, started)
+                put({'type': 'http.response.body', 'body': content})
+        finally:
+            try:
+                # Закрытие ответа отправляет request_finished, а он закрывает соединения с базой этого потока
+                if hasattr(result, 'close'):
+                    result.close()
+            finally:
+                put(None)
+
+    def put_start(self, put, started):
+        status, headers = started
+        put({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
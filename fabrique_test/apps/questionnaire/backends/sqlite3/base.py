@@ -0,0 +1,27 @@
+"""
+SQLite с выбором режима начала транзакций
+
+Параметр OPTIONS['transaction_mode'] = 'IMMEDIATE' начинает транзакции командой BEGIN IMMEDIATE:
+блокировка записи берётся сразу, и при занятой базе транзакция ждёт её в пределах timeout.
+При обычном BEGIN транзакция, которая сначала читает, а потом пишет, получает "database is locked"
+без ожидания, если другой процесс успел записать между её чтением и записью.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.transaction_mode = kwargs.pop('transaction_mode', None)
+        if self.transaction_mode is not None and self.transaction_mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured('transaction_mode: одно из %s.' % ', '.join(TRANSACTION_MODES))
+        return kwargs
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute('BEGIN %s' % self.transaction_mode.upper())
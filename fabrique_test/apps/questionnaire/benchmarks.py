@@ -0,0 +1,446 @@
+"""
+Замеры производительности эндпоинтов API через тестовый клиент Django
+
+Каждый эндпоинт из questionnaire/urls.py вызывается заданное число раз на текущей базе (обычно заполненной
+командой seed_benchmark). Для него записываются перцентили времени ответа, количество запросов к базе
+и пиковый объём выделенной памяти. Отчёт - JSON, два отчёта можно сравнить между собой.
+
+Отдельный замер пропускной способности запускает регистрацию ответов одновременно в нескольких
+процессах, чтобы увидеть, как запись масштабируется с числом процессов сервера.
+
+Замер одновременных соединений сравнивает WSGI и ASGI на одинаковом числе потоков для представлений.
+Медленная сеть клиента моделируется задержкой приёма запроса и передачи ответа: при WSGI её ждёт
+поток сервера, при ASGI - цикл событий.
+"""
+import asyncio
+import json
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+import tracemalloc
+from collections import OrderedDict
+from django.contrib.auth import get_user_model
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from .analytics import invalidate_answers
+from .asgi import WsgiToAsgi, build_environ
+from .models import Answer, Interview, Question, QuestionSet
+from .renderers import FastJSONRenderer
+from .serializers import InterviewQuestionsWithAnswersSerializer, InterviewQuestionsWithAnswersValues
+from .validators import get_answer_variants
+
+ADMIN_USERNAME = 'benchmark_admin'
+
+
+def percentile(values, percent):
+    """
+    Перцентиль по ближайшему рангу
+    """
+    values = sorted(values)
+    rank = max(int(round(percent / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+def make_answers(question, variants):
+    if question.answer_type == Question.AnswerType.TEXT:
+        return ['замер']
+    return list(variants)[:1]
+
+
+class BenchmarkContext:
+    """
+    Данные и клиенты, которые используют замеры эндпоинтов
+    """
+    def __init__(self):
+        self.client = Client()
+        self.admin_client = Client()
+        admin, _ = get_user_model().objects.get_or_create(username=ADMIN_USERNAME, \
+            defaults={'is_staff': True, 'is_superuser': True})
+        self.admin_client.force_login(admin)
+        self.question_set = QuestionSet.objects.filter(questions__isnull=False).order_by('-id').first()
+        if self.question_set is None:
+            raise ValueError('В базе нет анкет с вопросами, заполните её командой seed_benchmark.')
+        self.questions = list(Question.objects.filter(question_set=self.question_set).order_by('id'))
+        self.question = self.questions[0]
+        self.interview = Interview.objects.filter(question_set=self.question_set, interviewee_id__isnull=False)\
+            .order_by('-id').first()
+        if self.interview is None:
+            self.interview = self.start_interview()
+        variants = {question.id: get_answer_variants(question.id) for question in self.questions}
+        self.answers = [{'question_id': question.id, 'answers': make_answers(question, variants[question.id])} \
+            for question in self.questions]
+        # Аналитика: сегмент по варианту первого вопроса с выбором, таблица сопряжённости первого и последнего из них
+        choice_questions = [question.id for question in self.questions if variants[question.id]]
+        self.analytics = {'segment': list(variants[choice_questions[0]].values())[:1], \
+            'rows': choice_questions[0], 'columns': choice_questions[-1]} if choice_questions else {}
+        self.document = {
+            'title': 'Замер', 'description': 'Анкета, созданная замером', 'start_date': '2021-01-01T00:00:00Z',
+            'end_date': None,
+            'questions': [{'question_text': question.question_text, 'answer_type': question.answer_type, \
+                'answer_variants': list(variants[question.id])} for question in self.questions],
+        }
+
+    def start_interview(self):
+        return Interview.objects.create(question_set=self.question_set, interviewee_id=1, start_date=timezone.now())
+
+    def post(self, client, url, data):
+        return client.post(url, json.dumps(data), content_type='application/json')
+
+    def patch(self, client, url, data):
+        return client.patch(url, json.dumps(data), content_type='application/json')
+
+
+def get_endpoints(context):
+    """
+    Эндпоинты для замера: (название, функция вызова)
+    """
+    question_set_url = '/api/question_set/%d/' % context.question_set.id
+    question_url = '/api/question/%d/' % context.question.id
+    admin = context.admin_client
+    client = context.client
+
+    def import_and_delete():
+        document = check_response(context.post(admin, '/api/question_set/import/', context.document)).json()
+        return admin.delete('/api/question_set/%d/' % document['id'])
+
+    def clone_and_delete():
+        clone = check_response(context.post(admin, question_set_url + 'clone/', {'title': 'Замер'})).json()
+        return admin.delete('/api/question_set/%d/' % clone['id'])
+
+    def analytics_after_answers():
+        # После записи ответов версия ответов анкеты другая: ответы загружаются в маски заново
+        invalidate_answers([context.question_set.id])
+        return admin.get(question_set_url + 'analytics/', context.analytics)
+
+    def export_answers():
+        response = admin.get('/api/export_answers/', {'question_set': context.question_set.id, \
+            'date_from': '2100-01-01'})
+        b''.join(response.streaming_content)
+        return response
+
+    return [
+        ('GET active_question_sets', lambda: client.get('/api/active_question_sets/')),
+        ('POST start_interview', lambda: context.post(client, '/api/start_interview/', \
+            {'question_set_id': context.question_set.id, 'interviewee_id': context.interview.interviewee_id})),
+        ('GET interview_questions', lambda: client.get('/api/interview_questions/%d/' % context.interview.id)),
+        ('GET interview_unanswered', lambda: client.get('/api/interview_unanswered/%d/' % context.interview.id)),
+        ('POST register_answer', lambda: context.post(client, '/api/register_answer/', \
+            dict(context.answers[0], interview_id=context.interview.id))),
+        ('POST register_answers', lambda: context.post(client, '/api/register_answers/', \
+            {'interview_id': context.interview.id, 'answers': context.answers})),
+        ('GET user_interviews', lambda: client.get('/api/user_interviews/%d/' % context.interview.interviewee_id)),
+        ('GET question_set list', lambda: admin.get('/api/question_set/')),
+        ('GET question_set detail', lambda: admin.get(question_set_url)),
+        ('PATCH question_set', lambda: context.patch(admin, question_set_url, \
+            {'description': context.question_set.description})),
+        ('GET question_set results', lambda: admin.get(question_set_url + 'results/')),
+        ('GET question_set analytics', lambda: admin.get(question_set_url + 'analytics/', context.analytics)),
+        ('GET question_set analytics reload', analytics_after_answers),
+        ('POST question_set import + DELETE', import_and_delete),
+        ('POST question_set clone + DELETE', clone_and_delete),
+        ('GET question list', lambda: admin.get('/api/question/', {'question_set': context.question_set.id})),
+        ('GET question detail', lambda: admin.get(question_url)),
+        ('PATCH question', lambda: context.patch(admin, question_url, \
+            {'question_text': context.question.question_text})),
+        ('GET export_answers', export_answers),
+        # Два слова, одно по началу слова: запрос к индексу с пересечением и ранжированием
+        ('GET search_answers', lambda: admin.get('/api/search_answers/', \
+            {'q': 'удобно быстр*', 'question_set': context.question_set.id})),
+        ('GET metrics', lambda: admin.get('/api/metrics/')),
+    ]
+
+def check_response(response):
+    """
+    Время ответа с ошибкой (400, 404, 429) ничего не говорит о стоимости эндпоинта, поэтому такой ответ
+    останавливает замеры
+    """
+    if response.status_code >= 400:
+        raise ValueError('Ответ %d: %s' % (response.status_code, \
+            b'' if response.streaming else response.content[:200]))
+    return response
+
+def measure(function, iterations):
+    """
+    Время ответа в миллисекундах по итерациям, затем отдельный вызов для подсчёта запросов и памяти.
+    Каждый вызов должен вернуть ответ без ошибки
+    """
+    check_response(function())
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = function()
+        timings.append((time.perf_counter() - started) * 1000)
+        check_response(response)
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        try:
+            check_response(function())
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return OrderedDict([
+        ('iterations', iterations),
+        ('mean_ms', sum(timings) / len(timings)),
+        ('p50_ms', percentile(timings, 50)),
+        ('p90_ms', percentile(timings, 90)),
+        ('p99_ms', percentile(timings, 99)),
+        ('max_ms', max(timings)),
+        ('queries', len(queries)),
+        ('peak_memory_kb', peak / 1024.0),
+    ])
+
+def run(iterations=50, only=None):
+    """
+    Замер всех эндпоинтов. only - подстрока названия, чтобы замерить часть эндпоинтов
+    """
+    context = BenchmarkContext()
+    endpoints = OrderedDict()
+    for name, function in get_endpoints(context):
+        if only and only not in name:
+            continue
+        try:
+            endpoints[name] = measure(function, iterations)
+        except ValueError as e:
+            raise ValueError('%s: %s' % (name, e))
+    return OrderedDict([
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('database', connection.vendor),
+        ('question_sets', QuestionSet.objects.count()),
+        ('interviews', Interview.objects.count()),
+        ('answers', Answer.objects.count()),
+        ('endpoints', endpoints),
+    ])
+
+def register_answers_worker(arguments):
+    """
+    Процесс замера пропускной способности: requests регистраций ответов в своё интервью
+    """
+    interview_id, answers, requests = arguments
+    client = Client()
+    data = json.dumps({'interview_id': interview_id, 'answers': answers})
+    succeeded = failed = 0
+    for _ in range(requests):
+        try:
+            response = client.post('/api/register_answers/', data, content_type='application/json')
+            if response.status_code < 300:
+                succeeded += 1
+            else:
+                failed += 1
+        except Exception:
+            failed += 1
+    connections.close_all()
+    return succeeded, failed
+
+def run_workers(workers=(1, 2, 4, 8), requests=100):
+    """
+    Пропускная способность регистрации ответов при разном числе одновременно работающих процессов.
+    requests - запросов в каждом процессе
+    """
+    context = BenchmarkContext()
+    result = OrderedDict()
+    for count in workers:
+        interview_ids = [context.start_interview().id for _ in range(count)]
+        # Соединения с базой не должны наследоваться процессами
+        connections.close_all()
+        with multiprocessing.Pool(count) as pool:
+            started = time.perf_counter()
+            outcomes = pool.map(register_answers_worker, \
+                [(interview_id, context.answers, requests) for interview_id in interview_ids])
+            elapsed = time.perf_counter() - started
+        succeeded = sum(outcome[0] for outcome in outcomes)
+        result[count] = OrderedDict([
+            ('requests', count * requests),
+            ('failed', sum(outcome[1] for outcome in outcomes)),
+            ('seconds', elapsed),
+            ('requests_per_second', succeeded / elapsed),
+        ])
+    return result
+
+def make_scope(method, path, body):
+    return {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'http_version': '1.1',
+        'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'), \
+            (b'content-length', str(len(body)).encode('latin-1'))],
+    }
+
+def respondent_requests(context, interview_id=None):
+    """
+    Запросы интервьюируемого: список анкет и старт интервью, затем вопросы интервью и ответ
+    """
+    if interview_id is None:
+        return [('GET', '/api/active_question_sets/', None), ('POST', '/api/start_interview/', \
+            {'question_set_id': context.question_set.id, 'interviewee_id': context.interview.interviewee_id})]
+    return [('GET', '/api/interview_questions/%d/' % interview_id, None), \
+        ('POST', '/api/register_answer/', dict(context.answers[0], interview_id=interview_id))]
+
+def encode_body(data):
+    return json.dumps(data).encode('utf-8') if data is not None else b''
+
+class ConcurrencyStats:
+    def __init__(self):
+        self.timings = []
+        self.failed = 0
+
+    def add(self, started, status):
+        self.timings.append((time.perf_counter() - started) * 1000)
+        if status >= 400:
+            self.failed += 1
+
+    def report(self, elapsed):
+        return OrderedDict([
+            ('requests', len(self.timings)),
+            ('failed', self.failed),
+            ('requests_per_second', len(self.timings) / elapsed),
+            ('p50_ms', percentile(self.timings, 50)),
+            ('p99_ms', percentile(self.timings, 99)),
+        ])
+
+def run_wsgi_clients(context, clients, sessions, threads, client_delay):
+    """
+    Синхронный сервер: поток из threads занят запросом вместе с приёмом и передачей по медленной сети
+    """
+    application = get_wsgi_application()
+    stats = ConcurrencyStats()
+
+    def handle(method, path, body):
+        time.sleep(client_delay)
+        status = []
+        result = application(build_environ(make_scope(method, path, body), body), \
+            lambda value, headers, exc_info=None: status.append(value))
+        try:
+            content = b''.join(result)
+        finally:
+            result.close()
+        time.sleep(client_delay)
+        return int(status[0].split(' ', 1)[0]), content
+
+    def client(workers):
+        for _ in range(sessions):
+            interview_id = None
+            while True:
+                for method, path, data in respondent_requests(context, interview_id):
+                    started = time.perf_counter()
+                    status, content = workers.submit(handle, method, path, encode_body(data)).result()
+                    stats.add(started, status)
+                if interview_id is not None or status >= 400:
+                    break
+                interview_id = json.loads(content.decode('utf-8'))['id']
+
+    with ThreadPoolExecutor(threads) as workers, ThreadPoolExecutor(clients) as client_threads:
+        started = time.perf_counter()
+        for future in [client_threads.submit(client, workers) for _ in range(clients)]:
+            future.result()
+        elapsed = time.perf_counter() - started
+    return stats.report(elapsed)
+
+def run_asgi_clients(context, clients, sessions, threads, client_delay):
+    """
+    ASGI: медленную сеть ждёт цикл событий, поток из threads занят только работой представления
+    """
+    application = WsgiToAsgi(get_wsgi_application(), threads)
+    stats = ConcurrencyStats()
+
+    async def handle(method, path, body):
+        messages = []
+
+        async def receive():
+            await asyncio.sleep(client_delay)
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                await asyncio.sleep(client_delay)
+
+        await application(make_scope(method, path, body), receive, send)
+        return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+    async def client():
+        for _ in range(sessions):
+            interview_id = None
+            while True:
+                for method, path, data in respondent_requests(context, interview_id):
+                    started = time.perf_counter()
+                    status, content = await handle(method, path, encode_body(data))
+                    stats.add(started, status)
+                if interview_id is not None or status >= 400:
+                    break
+                interview_id = json.loads(content.decode('utf-8'))['id']
+
+    loop = asyncio.new_event_loop()
+    try:
+        started = time.perf_counter()
+        loop.run_until_complete(asyncio.gather(*[loop.create_task(client()) for _ in range(clients)]))
+        elapsed = time.perf_counter() - started
+    finally:
+        application.executor.shutdown()
+        loop.close()
+    return stats.report(elapsed)
+
+def run_concurrency(clients=50, sessions=2, threads=8, client_delay=0.1):
+    """
+    Пропускная способность респондентских эндпоинтов при clients одновременных клиентах через WSGI и ASGI.
+    Каждый клиент sessions раз проходит: список анкет, старт интервью, вопросы интервью, ответ
+    """
+    context = BenchmarkContext()
+    return OrderedDict([
+        ('wsgi', run_wsgi_clients(context, clients, sessions, threads, client_delay)),
+        ('asgi', run_asgi_clients(context, clients, sessions, threads, client_delay)),
+    ])
+
+def time_calls(function, iterations):
+    function()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return OrderedDict([('p50_ms', percentile(timings, 50)), ('p90_ms', percentile(timings, 90))])
+
+def run_serialization(iterations=20, page_size=100):
+    """
+    Стоимость вывода страницы интервью с вопросами и ответами: сериализаторы DRF с JSONRenderer
+    против словарей из .values() с FastJSONRenderer. Отдельно - только кодирование готовых данных в JSON
+    """
+    interview_ids = list(Interview.objects.order_by('id').values_list('id', flat=True)[:page_size])
+    if not interview_ids:
+        raise ValueError('В базе нет интервью, заполните её командой seed_benchmark.')
+    interviews = Interview.objects.filter(id__in=interview_ids)
+
+    def serializer_output():
+        queryset = InterviewQuestionsWithAnswersSerializer.get_queryset(interviews)
+        return JSONRenderer().render(InterviewQuestionsWithAnswersSerializer(queryset, many=True).data)
+
+    def values_output():
+        page = list(InterviewQuestionsWithAnswersValues.get_queryset(interviews))
+        return FastJSONRenderer().render(InterviewQuestionsWithAnswersValues.to_representation(page))
+
+    if serializer_output() != values_output():
+        raise ValueError('Вывод сериализаторов и быстрый вывод не совпадают.')
+    data = InterviewQuestionsWithAnswersValues.to_representation(\
+        list(InterviewQuestionsWithAnswersValues.get_queryset(interviews)))
+    return OrderedDict([
+        ('interviews', len(interview_ids)),
+        ('bytes', len(values_output())),
+        ('serializer', time_calls(serializer_output, iterations)),
+        ('values', time_calls(values_output, iterations)),
+        ('json_renderer', time_calls(lambda: JSONRenderer().render(data), iterations)),
+        ('fast_json_renderer', time_calls(lambda: FastJSONRenderer().render(data), iterations)),
+    ])
+
+def compare(baseline, report, metrics=('p50_ms', 'p99_ms', 'queries', 'peak_memory_kb')):
+    """
+    Сравнение отчётов: {эндпоинт: {показатель: (было, стало, отношение)}}
+    """
+    result = OrderedDict()
+    for name, values in report['endpoints'].items():
+        if name not in baseline['endpoints']:
+            continue
+        before = baseline['endpoints'][name]
+        result[name] = OrderedDict((metric, (before[metric], values[metric], \
+            values[metric] / before[metric] if before[metric] else None)) for metric in metrics)
+    return result
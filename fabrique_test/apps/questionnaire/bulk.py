@@ -0,0 +1,48 @@
+"""
+Копирование анкет целиком на стороне базы данных
+"""
+from django.db import connection, transaction
+from .models import AnswerVariant, Question, QuestionSet
+
+
+def clone_question_set(question_set, **fields):
+    """
+    Копия анкеты с вопросами и вариантами ответов. fields - поля анкеты, заменяемые в копии
+
+    Вопросы и варианты копируются запросами INSERT ... SELECT без загрузки в память. Новые вопросы
+    сопоставляются исходным по порядковому номеру в анкете.
+    """
+    values = {field: getattr(question_set, field) for field in ('title', 'description', 'start_date', 'end_date')}
+    values.update(fields)
+    quote = connection.ops.quote_name
+    names = {
+        'question': quote(Question._meta.db_table),
+        'question_id': quote(Question._meta.pk.column),
+        'question_set_id': quote(Question._meta.get_field('question_set').column),
+        'question_text': quote(Question._meta.get_field('question_text').column),
+        'answer_type': quote(Question._meta.get_field('answer_type').column),
+        'variant': quote(AnswerVariant._meta.db_table),
+        'variant_id': quote(AnswerVariant._meta.pk.column),
+        'variant_question_id': quote(AnswerVariant._meta.get_field('question').column),
+        'answer_text': quote(AnswerVariant._meta.get_field('answer_text').column),
+    }
+    with transaction.atomic():
+        clone = QuestionSet.objects.create(**values)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {question} ({question_set_id}, {question_text}, {answer_type}) '
+                'SELECT %s, {question_text}, {answer_type} FROM {question} '
+                'WHERE {question_set_id} = %s ORDER BY {question_id}'.format(**names),
+                [clone.id, question_set.id]
+            )
+            cursor.execute(
+                'INSERT INTO {variant} ({variant_question_id}, {answer_text}) '
+                'SELECT target.id, variant.{answer_text} FROM {variant} variant '
+                'JOIN (SELECT {question_id} AS id, ROW_NUMBER() OVER (ORDER BY {question_id}) AS position '
+                'FROM {question} WHERE {question_set_id} = %s) source ON source.id = variant.{variant_question_id} '
+                'JOIN (SELECT {question_id} AS id, ROW_NUMBER() OVER (ORDER BY {question_id}) AS position '
+                'FROM {question} WHERE {question_set_id} = %s) target ON target.position = source.position '
+                'ORDER BY variant.{variant_id}'.format(**names),
+                [question_set.id, clone.id]
+            )
+    return clone
@@ -0,0 +1,165 @@
+"""
+Потоковая выгрузка ответов интервью в CSV (одна строка на интервью, вопросы по столбцам) и NDJSON
+
+Интервью и ответы читаются двумя курсорами, упорядоченными по интервью, и сливаются на лету,
+поэтому память не зависит от объёма выгрузки. Архивные интервью читаются третьим курсором
+и вливаются в выгрузку по коду интервью.
+"""
+import csv
+import heapq
+import json
+import zlib
+from datetime import datetime, time
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Answer, ArchivedInterview, Interview, Question
+
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Размер порции выгрузки, байты
+BUFFER_SIZE = 64 * 1024
+
+# Разделитель нескольких ответов на вопрос в одной ячейке CSV
+MULTIPLE_ANSWERS_SEPARATOR = '; '
+
+_encoder = DjangoJSONEncoder()
+
+INTERVIEW_FIELDS = ('id', 'question_set_id', 'interviewee_id', 'loggedin_user_id', 'start_date')
+
+
+def parse_datetime_value(value):
+    """
+    Дата или дата со временем в формате ISO 8601; без часового пояса считается в текущем поясе
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed_date = parse_date(value)
+        if parsed_date is None:
+            raise ValueError('Неверный формат даты: %s' % value)
+        parsed = datetime.combine(parsed_date, time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+def filter_interviews(queryset, question_set_id=None, date_from=None, date_to=None, prefix=''):
+    """
+    Отбор интервью (или ответов при prefix='interview__') по анкете и дате начала
+    """
+    if question_set_id is not None:
+        queryset = queryset.filter(**{prefix + 'question_set': question_set_id})
+    if date_from is not None:
+        queryset = queryset.filter(**{prefix + 'start_date__gte': date_from})
+    if date_to is not None:
+        queryset = queryset.filter(**{prefix + 'start_date__lt': date_to})
+    return queryset
+
+def iter_live_interviews(question_set_id=None, date_from=None, date_to=None, chunk_size=2000):
+    # Оба курсора читают одну и ту же базу, иначе реплики с разным отставанием дадут разные данные
+    database = router.db_for_read(Interview)
+    interviews = filter_interviews(Interview.objects.using(database), question_set_id, date_from, date_to)\
+        .order_by('id').values_list(*INTERVIEW_FIELDS).iterator(chunk_size=chunk_size)
+    answers = filter_interviews(Answer.objects.using(database), question_set_id, date_from, date_to, 'interview__')\
+        .with_text().order_by('interview_id', 'id').values_list('interview_id', 'question_id', 'text')\
+        .iterator(chunk_size=chunk_size)
+    answer = next(answers, None)
+    for interview in interviews:
+        interview = dict(zip(INTERVIEW_FIELDS, interview))
+        interview_answers = {}
+        while answer is not None and answer[0] <= interview['id']:
+            if answer[0] == interview['id']:
+                interview_answers.setdefault(answer[1], []).append(answer[2])
+            answer = next(answers, None)
+        yield interview, interview_answers
+
+def iter_archived_interviews(question_set_id=None, date_from=None, date_to=None, chunk_size=2000):
+    interviews = filter_interviews(ArchivedInterview.objects.all(), question_set_id, date_from, date_to)\
+        .order_by('id').values_list(*(INTERVIEW_FIELDS + ('answers',))).iterator(chunk_size=chunk_size)
+    for interview in interviews:
+        yield dict(zip(INTERVIEW_FIELDS, interview)), \
+            {int(question_id): texts for question_id, texts in json.loads(interview[-1]).items()}
+
+def iter_interviews(question_set_id=None, date_from=None, date_to=None, chunk_size=2000):
+    """
+    Интервью по возрастанию кода вместе с ответами: (словарь полей интервью, {код вопроса: [ответы]}).
+    Рабочие и архивные интервью сливаются по коду
+    """
+    return heapq.merge(iter_live_interviews(question_set_id, date_from, date_to, chunk_size), \
+        iter_archived_interviews(question_set_id, date_from, date_to, chunk_size), \
+        key=lambda interview: interview[0]['id'])
+
+def _format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return _encoder.default(value)
+    return value
+
+class _Echo:
+    """
+    Псевдобуфер для csv.writer: возвращает записанную строку вместо записи
+    """
+    def write(self, value):
+        return value
+
+def iter_csv(interviews, questions):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(list(INTERVIEW_FIELDS) + \
+        ['%d. %s' % (question_id, question_text) for question_id, question_text in questions])
+    for interview, answers in interviews:
+        yield writer.writerow([_format_value(interview[field]) for field in INTERVIEW_FIELDS] + \
+            [MULTIPLE_ANSWERS_SEPARATOR.join(answers.get(question_id, [])) for question_id, _ in questions])
+
+def iter_ndjson(interviews):
+    for interview, answers in interviews:
+        interview['answers'] = {str(question_id): texts for question_id, texts in answers.items()}
+        yield json.dumps(interview, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+def buffered(lines, size=BUFFER_SIZE):
+    """
+    Склеивает строки выгрузки в порции байтов примерно по size
+    """
+    buffer = []
+    length = 0
+    for line in lines:
+        line = line.encode('utf-8')
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_answers(output_format='csv', question_set_id=None, date_from=None, date_to=None, \
+    gzip=False, chunk_size=2000):
+    """
+    Генератор порций байтов выгрузки ответов
+    """
+    interviews = iter_interviews(question_set_id, date_from, date_to, chunk_size)
+    if output_format == 'csv':
+        questions = Question.objects.order_by('question_set_id', 'id')
+        if question_set_id is not None:
+            questions = questions.filter(question_set=question_set_id)
+        lines = iter_csv(interviews, list(questions.values_list('id', 'question_text')))
+    else:
+        lines = iter_ndjson(interviews)
+    chunks = buffered(lines)
+    return gzipped(chunks) if gzip else chunks
+
+def get_filename(output_format, gzip=False):
+    return 'answers.%s%s' % (output_format, '.gz' if gzip else '')
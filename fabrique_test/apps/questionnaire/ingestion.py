@@ -0,0 +1,50 @@
+"""
+Отложенная запись ответов
+
+В режиме QUESTIONNAIRE_ANSWER_INGESTION = 'queue' проверенные ответы только добавляются в таблицу
+PendingAnswer, а в Answer их переносит команда drain_answer_queue большими транзакциями. Несколько
+одновременно работающих команд не обрабатывают одни и те же строки: каждая забирает свою порцию
+блокировкой строк (SELECT ... FOR UPDATE SKIP LOCKED), а в SQLite записи и так идут по одной.
+"""
+import json
+from collections import OrderedDict
+from django.conf import settings
+from django.db import transaction
+from .answers import replace_answers_many
+from .models import Interview, PendingAnswer
+from .validators import get_answer_variants_many
+
+SYNC = 'sync'
+QUEUE = 'queue'
+
+
+def is_queued():
+    return getattr(settings, 'QUESTIONNAIRE_ANSWER_INGESTION', SYNC) == QUEUE
+
+def enqueue_answers(interview_id, answers_by_question):
+    """
+    answers_by_question - словарь {код вопроса: список ответов без повторов}
+    """
+    PendingAnswer.objects.bulk_create([PendingAnswer(interview_id=interview_id, question_id=question_id, \
+        answers=json.dumps(answers, ensure_ascii=False)) for question_id, answers in answers_by_question.items()])
+
+def drain_batch(batch_size):
+    """
+    Переносит в Answer до batch_size самых старых ответов из очереди. Возвращает количество обработанных строк
+    """
+    with transaction.atomic():
+        # Строки, забранные другой командой, пропускаются: иначе их ответы попали бы в счётчики итогов дважды
+        pending = list(PendingAnswer.objects.select_for_update(skip_locked=True).order_by('id')\
+            .values_list('id', 'interview_id', 'question_id', 'answers')[:batch_size])
+        if not pending:
+            return 0
+        # Из нескольких ответов интервью на один вопрос остаётся последний
+        answers = OrderedDict()
+        for _, interview_id, question_id, texts in pending:
+            answers[(interview_id, question_id)] = json.loads(texts)
+        interviews = dict(Interview.objects.filter(id__in={key[0] for key in answers})\
+            .values_list('id', 'question_set_id'))
+        variant_ids = get_answer_variants_many({key[1] for key in answers})
+        replace_answers_many(interviews, answers, variant_ids)
+        PendingAnswer.objects.filter(id__in=[row[0] for row in pending]).delete()
+    return len(pending)
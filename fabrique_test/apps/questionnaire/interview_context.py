@@ -0,0 +1,110 @@
+"""
+Контекст интервью для проверки и регистрации ответов без обращения к базе
+
+При старте интервью в кэш кладётся компактная запись интервью: анкета и владелец. Вопросы анкеты
+с типами ответа и допустимыми вариантами кэшируются одни на версию анкеты и общие для всех её
+интервью, поэтому изменение анкеты администратором сразу действует на все интервью.
+Запись интервью хранится до окончания анкеты, но не дольше QUESTIONNAIRE_INTERVIEW_CONTEXT_TIMEOUT;
+вытесненная из кэша запись восстанавливается из базы. Отсутствие интервью тоже кэшируется, ненадолго:
+запросы с несуществующими кодами интервью не доходят до основной базы каждый раз.
+"""
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from django.utils import timezone
+from .models import Interview, Question
+from .routers import use_primary
+from .snapshots import SNAPSHOT_TIMEOUT, get_question_set_version
+from .validators import get_answer_variants_many
+
+INTERVIEW_KEY = 'questionnaire:interview:%s'
+QUESTIONS_KEY = 'questionnaire:question_set_rules:%s:%s'
+
+CONTEXT_TIMEOUT = getattr(settings, 'QUESTIONNAIRE_INTERVIEW_CONTEXT_TIMEOUT', 24 * 60 * 60)
+
+# Сколько секунд помнить, что интервью с кодом нет. Созданное интервью кладётся в кэш при старте
+MISSING_TIMEOUT = getattr(settings, 'QUESTIONNAIRE_MISSING_INTERVIEW_TIMEOUT', 60)
+
+# Запись кэша для ненайденного интервью
+MISSING = ()
+
+# Атрибут запроса, в котором хранится контекст интервью запроса
+REQUEST_CONTEXT_ATTRIBUTE = '_questionnaire_interview_context'
+
+# questions - словарь {код вопроса: (тип ответа, {текст варианта: код варианта})}
+InterviewContext = namedtuple('InterviewContext', \
+    ['id', 'question_set_id', 'loggedin_user_id', 'interviewee_id', 'questions'])
+
+
+def get_question_set_questions(question_set_id):
+    """
+    Вопросы текущей версии анкеты: {код вопроса: (тип ответа, {текст варианта: код варианта})}
+    """
+    key = QUESTIONS_KEY % (question_set_id, get_question_set_version(question_set_id))
+    questions = cache.get(key)
+    if questions is None:
+        with use_primary():
+            answer_types = dict(Question.objects.filter(question_set_id=question_set_id)\
+                .values_list('id', 'answer_type'))
+        variants = get_answer_variants_many(answer_types)
+        questions = {question_id: (answer_type, variants[question_id]) \
+            for question_id, answer_type in answer_types.items()}
+        cache.set(key, questions, SNAPSHOT_TIMEOUT)
+    return questions
+
+def remember_interview(interview_id, question_set_id, loggedin_user_id, interviewee_id, end_date):
+    """
+    Запись интервью в кэш до окончания анкеты
+    """
+    timeout = CONTEXT_TIMEOUT
+    if end_date is not None:
+        timeout = min(timeout, int((end_date - timezone.now()).total_seconds()))
+    if timeout > 0:
+        cache.set(INTERVIEW_KEY % interview_id, (question_set_id, loggedin_user_id, interviewee_id), timeout)
+
+def get_interview_context(interview_id):
+    """
+    Контекст интервью. Если интервью нет, Http404
+    """
+    try:
+        interview_id = int(interview_id)
+    except (TypeError, ValueError):
+        raise Http404
+    interview = cache.get(INTERVIEW_KEY % interview_id)
+    if interview == MISSING:
+        raise Http404
+    if interview is None:
+        # Интервью могли только что создать, а реплика ещё не догнала основную базу
+        with use_primary():
+            try:
+                question_set_id, loggedin_user_id, interviewee_id, end_date = Interview.objects\
+                    .values_list('question_set_id', 'loggedin_user_id', 'interviewee_id', \
+                    'question_set__end_date').get(id=interview_id)
+            except Interview.DoesNotExist:
+                cache.add(INTERVIEW_KEY % interview_id, MISSING, MISSING_TIMEOUT)
+                raise Http404
+        remember_interview(interview_id, question_set_id, loggedin_user_id, interviewee_id, end_date)
+        interview = (question_set_id, loggedin_user_id, interviewee_id)
+    return InterviewContext(interview_id, interview[0], interview[1], interview[2], \
+        get_question_set_questions(interview[0]))
+
+def get_request_interview_context(request):
+    """
+    Контекст интервью из поля interview_id тела запроса. Определяется один раз на запрос и хранится
+    в запросе: его используют и ограничители частоты, и представление. Если интервью нет, Http404
+    """
+    context = getattr(request, REQUEST_CONTEXT_ATTRIBUTE, None)
+    if context is None:
+        data = request.data if isinstance(request.data, dict) else {}
+        try:
+            context = get_interview_context(data.get('interview_id'))
+        except Http404:
+            context = MISSING
+        setattr(request, REQUEST_CONTEXT_ATTRIBUTE, context)
+    if context == MISSING:
+        raise Http404
+    return context
+
+def get_interview_question_set_id(interview_id):
+    return get_interview_context(interview_id).question_set_id
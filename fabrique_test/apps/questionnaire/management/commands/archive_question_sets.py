@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from questionnaire.archive import ARCHIVE_AFTER_DAYS, archive_question_set, get_question_sets_to_archive
+from questionnaire.models import QuestionSet
+
+
+class Command(BaseCommand):
+    help = 'Переносит интервью и ответы прошедших анкет в архив порциями и удаляет их из рабочих таблиц. ' \
+        'По умолчанию - анкеты, закончившиеся больше QUESTIONNAIRE_ARCHIVE_AFTER_DAYS (%d) дней назад' % \
+        ARCHIVE_AFTER_DAYS
+
+    def add_arguments(self, parser):
+        parser.add_argument('--question-set', type=int, action='append', dest='question_sets', \
+            help='код закончившейся анкеты (можно указать несколько раз), независимо от срока')
+        parser.add_argument('--batch-size', type=int, default=500, help='интервью в одной транзакции')
+
+    def handle(self, *args, **options):
+        if options['question_sets']:
+            question_sets = QuestionSet.objects.filter(id__in=options['question_sets']).order_by('id')
+            not_finished = [question_set.id for question_set in question_sets \
+                if question_set.end_date is None or question_set.end_date > timezone.now()]
+            if not_finished:
+                raise CommandError('Анкеты ещё не закончились: %s' % ', '.join(map(str, not_finished)))
+        else:
+            question_sets = get_question_sets_to_archive()
+        for question_set in question_sets:
+            archive = archive_question_set(question_set.id, options['batch_size'])
+            self.stdout.write('Анкета %d: в архиве интервью %d, ответов %d' % (question_set.id, \
+                archive.interviews, archive.answers))
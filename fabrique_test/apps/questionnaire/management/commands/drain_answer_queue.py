@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from questionnaire.ingestion import drain_batch
+
+
+class Command(BaseCommand):
+    help = 'Переносит ответы из очереди отложенной записи в таблицу ответов пакетными транзакциями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='ответов в одной транзакции')
+        parser.add_argument('--loop', action='store_true', \
+            help='не завершаться на пустой очереди, а ждать новых ответов')
+        parser.add_argument('--sleep', type=float, default=1.0, help='пауза на пустой очереди, секунды')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            drained = drain_batch(options['batch_size'])
+            total += drained
+            if drained:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write('Перенесено ответов: %d' % total)
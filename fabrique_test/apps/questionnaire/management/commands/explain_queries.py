@@ -0,0 +1,37 @@
+import timeit
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from questionnaire.models import Answer, Interview
+
+
+class Command(BaseCommand):
+    help = 'Показывает планы и время выполнения частых запросов к интервью и ответам на текущей базе ' \
+        '(имеет смысл на базе, заполненной командой seed_benchmark)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=100, help='повторов каждого запроса для замера времени')
+
+    def handle(self, *args, **options):
+        interview = Interview.objects.exclude(interviewee_id=None).order_by('-id').first()
+        answer = Answer.objects.order_by('-id').first()
+        if interview is None or answer is None:
+            raise CommandError('В базе нет интервью с ответами.')
+        user_interview = Interview.objects.exclude(loggedin_user=None).order_by('-id').first()
+        queries = [
+            ('Интервью по interviewee_id (UserInterviewsView)', \
+                Interview.objects.filter(interviewee_id=interview.interviewee_id).order_by('id')[:100]),
+            ('Ответы интервью на вопрос (RegisterAnswerView)', \
+                Answer.objects.filter(interview_id=answer.interview_id, question_id=answer.question_id)),
+            ('Ответы интервью (UserInterviewsView)', \
+                Answer.objects.filter(interview_id__in=[answer.interview_id]).order_by('id')),
+        ]
+        if user_interview is not None:
+            queries.insert(1, ('Интервью по loggedin_user (UserInterviewsView)', \
+                Interview.objects.filter(loggedin_user=user_interview.loggedin_user_id).order_by('id')[:100]))
+        self.stdout.write('База: %s, интервью: %d, ответов: %d' % (connection.vendor, \
+            Interview.objects.count(), Answer.objects.count()))
+        for title, queryset in queries:
+            seconds = timeit.timeit(lambda: list(queryset.all()), number=options['repeat'])
+            self.stdout.write('\n%s: %.3f мс' % (title, seconds * 1000 / options['repeat']))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain())
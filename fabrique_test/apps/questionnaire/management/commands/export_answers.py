@@ -0,0 +1,34 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from questionnaire import export
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка ответов интервью в CSV или NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=export.FORMATS, default='csv', dest='output_format')
+        parser.add_argument('--question-set', type=int, help='код анкеты')
+        parser.add_argument('--date-from', help='начало интервью не раньше (ISO 8601)')
+        parser.add_argument('--date-to', help='начало интервью раньше (ISO 8601)')
+        parser.add_argument('--gzip', action='store_true', help='сжимать выгрузку gzip')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='строк в одной порции чтения из базы')
+        parser.add_argument('--output', help='файл выгрузки, по умолчанию стандартный вывод')
+
+    def handle(self, *args, **options):
+        try:
+            date_from, date_to = [export.parse_datetime_value(options[name]) if options[name] else None \
+                for name in ('date_from', 'date_to')]
+        except ValueError as e:
+            raise CommandError(str(e))
+        chunks = export.export_answers(options['output_format'], options['question_set'], date_from, date_to, \
+            options['gzip'], options['chunk_size'])
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
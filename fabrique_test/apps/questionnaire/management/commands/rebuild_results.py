@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from questionnaire.archive import is_archived
+from questionnaire.models import QuestionSet
+from questionnaire.results import rebuild_results
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики итогов анкет и прогресс интервью по сохранённым ответам, читая интервью порциями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--question-set', type=int, action='append', dest='question_sets', \
+            help='код анкеты (можно указать несколько раз), по умолчанию все анкеты')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='интервью в одной порции')
+
+    def handle(self, *args, **options):
+        question_sets = QuestionSet.objects.order_by('id')
+        if options['question_sets']:
+            question_sets = question_sets.filter(id__in=options['question_sets'])
+        for question_set in question_sets:
+            # Интервью архивной анкеты удалены из рабочих таблиц, а её итоги уже окончательные
+            if is_archived(question_set.id):
+                self.stdout.write('Анкета %d: в архиве, пропущена' % question_set.id)
+                continue
+            rebuild_results(question_set, options['chunk_size'])
+            self.stdout.write('Анкета %d: счётчики пересчитаны' % question_set.id)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from questionnaire.search import iter_rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает индекс полнотекстового поиска по ответам порциями. Индекс обновляется при записи ответов ' \
+        'сам, пересборка нужна после восстановления базы или загрузки ответов в обход таблицы ответов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help='ответов в одной порции')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='база данных')
+
+    def handle(self, *args, **options):
+        try:
+            for last_id in iter_rebuild_index(options['chunk_size'], options['database']):
+                self.stdout.write('Проиндексированы ответы до %d' % last_id)
+        except NotImplementedError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Индекс пересобран')
@@ -0,0 +1,113 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_test_environment
+from questionnaire import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время ответа, количество запросов к базе и память эндпоинтов API на текущей базе. ' \
+        'Команда создаёт интервью, ответы и анкеты, поэтому запускайте её на отдельной базе для замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='вызовов каждого эндпоинта')
+        parser.add_argument('--only', help='замерять только эндпоинты, в названии которых есть эта строка')
+        parser.add_argument('--output', help='файл для отчёта в JSON')
+        parser.add_argument('--compare', help='отчёт предыдущего запуска для сравнения')
+        parser.add_argument('--fail-ratio', type=float, default=None, \
+            help='завершиться с ошибкой, если p50 или количество запросов выросли больше, чем во столько раз')
+        parser.add_argument('--workers', help='вместо замера эндпоинтов замерить пропускную способность ' \
+            'регистрации ответов при заданном через запятую числе процессов, например 1,2,4,8')
+        parser.add_argument('--requests', type=int, default=100, help='запросов в каждом процессе при --workers')
+        parser.add_argument('--serialization', action='store_true', help='вместо замера эндпоинтов сравнить ' \
+            'стоимость вывода страницы интервью через сериализаторы DRF и через быстрый вывод')
+        parser.add_argument('--page-size', type=int, default=100, help='интервью на странице при --serialization')
+        parser.add_argument('--concurrency', type=int, help='вместо замера эндпоинтов сравнить WSGI и ASGI ' \
+            'при заданном числе одновременных клиентов с медленной сетью')
+        parser.add_argument('--sessions', type=int, default=2, \
+            help='прохождений (список анкет, старт, вопросы, ответ) на клиента при --concurrency')
+        parser.add_argument('--threads', type=int, default=8, help='потоков для представлений при --concurrency')
+        parser.add_argument('--client-delay', type=float, default=0.1, \
+            help='задержка сети клиента на приём запроса и на передачу ответа при --concurrency, секунды')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        # Все запросы идут от одного клиента, а замеряется стоимость эндпоинтов, а не лимиты запросов
+        with override_settings(QUESTIONNAIRE_THROTTLE_RATES={}):
+            return self.handle_benchmarks(options)
+
+    def handle_benchmarks(self, options):
+        if options['workers']:
+            return self.handle_workers(options)
+        if options['concurrency']:
+            return self.handle_concurrency(options)
+        if options['serialization']:
+            return self.handle_serialization(options)
+        try:
+            report = benchmarks.run(options['iterations'], options['only'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write('%-36s %9s %9s %9s %8s %10s' % ('эндпоинт', 'p50 мс', 'p90 мс', 'p99 мс', 'запросы', 'память КБ'))
+        for name, values in report['endpoints'].items():
+            self.stdout.write('%-36s %9.2f %9.2f %9.2f %8d %10.1f' % (name, values['p50_ms'], values['p90_ms'], \
+                values['p99_ms'], values['queries'], values['peak_memory_kb']))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, ensure_ascii=False)
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                self.report_comparison(benchmarks.compare(json.load(baseline), report), options['fail_ratio'])
+
+    def handle_workers(self, options):
+        try:
+            workers = [int(count) for count in options['workers'].split(',')]
+            report = benchmarks.run_workers(workers, options['requests'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write('%8s %9s %8s %10s' % ('процессы', 'запросы', 'ошибки', 'запросов/с'))
+        for count, values in report.items():
+            self.stdout.write('%8d %9d %8d %10.1f' % (count, values['requests'], values['failed'], \
+                values['requests_per_second']))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, ensure_ascii=False)
+
+    def handle_concurrency(self, options):
+        try:
+            report = benchmarks.run_concurrency(options['concurrency'], options['sessions'], options['threads'], \
+                options['client_delay'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write('%6s %9s %8s %10s %9s %9s' % ('сервер', 'запросы', 'ошибки', 'запросов/с', 'p50 мс', \
+            'p99 мс'))
+        for server, values in report.items():
+            self.stdout.write('%6s %9d %8d %10.1f %9.1f %9.1f' % (server, values['requests'], values['failed'], \
+                values['requests_per_second'], values['p50_ms'], values['p99_ms']))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, ensure_ascii=False)
+
+    def handle_serialization(self, options):
+        try:
+            report = benchmarks.run_serialization(options['iterations'], options['page_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Страница из %d интервью, %d байт' % (report['interviews'], report['bytes']))
+        for name in ('serializer', 'values', 'json_renderer', 'fast_json_renderer'):
+            self.stdout.write('%-20s p50 %8.2f мс, p90 %8.2f мс' % (name, report[name]['p50_ms'], \
+                report[name]['p90_ms']))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, ensure_ascii=False)
+
+    def report_comparison(self, comparison, fail_ratio):
+        regressions = []
+        self.stdout.write('\nСравнение с предыдущим отчётом (было -> стало, отношение)')
+        for name, metrics in comparison.items():
+            parts = []
+            for metric, (before, after, ratio) in metrics.items():
+                parts.append('%s %.1f -> %.1f (%s)' % (metric, before, after, '%.2f' % ratio if ratio else '-'))
+                if fail_ratio and ratio and metric in ('p50_ms', 'queries') and ratio > fail_ratio:
+                    regressions.append('%s: %s' % (name, metric))
+            self.stdout.write('%s: %s' % (name, ', '.join(parts)))
+        if regressions:
+            raise CommandError('Ухудшение больше чем в %.2f раза: %s' % (fail_ratio, '; '.join(regressions)))
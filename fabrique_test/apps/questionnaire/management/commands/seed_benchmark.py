@@ -0,0 +1,105 @@
+import random
+from datetime import timedelta
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from questionnaire.models import Answer, AnswerVariant, Interview, Question, QuestionSet
+
+WORDS = ('да', 'нет', 'хорошо', 'плохо', 'быстро', 'медленно', 'удобно', 'дорого', 'дешево', 'красиво')
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими анкетами, интервью и ответами для нагрузочных замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--question-sets', type=int, default=10, help='количество анкет')
+        parser.add_argument('--questions', type=int, default=20, help='вопросов в анкете')
+        parser.add_argument('--variants', type=int, default=5, help='вариантов ответа в вопросе с выбором')
+        parser.add_argument('--interviews', type=int, default=10000, help='количество интервью')
+        parser.add_argument('--interviewees', type=int, default=0, \
+            help='количество разных interviewee_id, по умолчанию треть от количества интервью')
+        parser.add_argument('--answer-rate', type=float, default=0.9, help='доля вопросов интервью с ответом')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='строк в одной вставке')
+        parser.add_argument('--seed', type=int, default=None, help='начальное значение генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        now = timezone.now()
+        # Коды задаём сами, чтобы не перечитывать их после bulk_create
+        question_set_id = self.next_id(QuestionSet)
+        question_id = self.next_id(Question)
+        variant_id = self.next_id(AnswerVariant)
+        question_sets = []
+        questions = []
+        variants = {}
+        for number in range(options['question_sets']):
+            question_sets.append(QuestionSet(id=question_set_id + number, title='Анкета %d' % (number + 1), \
+                description='Синтетическая анкета для замеров', start_date=now - timedelta(days=30), \
+                end_date=now + timedelta(days=30)))
+            for question_number in range(options['questions']):
+                answer_type = (Question.AnswerType.TEXT, Question.AnswerType.ONEVARIANT, \
+                    Question.AnswerType.MULTIVARIANT)[question_number % 3]
+                question = Question(id=question_id, question_set_id=question_set_id + number, \
+                    question_text='Вопрос %d' % (question_number + 1), answer_type=answer_type)
+                questions.append(question)
+                if answer_type != Question.AnswerType.TEXT:
+                    variants[question_id] = [AnswerVariant(id=variant_id + variant_number, question_id=question_id, \
+                        answer_text='Вариант %d' % (variant_number + 1)) for variant_number in range(options['variants'])]
+                    variant_id += options['variants']
+                question_id += 1
+        with transaction.atomic():
+            QuestionSet.objects.bulk_create(question_sets)
+            Question.objects.bulk_create(questions)
+            AnswerVariant.objects.bulk_create([variant for items in variants.values() for variant in items])
+        questions_by_set = {}
+        for question in questions:
+            questions_by_set.setdefault(question.question_set_id, []).append(question)
+        interviewees = options['interviewees'] or max(options['interviews'] // 3, 1)
+        interview_id = self.next_id(Interview)
+        interviews = []
+        answers = []
+        answer_count = 0
+        for number in range(options['interviews']):
+            question_set = self.random.choice(question_sets)
+            interviews.append(Interview(id=interview_id + number, question_set_id=question_set.id, \
+                interviewee_id=self.random.randint(1, interviewees), \
+                start_date=now - timedelta(seconds=self.random.randint(0, 30 * 24 * 60 * 60))))
+            for question in questions_by_set[question_set.id]:
+                if self.random.random() < options['answer_rate']:
+                    answers.extend(self.make_answers(interview_id + number, question, variants.get(question.id)))
+            if len(answers) >= self.chunk_size:
+                answer_count += self.flush(interviews, answers)
+                interviews, answers = [], []
+        answer_count += self.flush(interviews, answers)
+        # После вставки с явными кодами сдвигаем последовательности там, где они есть
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), \
+                [QuestionSet, Question, AnswerVariant, Interview, Answer]):
+                cursor.execute(sql)
+        call_command('rebuild_results', chunk_size=self.chunk_size, stdout=self.stdout, \
+            question_sets=[question_set.id for question_set in question_sets])
+        self.stdout.write('Создано анкет: %d, вопросов: %d, интервью: %d, ответов: %d' % ( \
+            len(question_sets), len(questions), options['interviews'], answer_count))
+
+    def next_id(self, model):
+        return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+    def make_answers(self, interview_id, question, variants):
+        if question.answer_type == Question.AnswerType.TEXT:
+            return [Answer(interview_id=interview_id, question_id=question.id, \
+                answer_text=' '.join(self.random.choice(WORDS) for _ in range(3)))]
+        if question.answer_type == Question.AnswerType.ONEVARIANT:
+            chosen = [self.random.choice(variants)]
+        else:
+            chosen = self.random.sample(variants, self.random.randint(1, len(variants)))
+        return [Answer(interview_id=interview_id, question_id=question.id, variant_id=variant.id) for variant in chosen]
+
+    def flush(self, interviews, answers):
+        with transaction.atomic():
+            Interview.objects.bulk_create(interviews)
+            Answer.objects.bulk_create(answers)
+        return len(answers)
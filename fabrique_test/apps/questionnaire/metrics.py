@@ -0,0 +1,109 @@
+"""
+Метрики запросов к API в памяти процесса
+
+Для каждого представления накапливаются гистограмма времени ответа, время в базе, количество запросов
+к базе и повторных запросов (одинаковый SQL в одном запросе к API - признак N+1). Метрики отдаются
+в текстовом формате Prometheus. Каждый процесс сервера копит свои метрики, поэтому при нескольких
+процессах Prometheus должен опрашивать каждый процесс отдельно.
+"""
+import threading
+from django.conf import settings
+
+# Верхние границы корзин гистограммы времени ответа, секунды
+BUCKETS = tuple(getattr(settings, 'QUESTIONNAIRE_METRICS_BUCKETS', \
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)))
+
+# Метод запроса задаёт клиент: прочие методы учитываются вместе, иначе каждый новый метод - новый ряд метрик
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT')
+OTHER_METHOD = 'OTHER'
+
+
+def escape_label(value):
+    """
+    Значение метки в текстовом формате Prometheus
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class ViewMetrics:
+    """
+    Накопленные метрики одного представления и метода HTTP
+    """
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.db_duration = 0.0
+        self.queries = 0
+        self.duplicate_queries = 0
+
+    def add(self, duration, db_duration, queries, duplicate_queries):
+        for index, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                self.buckets[index] += 1
+                break
+        self.count += 1
+        self.duration += duration
+        self.db_duration += db_duration
+        self.queries += queries
+        self.duplicate_queries += duplicate_queries
+
+
+class MetricsRegistry:
+    """
+    Метрики всех представлений процесса: {(представление, метод): ViewMetrics}
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, method, duration, db_duration, queries, duplicate_queries):
+        if method not in METHODS:
+            method = OTHER_METHOD
+        with self._lock:
+            metrics = self._views.get((view, method))
+            if metrics is None:
+                metrics = self._views[(view, method)] = ViewMetrics()
+            metrics.add(duration, db_duration, queries, duplicate_queries)
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+    def render(self):
+        """
+        Метрики в текстовом формате Prometheus
+        """
+        with self._lock:
+            views = sorted((key, metrics.buckets[:], metrics.count, metrics.duration, metrics.db_duration, \
+                metrics.queries, metrics.duplicate_queries) for key, metrics in self._views.items())
+        lines = [
+            '# HELP questionnaire_request_duration_seconds Время ответа API.',
+            '# TYPE questionnaire_request_duration_seconds histogram',
+        ]
+        for (view, method), buckets, count, duration, _, _, _ in views:
+            labels = 'view="%s",method="%s"' % (escape_label(view), escape_label(method))
+            cumulative = 0
+            for bound, value in zip(BUCKETS, buckets):
+                cumulative += value
+                lines.append('questionnaire_request_duration_seconds_bucket{%s,le="%s"} %d' % \
+                    (labels, bound, cumulative))
+            lines.append('questionnaire_request_duration_seconds_bucket{%s,le="+Inf"} %d' % (labels, count))
+            lines.append('questionnaire_request_duration_seconds_sum{%s} %.6f' % (labels, duration))
+            lines.append('questionnaire_request_duration_seconds_count{%s} %d' % (labels, count))
+        counters = (
+            ('questionnaire_request_db_seconds_total', 'Время выполнения запросов к базе.', 4, '%.6f'),
+            ('questionnaire_request_queries_total', 'Количество запросов к базе.', 5, '%d'),
+            ('questionnaire_request_duplicate_queries_total', \
+                'Количество повторов одинакового SQL в пределах запроса к API.', 6, '%d'),
+        )
+        for name, description, index, value_format in counters:
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s counter' % name)
+            for row in views:
+                view, method = row[0]
+                lines.append(('%s{view="%s",method="%s"} ' + value_format) % (name, escape_label(view), \
+                    escape_label(method), row[index]))
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse
+from .metrics import registry
+from .routers import use_primary
+
+logger = logging.getLogger('questionnaire.requests')
+
+
+class QueryRecorder:
+    """
+    Обёртка выполнения SQL: время и количество запросов к базе за один запрос к API
+    """
+    def __init__(self, keep_queries):
+        self.duration = 0.0
+        self.statements = Counter()
+        self.queries = [] if keep_queries else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.duration += duration
+            # SQL без параметров: одинаковый текст с разными параметрами - это и есть N+1
+            self.statements[sql] += 1
+            if self.queries is not None:
+                self.queries.append((duration, sql))
+
+    @property
+    def count(self):
+        return sum(self.statements.values())
+
+    @property
+    def duplicates(self):
+        return self.count - len(self.statements)
+
+
+class QueryTimingMiddleware:
+    """
+    Время ответа, время в базе и количество запросов к базе по каждому представлению
+
+    Значения запроса добавляются в заголовок Server-Timing и в метрики процесса (questionnaire.metrics).
+    Медленные запросы и запросы с многократно повторённым SQL пишутся в журнал questionnaire.requests
+    вместе с текстом самых долгих и самых частых запросов к базе. Для потоковых ответов учитывается
+    время до начала передачи.
+    """
+    server_timing = getattr(settings, 'QUESTIONNAIRE_SERVER_TIMING', True)
+    slow_request_ms = getattr(settings, 'QUESTIONNAIRE_SLOW_REQUEST_MS', 500)
+    duplicate_queries_log = getattr(settings, 'QUESTIONNAIRE_DUPLICATE_QUERIES_LOG', 10)
+    logged_queries = 5
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(keep_queries=self.slow_request_ms is not None)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        view = self.get_view_name(request)
+        registry.observe(view, request.method, duration, recorder.duration, recorder.count, recorder.duplicates)
+        if self.server_timing:
+            response['Server-Timing'] = 'total;dur=%.1f, db;dur=%.1f;desc="queries=%d duplicates=%d"' % \
+                (duration * 1000, recorder.duration * 1000, recorder.count, recorder.duplicates)
+        self.log(request, view, duration, recorder)
+        return response
+
+    def get_view_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unresolved'
+        view_class = getattr(match.func, 'view_class', None) or getattr(match.func, 'cls', None)
+        if view_class is None:
+            return match.view_name or match.func.__name__
+        actions = getattr(match.func, 'actions', None)
+        if actions and request.method.lower() in actions:
+            return '%s.%s' % (view_class.__name__, actions[request.method.lower()])
+        return view_class.__name__
+
+    def log(self, request, view, duration, recorder):
+        slow = self.slow_request_ms is not None and duration * 1000 >= self.slow_request_ms
+        repeated = recorder.statements.most_common(self.logged_queries)
+        has_repeats = self.duplicate_queries_log is not None and bool(repeated) and \
+            repeated[0][1] >= self.duplicate_queries_log
+        if not slow and not has_repeats:
+            return
+        lines = ['%s %s (%s): %.1f мс, в базе %.1f мс, запросов %d, повторных %d' % (request.method, \
+            request.path, view, duration * 1000, recorder.duration * 1000, recorder.count, recorder.duplicates)]
+        if slow and recorder.queries:
+            lines.append('Самые долгие запросы:')
+            lines.extend('%.1f мс: %s' % (query_duration * 1000, sql) for query_duration, sql in \
+                sorted(recorder.queries, key=lambda query: query[0], reverse=True)[:self.logged_queries])
+        if has_repeats:
+            lines.append('Повторяющиеся запросы:')
+            lines.extend('%d раз: %s' % (count, sql) for sql, count in repeated if count > 1)
+        logger.warning('\n'.join(lines))
+
+
+class ReplicaPinningMiddleware:
+    """
+    Чтение своих записей при чтении с реплик
+
+    Запрос с записью целиком читает из основной базы и ставит клиенту куку, с которой его запросы
+    ещё QUESTIONNAIRE_REPLICA_PIN_SECONDS секунд тоже читают из основной базы, пока реплики догоняют.
+    """
+    cookie_name = 'questionnaire_primary'
+    pin_seconds = getattr(settings, 'QUESTIONNAIRE_REPLICA_PIN_SECONDS', 10)
+    safe_methods = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        writes = request.method not in self.safe_methods
+        if writes or self.cookie_name in request.COOKIES:
+            with use_primary():
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+        if writes and response.status_code < 400:
+            response.set_cookie(self.cookie_name, '1', max_age=self.pin_seconds, httponly=True)
+        return response
+
+
+class AdmissionControlMiddleware:
+    """
+    Ограничение числа одновременно обрабатываемых запросов процесса
+
+    Сверх QUESTIONNAIRE_MAX_CONCURRENT_REQUESTS запросы не ждут в очереди, а сразу получают 429
+    с заголовком Retry-After: при всплеске нагрузки база обслуживает допущенные запросы, а не копит
+    ожидающие соединения. None - без ограничения.
+    """
+    retry_after = 1
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.max_concurrent = getattr(settings, 'QUESTIONNAIRE_MAX_CONCURRENT_REQUESTS', None)
+        self.slots = None if self.max_concurrent is None else threading.BoundedSemaphore(self.max_concurrent)
+
+    def __call__(self, request):
+        if self.slots is None:
+            return self.get_response(request)
+        if not self.slots.acquire(blocking=False):
+            response = JsonResponse({'detail': 'Сервер перегружен, повторите запрос позже.'}, status=429)
+            response['Retry-After'] = str(self.retry_after)
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            self.slots.release()
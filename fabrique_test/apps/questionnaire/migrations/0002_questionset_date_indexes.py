@@ -0,0 +1,37 @@
+# Generated by Django 2.2.10 on 2026-10-18 17:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='answer',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='questionnaire.Question'),
+        ),
+        migrations.AlterField(
+            model_name='answervariant',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answer_variants', to='questionnaire.Question'),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='question_set',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='questionnaire.QuestionSet'),
+        ),
+        migrations.AddIndex(
+            model_name='questionset',
+            index=models.Index(fields=['start_date', 'end_date'], name='questionset_start_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionset',
+            index=models.Index(fields=['end_date', 'start_date'], name='questionset_end_start_idx'),
+        ),
+    ]
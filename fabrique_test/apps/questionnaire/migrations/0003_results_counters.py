@@ -0,0 +1,40 @@
+# Generated by Django 2.2.10 on 2026-10-18 17:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0002_questionset_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerVariantResult',
+            fields=[
+                ('variant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='result', serialize=False, to='questionnaire.AnswerVariant')),
+                ('answers', models.IntegerField(default=0, verbose_name='выборов варианта')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuestionResult',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='result', serialize=False, to='questionnaire.Question')),
+                ('respondents', models.IntegerField(default=0, verbose_name='ответивших интервью')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CompletionResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answered_questions', models.IntegerField(verbose_name='отвеченных вопросов')),
+                ('interviews', models.IntegerField(default=0, verbose_name='интервью')),
+                ('question_set', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='completion_results', to='questionnaire.QuestionSet')),
+            ],
+            options={
+                'unique_together': {('question_set', 'answered_questions')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.10 on 2026-10-18 17:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0003_results_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingAnswer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answers', models.TextField(verbose_name='ответы в JSON')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='дата приёма')),
+                ('interview', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='questionnaire.Interview')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='questionnaire.Question')),
+            ],
+        ),
+    ]
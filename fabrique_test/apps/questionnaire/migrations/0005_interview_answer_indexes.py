@@ -0,0 +1,51 @@
+# Generated by Django 2.2.10 on 2026-10-18 17:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Min
+
+
+def remove_duplicate_answers(apps, schema_editor):
+    """
+    Перед добавлением ограничения уникальности оставляем по одному одинаковому ответу
+    """
+    Answer = apps.get_model('questionnaire', 'Answer')
+    duplicates = Answer.objects.values('interview_id', 'question_id', 'answer_text')\
+        .annotate(first_id=Min('id'), answers=Count('id')).filter(answers__gt=1).order_by()
+    for duplicate in duplicates.iterator():
+        Answer.objects.filter(interview_id=duplicate['interview_id'], question_id=duplicate['question_id'], \
+            answer_text=duplicate['answer_text']).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0004_pending_answers'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_answers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='answer',
+            name='interview',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='questionnaire.Interview'),
+        ),
+        migrations.AlterField(
+            model_name='interview',
+            name='loggedin_user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='interview',
+            index=models.Index(fields=['interviewee_id', 'id'], name='interview_interviewee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='interview',
+            index=models.Index(fields=['loggedin_user', 'id'], name='interview_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(fields=('interview', 'question', 'answer_text'), name='answer_unique_text'),
+        ),
+    ]
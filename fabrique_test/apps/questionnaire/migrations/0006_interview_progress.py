@@ -0,0 +1,69 @@
+# Generated by Django 2.2.10 on 2026-10-18 17:54
+
+from django.db import migrations, models, transaction
+from django.db.models import Count
+import django.utils.timezone
+
+CHUNK_SIZE = 1000
+
+
+def fill_progress(apps, schema_editor):
+    """
+    Прогресс существующих интервью по их ответам. Интервью обрабатываются порциями по id, каждая порция
+    в своей транзакции, чтобы не держать блокировку записи на всё время заполнения. Времени ответов
+    нет, поэтому последней активностью считаем старт интервью
+    """
+    Answer = apps.get_model('questionnaire', 'Answer')
+    Interview = apps.get_model('questionnaire', 'Interview')
+    Question = apps.get_model('questionnaire', 'Question')
+    alias = schema_editor.connection.alias
+    question_counts = dict(Question.objects.using(alias).values_list('question_set_id')\
+        .annotate(Count('id')).order_by())
+    last_id = 0
+    while True:
+        interviews = list(Interview.objects.using(alias).filter(id__gt=last_id).order_by('id')\
+            .values_list('id', 'question_set_id', 'start_date')[:CHUNK_SIZE])
+        if not interviews:
+            break
+        answered = dict(Answer.objects.using(alias).filter(interview_id__gt=last_id, \
+            interview_id__lte=interviews[-1][0]).values_list('interview_id')\
+            .annotate(Count('question_id', distinct=True)).order_by())
+        last_id = interviews[-1][0]
+        with transaction.atomic(using=alias):
+            Interview.objects.using(alias).bulk_update([Interview(id=interview_id, \
+                answered_questions=answered.get(interview_id, 0), \
+                completed=answered.get(interview_id, 0) >= question_counts.get(question_set_id, 0) > 0, \
+                last_activity=start_date) for interview_id, question_set_id, start_date in interviews], \
+                ['answered_questions', 'completed', 'last_activity'])
+
+
+class Migration(migrations.Migration):
+    # Заполнение идёт отдельными транзакциями по порциям
+    atomic = False
+
+    dependencies = [
+        ('questionnaire', '0005_interview_answer_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interview',
+            name='answered_questions',
+            field=models.IntegerField(default=0, verbose_name='отвеченных вопросов'),
+        ),
+        migrations.AddField(
+            model_name='interview',
+            name='completed',
+            field=models.BooleanField(default=False, verbose_name='завершено'),
+        ),
+        migrations.AddField(
+            model_name='interview',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='последняя активность'),
+        ),
+        migrations.RunPython(fill_progress, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='interview',
+            index=models.Index(fields=['question_set', 'completed', 'last_activity'], name='interview_progress_idx'),
+        ),
+    ]
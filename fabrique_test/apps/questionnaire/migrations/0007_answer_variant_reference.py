@@ -0,0 +1,78 @@
+# Generated by Django 2.2.10 on 2026-10-18 17:57
+
+from django.db import migrations, models, transaction
+from django.db.models import Max, OuterRef, Subquery
+import django.db.models.deletion
+
+CHUNK_SIZE = 10000
+
+CHOICE_TYPES = ['ONEVARIANT', 'MULTIVARIANT']
+
+
+def iter_chunks(Answer, alias):
+    """
+    Границы порций ответов по коду: (после, до включительно), каждая порция в своей транзакции
+    """
+    last_id = Answer.objects.using(alias).aggregate(Max('id'))['id__max'] or 0
+    for start in range(0, last_id, CHUNK_SIZE):
+        with transaction.atomic(using=alias):
+            yield start, start + CHUNK_SIZE
+
+def link_variants(apps, schema_editor):
+    """
+    Ответы на вопросы с выбором ссылаются на вариант с тем же текстом, а текст больше не хранят.
+    Ответы, для которых варианта уже нет (переименован или удалён), остаются текстовыми
+    """
+    Answer = apps.get_model('questionnaire', 'Answer')
+    AnswerVariant = apps.get_model('questionnaire', 'AnswerVariant')
+    alias = schema_editor.connection.alias
+    variant = AnswerVariant.objects.using(alias).filter(question_id=OuterRef('question_id'), \
+        answer_text=OuterRef('answer_text')).order_by('id').values('id')[:1]
+    for start, end in iter_chunks(Answer, alias):
+        answers = Answer.objects.using(alias).filter(id__gt=start, id__lte=end)
+        answers.filter(question__answer_type__in=CHOICE_TYPES).update(variant_id=Subquery(variant))
+        answers.filter(variant_id__isnull=False).update(answer_text=None)
+
+def unlink_variants(apps, schema_editor):
+    Answer = apps.get_model('questionnaire', 'Answer')
+    AnswerVariant = apps.get_model('questionnaire', 'AnswerVariant')
+    alias = schema_editor.connection.alias
+    text = AnswerVariant.objects.using(alias).filter(id=OuterRef('variant_id')).values('answer_text')[:1]
+    for start, end in iter_chunks(Answer, alias):
+        Answer.objects.using(alias).filter(id__gt=start, id__lte=end, variant_id__isnull=False)\
+            .update(answer_text=Subquery(text), variant_id=None)
+
+
+class Migration(migrations.Migration):
+    # Перенос ответов идёт отдельными транзакциями по порциям
+    atomic = False
+
+    dependencies = [
+        ('questionnaire', '0006_interview_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='variant',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='answers', to='questionnaire.AnswerVariant'),
+        ),
+        migrations.AlterField(
+            model_name='answer',
+            name='answer_text',
+            field=models.CharField(blank=True, max_length=50, null=True, verbose_name='текст ответа'),
+        ),
+        migrations.RunPython(link_variants, unlink_variants),
+        migrations.RemoveConstraint(
+            model_name='answer',
+            name='answer_unique_text',
+        ),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(condition=models.Q(variant__isnull=True), fields=('interview', 'question', 'answer_text'), name='answer_unique_text'),
+        ),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(fields=('interview', 'question', 'variant'), name='answer_unique_variant'),
+        ),
+    ]
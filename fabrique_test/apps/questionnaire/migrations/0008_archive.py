@@ -0,0 +1,49 @@
+# Generated by Django 2.2.10 on 2026-10-18 18:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('questionnaire', '0007_answer_variant_reference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedQuestionSet',
+            fields=[
+                ('question_set', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='questionnaire.QuestionSet')),
+                ('started', models.DateTimeField(default=django.utils.timezone.now, verbose_name='начало архивирования')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='окончание архивирования')),
+                ('interviews', models.IntegerField(default=0, verbose_name='интервью в архиве')),
+                ('answers', models.IntegerField(default=0, verbose_name='ответов в архиве')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedInterview',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('interviewee_id', models.IntegerField(blank=True, default=None, null=True, verbose_name='код пользователя')),
+                ('start_date', models.DateTimeField(verbose_name='дата опроса')),
+                ('answered_questions', models.IntegerField(default=0, verbose_name='отвеченных вопросов')),
+                ('completed', models.BooleanField(default=False, verbose_name='завершено')),
+                ('last_activity', models.DateTimeField(verbose_name='последняя активность')),
+                ('answers', models.TextField(verbose_name='ответы в JSON')),
+                ('loggedin_user', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('question_set', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='questionnaire.QuestionSet')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedinterview',
+            index=models.Index(fields=['interviewee_id', 'id'], name='archived_interviewee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedinterview',
+            index=models.Index(fields=['loggedin_user', 'id'], name='archived_user_idx'),
+        ),
+    ]
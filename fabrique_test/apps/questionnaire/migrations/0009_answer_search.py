@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.db import migrations, transaction
+from django.db.models import Max
+
+CHUNK_SIZE = 10000
+
+SEARCH_CONFIG = getattr(settings, 'QUESTIONNAIRE_SEARCH_CONFIG', 'russian')
+
+# Индексируются ответы без ссылки на вариант: текстовые ответы и тексты удалённых вариантов
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE questionnaire_answer_fts USING fts5(answer_text, content='questionnaire_answer', "
+    "content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER questionnaire_answer_fts_insert AFTER INSERT ON questionnaire_answer "
+    "WHEN new.variant_id IS NULL AND new.answer_text IS NOT NULL BEGIN "
+    "INSERT INTO questionnaire_answer_fts (rowid, answer_text) VALUES (new.id, new.answer_text); END",
+    "CREATE TRIGGER questionnaire_answer_fts_delete AFTER DELETE ON questionnaire_answer "
+    "WHEN old.variant_id IS NULL AND old.answer_text IS NOT NULL BEGIN "
+    "INSERT INTO questionnaire_answer_fts (questionnaire_answer_fts, rowid, answer_text) "
+    "VALUES ('delete', old.id, old.answer_text); END",
+    "CREATE TRIGGER questionnaire_answer_fts_update AFTER UPDATE OF answer_text, variant_id ON questionnaire_answer "
+    "BEGIN "
+    "INSERT INTO questionnaire_answer_fts (questionnaire_answer_fts, rowid, answer_text) "
+    "SELECT 'delete', old.id, old.answer_text WHERE old.variant_id IS NULL AND old.answer_text IS NOT NULL; "
+    "INSERT INTO questionnaire_answer_fts (rowid, answer_text) "
+    "SELECT new.id, new.answer_text WHERE new.variant_id IS NULL AND new.answer_text IS NOT NULL; END",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS questionnaire_answer_fts_insert",
+    "DROP TRIGGER IF EXISTS questionnaire_answer_fts_delete",
+    "DROP TRIGGER IF EXISTS questionnaire_answer_fts_update",
+    "DROP TABLE IF EXISTS questionnaire_answer_fts",
+]
+SQLITE_FILL = "INSERT INTO questionnaire_answer_fts (rowid, answer_text) SELECT id, answer_text " \
+    "FROM questionnaire_answer WHERE id > %s AND id <= %s AND variant_id IS NULL AND answer_text IS NOT NULL"
+
+# PostgreSQL поддерживает GIN-индекс по выражению сам, триггеры не нужны
+POSTGRESQL_CREATE = "CREATE INDEX answer_text_search_idx ON questionnaire_answer " \
+    "USING gin (to_tsvector('%s'::regconfig, answer_text)) WHERE variant_id IS NULL" % SEARCH_CONFIG
+POSTGRESQL_DROP = "DROP INDEX IF EXISTS answer_text_search_idx"
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Индекс полнотекстового поиска по ответам. Существующие ответы в SQLite индексируются порциями,
+    каждая в своей транзакции
+    """
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRESQL_CREATE)
+    elif connection.vendor == 'sqlite':
+        Answer = apps.get_model('questionnaire', 'Answer')
+        with transaction.atomic(using=connection.alias):
+            for statement in SQLITE_CREATE:
+                schema_editor.execute(statement)
+        last_id = Answer.objects.using(connection.alias).aggregate(Max('id'))['id__max'] or 0
+        for start in range(0, last_id, CHUNK_SIZE):
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(SQLITE_FILL, [start, start + CHUNK_SIZE])
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRESQL_DROP)
+    elif connection.vendor == 'sqlite':
+        for statement in SQLITE_DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+    # Индексация существующих ответов идёт отдельными транзакциями по порциям
+    atomic = False
+
+    dependencies = [
+        ('questionnaire', '0008_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
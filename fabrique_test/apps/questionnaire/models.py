@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.db.models.base import Model
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 class QuestionSet(models.Model):
     """
@@ -10,6 +13,11 @@ class QuestionSet(models.Model):
     description = models.TextField('описание', max_length=500)
     start_date = models.DateTimeField('дата старта')
     end_date = models.DateTimeField('дата окончания', null=True, blank=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_date', 'end_date'], name='questionset_start_end_idx'),
+            models.Index(fields=['end_date', 'start_date'], name='questionset_end_start_idx'),
+        ]
     def __str__(self):
         return self.title
 
@@ -48,18 +56,130 @@ class Interview(models.Model):
     Интервью, проводимое с конкретным интервьюируемым по конкретной анкете
     """
     question_set = models.ForeignKey(QuestionSet, on_delete=models.CASCADE)
-    loggedin_user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, blank=True, null=True)
+    # индекс по пользователю входит в составной индекс ниже
+    loggedin_user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, blank=True, null=True, \
+        db_index=False)
     interviewee_id = models.IntegerField('код пользователя', default=None, blank=True, null=True)
     start_date = models.DateTimeField('дата опроса')
+    # прогресс прохождения обновляется вместе с ответами
+    answered_questions = models.IntegerField('отвеченных вопросов', default=0)
+    completed = models.BooleanField('завершено', default=False)
+    last_activity = models.DateTimeField('последняя активность', default=timezone.now)
+    class Meta:
+        indexes = [
+            # интервью пользователя постранично по id
+            models.Index(fields=['interviewee_id', 'id'], name='interview_interviewee_idx'),
+            models.Index(fields=['loggedin_user', 'id'], name='interview_user_idx'),
+            # незавершённые интервью анкеты по давности активности
+            models.Index(fields=['question_set', 'completed', 'last_activity'], name='interview_progress_idx'),
+        ]
+
+class AnswerQuerySet(models.QuerySet):
+    def with_text(self):
+        """
+        Ответы с полем text: текст выбранного варианта или текстовый ответ
+        """
+        return self.annotate(text=Coalesce('variant__answer_text', 'answer_text'))
+
+    def detach_variants(self):
+        """
+        Переносит в ответы текст их вариантов и убирает ссылки, чтобы ответы пережили удаление вариантов
+        """
+        return self.filter(variant__isnull=False).update(variant=None, answer_text=Subquery(\
+            AnswerVariant.objects.filter(id=OuterRef('variant_id')).values('answer_text')[:1]))
 
 class Answer(models.Model):
     """
     Ответ на вопрос в конкретном интервью (может быть несколько на один вопрос)
     """
     RELATED_NAME='answers'
-    interview = models.ForeignKey(Interview, on_delete=models.CASCADE)
+    # индекс по интервью входит в составные ограничения ниже
+    interview = models.ForeignKey(Interview, on_delete=models.CASCADE, db_index=False)
     question = models.ForeignKey(Question, related_name=RELATED_NAME, on_delete=models.CASCADE)
-    # для единообразия по типам ответов сохраняем только текстовый ответ без ссылки на вариант
-    answer_text = models.CharField('текст ответа', max_length=50)
+    # ответ с выбором хранит ссылку на вариант, текстовый ответ - текст; при удалении варианта
+    # его текст переносится в ответ (см. AnswerQuerySet.detach_variants). Отдельного индекса по варианту
+    # нет: варианты удаляются редко, а он занимал бы место по строке на каждый ответ
+    variant = models.ForeignKey(AnswerVariant, related_name='answers', on_delete=models.SET_NULL, \
+        blank=True, null=True, db_index=False)
+    answer_text = models.CharField('текст ответа', max_length=50, blank=True, null=True)
+    objects = AnswerQuerySet.as_manager()
+    class Meta:
+        constraints = [
+            # индекс ограничения обслуживает и выборку ответов интервью на вопрос
+            models.UniqueConstraint(fields=['interview', 'question', 'variant'], name='answer_unique_variant'),
+            models.UniqueConstraint(fields=['interview', 'question', 'answer_text'], \
+                condition=models.Q(variant__isnull=True), name='answer_unique_text'),
+        ]
     def __str__(self):
-        return self.answer_text
\ No newline at end of file
+        return self.variant.answer_text if self.variant_id is not None else self.answer_text
+
+class PendingAnswer(models.Model):
+    """
+    Ответы на вопрос, принятые в режиме отложенной записи и ещё не перенесённые в Answer
+    """
+    interview = models.ForeignKey(Interview, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    answers = models.TextField('ответы в JSON')
+    created = models.DateTimeField('дата приёма', auto_now_add=True)
+
+class QuestionResult(models.Model):
+    """
+    Накопленные итоги ответов на вопрос: количество интервью, в которых на него ответили
+    """
+    question = models.OneToOneField(Question, primary_key=True, related_name='result', on_delete=models.CASCADE)
+    respondents = models.IntegerField('ответивших интервью', default=0)
+
+class AnswerVariantResult(models.Model):
+    """
+    Накопленные итоги ответов на вопрос: количество выборов варианта ответа
+    """
+    variant = models.OneToOneField(AnswerVariant, primary_key=True, related_name='result', \
+        on_delete=models.CASCADE)
+    answers = models.IntegerField('выборов варианта', default=0)
+
+class CompletionResult(models.Model):
+    """
+    Накопленные итоги прохождения анкеты: количество интервью с заданным числом отвеченных вопросов
+    """
+    question_set = models.ForeignKey(QuestionSet, related_name='completion_results', on_delete=models.CASCADE)
+    answered_questions = models.IntegerField('отвеченных вопросов')
+    interviews = models.IntegerField('интервью', default=0)
+    class Meta:
+        unique_together = ('question_set', 'answered_questions')
+
+class ArchivedQuestionSet(models.Model):
+    """
+    Отметка об архивировании прошедшей анкеты: её интервью с ответами перенесены в ArchivedInterview,
+    а в основной базе остались анкета, вопросы и накопленные итоги
+    """
+    question_set = models.OneToOneField(QuestionSet, primary_key=True, related_name='archive', \
+        on_delete=models.CASCADE)
+    started = models.DateTimeField('начало архивирования', default=timezone.now)
+    finished = models.DateTimeField('окончание архивирования', blank=True, null=True)
+    interviews = models.IntegerField('интервью в архиве', default=0)
+    answers = models.IntegerField('ответов в архиве', default=0)
+
+class ArchivedInterview(models.Model):
+    """
+    Интервью прошедшей анкеты в архиве: одна строка вместе с ответами
+
+    Может храниться в отдельной базе (QUESTIONNAIRE_ARCHIVE_DATABASE), поэтому ссылки на анкету
+    и пользователя - без ограничений внешнего ключа. Код интервью сохраняется прежним
+    """
+    id = models.IntegerField(primary_key=True)
+    question_set = models.ForeignKey(QuestionSet, related_name='+', on_delete=models.DO_NOTHING, \
+        db_constraint=False)
+    loggedin_user = models.ForeignKey(get_user_model(), related_name='+', on_delete=models.DO_NOTHING, \
+        db_constraint=False, blank=True, null=True, db_index=False)
+    interviewee_id = models.IntegerField('код пользователя', default=None, blank=True, null=True)
+    start_date = models.DateTimeField('дата опроса')
+    answered_questions = models.IntegerField('отвеченных вопросов', default=0)
+    completed = models.BooleanField('завершено', default=False)
+    last_activity = models.DateTimeField('последняя активность')
+    # {код вопроса: [тексты ответов]}
+    answers = models.TextField('ответы в JSON')
+    class Meta:
+        indexes = [
+            models.Index(fields=['interviewee_id', 'id'], name='archived_interviewee_idx'),
+            models.Index(fields=['loggedin_user', 'id'], name='archived_user_idx'),
+        ]
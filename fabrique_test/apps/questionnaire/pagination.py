@@ -0,0 +1,107 @@
+import heapq
+from collections import OrderedDict
+from itertools import islice
+from django.conf import settings
+from rest_framework import pagination, serializers
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Постраничный вывод по ключу: следующая страница начинается после последнего ключа предыдущей,
+    поэтому время выборки страницы не зависит от её номера
+
+    Работает как с QuerySet, так и с уже упорядоченным по ключу списком словарей.
+    Параметры запроса: after - ключ, после которого начинается страница, page_size - размер страницы
+    """
+    ordering_field = 'id'
+    page_size = getattr(settings, 'QUESTIONNAIRE_PAGE_SIZE', 100)
+    max_page_size = getattr(settings, 'QUESTIONNAIRE_MAX_PAGE_SIZE', 1000)
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'after'
+
+    def get_int_param(self, request, name, default):
+        value = request.query_params.get(name)
+        if value is None or value == '':
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise serializers.ValidationError({name: ["Ожидается целое число."]})
+
+    def get_key(self, item):
+        return item[self.ordering_field] if isinstance(item, dict) else getattr(item, self.ordering_field)
+
+    def get_page_params(self, request):
+        self.request = request
+        page_size = min(max(self.get_int_param(request, self.page_size_query_param, self.page_size), 1), \
+            self.max_page_size)
+        return page_size, self.get_int_param(request, self.cursor_query_param, None)
+
+    def get_page(self, queryset, page_size, after):
+        if after is not None:
+            queryset = queryset.filter(**{self.ordering_field + '__gt': after})
+        return list(queryset.order_by(self.ordering_field)[:page_size + 1])
+
+    def finish_page(self, page, page_size):
+        self.next_key = self.get_key(page[page_size - 1]) if len(page) > page_size else None
+        return page[:page_size]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size, after = self.get_page_params(request)
+        if isinstance(queryset, list):
+            start = 0
+            if after is not None:
+                # Двоичный поиск первого элемента с ключом больше after
+                end = len(queryset)
+                while start < end:
+                    middle = (start + end) // 2
+                    if self.get_key(queryset[middle]) <= after:
+                        start = middle + 1
+                    else:
+                        end = middle
+            page = queryset[start:start + page_size + 1]
+        else:
+            page = self.get_page(queryset, page_size, after)
+        return self.finish_page(page, page_size)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        Общая страница нескольких QuerySet с непересекающимися ключами: из каждого читается не больше
+        страницы, и результаты сливаются по ключу
+        """
+        page_size, after = self.get_page_params(request)
+        pages = [self.get_page(queryset, page_size, after) for queryset in querysets]
+        page = list(islice(heapq.merge(*pages, key=self.get_key), page_size + 1))
+        return self.finish_page(page, page_size)
+
+    def get_next_link(self):
+        if self.next_key is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_key)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class OffsetPagination(KeysetPagination):
+    """
+    Постраничный вывод по смещению для списков без возрастающего ключа, например по релевантности.
+    Параметр offset - сколько элементов пропустить, ссылка next уже содержит нужное значение.
+    Общее количество не считается, поэтому стоимость страницы зависит только от выборки
+    """
+    cursor_query_param = 'offset'
+
+    def paginate_function(self, function, request, view=None):
+        """
+        function(limit, offset) возвращает список элементов
+        """
+        page_size, offset = self.get_page_params(request)
+        offset = max(offset or 0, 0)
+        page = function(page_size + 1, offset)
+        self.next_key = offset + page_size if len(page) > page_size else None
+        return page[:page_size]
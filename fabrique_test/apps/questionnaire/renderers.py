@@ -0,0 +1,38 @@
+"""
+Быстрый вывод JSON
+
+FastJSONRenderer кодирует ответ через orjson, если он установлен, иначе работает как JSONRenderer.
+Для строк, целых чисел, bool, None, списков и словарей вывод побайтно совпадает с JSONRenderer.
+Числа с плавающей точкой orjson пишет иначе (0.00001 вместо 1e-05), поэтому рендерер ставится
+только на представления без них.
+"""
+from rest_framework import renderers
+from rest_framework.settings import api_settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Отступы (в том числе для Browsable API) и настройки вывода DRF оставляем JSONRenderer
+        if orjson is None or data is None or self.ensure_ascii or not self.compact or \
+            self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, default=self.encoder_class().default, \
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Как и JSONRenderer, экранируем разделители строк, недопустимые в JavaScript
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def get_renderer_classes():
+    """
+    Рендереры по умолчанию из настроек DRF, где JSONRenderer заменён на FastJSONRenderer
+    """
+    return [FastJSONRenderer if renderer is renderers.JSONRenderer else renderer \
+        for renderer in api_settings.DEFAULT_RENDERER_CLASSES]
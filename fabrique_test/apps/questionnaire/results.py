@@ -0,0 +1,190 @@
+"""
+Итоги ответов по анкетам на накопительных счётчиках
+
+Счётчики обновляются в той же транзакции, что и ответы, поэтому чтение итогов анкеты стоит
+O(вопросов + вариантов) вне зависимости от количества ответов.
+"""
+from collections import Counter
+from django.db import connection, transaction
+from django.db.models import F
+from .models import Answer, AnswerVariant, AnswerVariantResult, CompletionResult, Interview, Question, \
+    QuestionResult
+
+
+def _apply_deltas(model, deltas, field, key_field='pk', **key_filter):
+    """
+    Прибавляет к полю field строк model изменения deltas {ключ: изменение}, создавая недостающие строки
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    increased = [key for key, delta in deltas.items() if delta > 0]
+    if increased:
+        model.objects.bulk_create([model(**dict(key_filter, **{key_field: key})) for key in increased], \
+            ignore_conflicts=True)
+    by_delta = {}
+    for key, delta in deltas.items():
+        by_delta.setdefault(delta, []).append(key)
+    for delta, keys in by_delta.items():
+        model.objects.filter(**dict(key_filter, **{key_field + '__in': keys}))\
+            .update(**{field: F(field) + delta})
+
+def register_interview_start(question_set_id):
+    """
+    Новое интервью попадает в воронку с нулём отвеченных вопросов
+    """
+    _apply_deltas(CompletionResult, {0: 1}, 'interviews', key_field='answered_questions', \
+        question_set_id=question_set_id)
+
+class ResultChanges:
+    """
+    Накопитель изменений счётчиков при замене ответов одного или нескольких интервью
+    """
+    def __init__(self):
+        self.respondents = Counter()
+        self.variants = Counter()
+        self.completion = {}
+
+    def add_answers_change(self, question_set_id, answered_before, old_answers, new_answers):
+        """
+        Замена ответов одного интервью анкеты question_set_id. Возвращает количество вопросов
+        интервью с ответами после замены
+
+        answered_before - количество вопросов интервью с ответами до замены
+        old_answers, new_answers - словари {код вопроса: список кодов выбранных вариантов} до и после
+        замены, текстовым ответам соответствует None
+        """
+        answered_after = answered_before
+        for question_id in set(old_answers) | set(new_answers):
+            respondents = bool(new_answers.get(question_id)) - bool(old_answers.get(question_id))
+            self.respondents[question_id] += respondents
+            answered_after += respondents
+            self.variants.update(variant_id for variant_id in new_answers.get(question_id, []) \
+                if variant_id is not None)
+            self.variants.subtract(variant_id for variant_id in old_answers.get(question_id, []) \
+                if variant_id is not None)
+        if answered_after != answered_before:
+            completion = self.completion.setdefault(question_set_id, Counter())
+            completion[answered_before] -= 1
+            completion[answered_after] += 1
+        return answered_after
+
+    def add_interview_removal(self, question_set_id, answered_before, old_answers):
+        """
+        Удаление интервью анкеты question_set_id вместе с ответами old_answers (как в add_answers_change):
+        ответы вычитаются из счётчиков, а интервью - из воронки
+        """
+        self.add_answers_change(question_set_id, answered_before, old_answers, {})
+        self.completion.setdefault(question_set_id, Counter())[0] -= 1
+
+    def save(self):
+        _apply_deltas(QuestionResult, self.respondents, 'respondents')
+        _apply_deltas(AnswerVariantResult, self.variants, 'answers')
+        for question_set_id, completion in self.completion.items():
+            _apply_deltas(CompletionResult, completion, 'interviews', key_field='answered_questions', \
+                question_set_id=question_set_id)
+
+def get_question_set_results(question_set):
+    """
+    Итоги анкеты: ответы по вариантам, доля ответивших на каждый вопрос и воронка прохождения
+    """
+    funnel = list(CompletionResult.objects.filter(question_set=question_set, interviews__gt=0)\
+        .order_by('answered_questions').values('answered_questions', 'interviews'))
+    interviews = sum(step['interviews'] for step in funnel)
+    questions = list(Question.objects.filter(question_set=question_set).order_by('id')\
+        .values('id', 'question_text', 'answer_type', 'result__respondents'))
+    variants = {}
+    for variant in AnswerVariant.objects.filter(question__question_set=question_set).order_by('id')\
+        .values('id', 'question_id', 'answer_text', 'result__answers'):
+        variants.setdefault(variant['question_id'], []).append({
+            'id': variant['id'],
+            'answer_text': variant['answer_text'],
+            'answers': variant['result__answers'] or 0,
+        })
+    question_results = []
+    for question in questions:
+        respondents = question['result__respondents'] or 0
+        question_results.append({
+            'id': question['id'],
+            'question_text': question['question_text'],
+            'answer_type': question['answer_type'],
+            'respondents': respondents,
+            'response_rate': respondents / interviews if interviews else 0,
+            'answer_variants': variants.get(question['id'], []),
+        })
+    # Сколько интервью дошло хотя бы до заданного числа отвеченных вопросов
+    reached = interviews
+    for step in funnel:
+        step['reached'] = reached
+        reached -= step['interviews']
+    return {
+        'question_set': question_set.id,
+        'interviews': interviews,
+        'completed': sum(step['interviews'] for step in funnel \
+            if questions and step['answered_questions'] >= len(questions)),
+        'questions': question_results,
+        'funnel': funnel,
+    }
+
+def _lock_answer_writes():
+    """
+    Останавливает запись интервью и ответов до конца транзакции. В SQLite блокировку записи базы
+    берёт первая запись транзакции, поэтому вызывающий сразу после этого пишет
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('LOCK TABLE %s, %s IN SHARE MODE' % (Interview._meta.db_table, Answer._meta.db_table))
+
+def rebuild_results(question_set, chunk_size=1000):
+    """
+    Пересчитывает счётчики итогов анкеты и прогресс её интервью по сохранённым ответам,
+    читая интервью порциями по коду
+
+    Пересчёт идёт в одной транзакции, которая на всё время держит блокировку записи интервью и ответов:
+    иначе ответы, записанные во время чтения, изменили бы старые строки счётчиков, а пересчёт заменил бы их
+    устаревшими итогами. Поэтому запись ответов (на всех анкетах) ждёт окончания пересчёта, и пересчитывать
+    лучше без нагрузки
+    """
+    with transaction.atomic():
+        _lock_answer_writes()
+        QuestionResult.objects.filter(question__question_set=question_set).delete()
+        AnswerVariantResult.objects.filter(variant__question__question_set=question_set).delete()
+        CompletionResult.objects.filter(question_set=question_set).delete()
+        variant_ids = list(AnswerVariant.objects.filter(question__question_set=question_set)\
+            .values_list('id', flat=True))
+        question_ids = list(Question.objects.filter(question_set=question_set).values_list('id', flat=True))
+        respondents = Counter()
+        variants = Counter()
+        funnel = Counter()
+        last_id = 0
+        while True:
+            progress = {interview_id: (answered_questions, completed) for interview_id, answered_questions, \
+                completed in Interview.objects.filter(question_set=question_set, id__gt=last_id).order_by('id')\
+                .values_list('id', 'answered_questions', 'completed')[:chunk_size]}
+            if not progress:
+                break
+            interview_ids = sorted(progress)
+            last_id = interview_ids[-1]
+            answered = {interview_id: set() for interview_id in interview_ids}
+            for interview_id, question_id, variant_id in Answer.objects.filter(interview_id__in=interview_ids)\
+                .values_list('interview_id', 'question_id', 'variant_id'):
+                answered[interview_id].add(question_id)
+                if variant_id is not None:
+                    variants[variant_id] += 1
+            changed = {}
+            for interview_id, questions in answered.items():
+                respondents.update(questions)
+                funnel[len(questions)] += 1
+                actual = (len(questions), len(questions) >= len(question_ids) > 0)
+                if progress[interview_id] != actual:
+                    changed.setdefault(actual, []).append(interview_id)
+            for (answered_questions, completed), ids in changed.items():
+                Interview.objects.filter(id__in=ids).update(answered_questions=answered_questions, \
+                    completed=completed)
+        QuestionResult.objects.bulk_create([QuestionResult(question_id=question_id, \
+            respondents=respondents[question_id]) for question_id in question_ids])
+        AnswerVariantResult.objects.bulk_create([AnswerVariantResult(variant_id=variant_id, \
+            answers=variants[variant_id]) for variant_id in variant_ids])
+        CompletionResult.objects.bulk_create([CompletionResult(question_set=question_set, \
+            answered_questions=answered_questions, interviews=interviews) \
+            for answered_questions, interviews in funnel.items()])
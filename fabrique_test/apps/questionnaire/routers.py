@@ -0,0 +1,83 @@
+"""
+Чтение с реплик, запись в основную базу
+
+Запросы на чтение уходят на случайную из реплик QUESTIONNAIRE_READ_REPLICAS, запись и чтение внутри
+транзакции основной базы - в основную базу. Реплика может отставать, поэтому в основную базу читают:
+- запросы с записью целиком (POST, PUT, PATCH, DELETE) и запросы клиента в течение
+  QUESTIONNAIRE_REPLICA_PIN_SECONDS после его записи (ReplicaPinningMiddleware, кука);
+- построение кэшей, которые сбрасываются при изменениях (снимки анкет, индекс активных анкет,
+  варианты ответов): иначе в кэш на долгое время попало бы состояние до изменения.
+
+Архив интервью прошедших анкет может жить в отдельной базе QUESTIONNAIRE_ARCHIVE_DATABASE (ArchiveRouter).
+"""
+import random
+import threading
+from contextlib import ContextDecorator
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_state = threading.local()
+
+
+def is_pinned():
+    return getattr(_state, 'depth', 0) > 0
+
+
+class use_primary(ContextDecorator):
+    """
+    Чтение из основной базы внутри блока или функции
+    """
+    def __enter__(self):
+        _state.depth = getattr(_state, 'depth', 0) + 1
+        return self
+
+    def __exit__(self, *exc):
+        _state.depth -= 1
+        return False
+
+
+class ReplicaRouter:
+    replicas = list(getattr(settings, 'QUESTIONNAIRE_READ_REPLICAS', []))
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        databases = {DEFAULT_DB_ALIAS} | set(self.replicas)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ArchiveRouter:
+    """
+    Архивные модели - в базе QUESTIONNAIRE_ARCHIVE_DATABASE, остальные модели в неё не попадают.
+    Если архив в основной базе, маршрутизацию оставляем ReplicaRouter
+    """
+    database = getattr(settings, 'QUESTIONNAIRE_ARCHIVE_DATABASE', DEFAULT_DB_ALIAS)
+    models = {'questionnaire.archivedinterview'}
+
+    def is_archive(self, model):
+        return model._meta.label_lower in self.models
+
+    def db_for_read(self, model, **hints):
+        if self.database != DEFAULT_DB_ALIAS and self.is_archive(model):
+            return self.database
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if self.database == DEFAULT_DB_ALIAS:
+            return None
+        if model_name is not None and '%s.%s' % (app_label, model_name) in self.models:
+            return db == self.database
+        if db == self.database:
+            return False
+        return None
@@ -0,0 +1,151 @@
+"""
+Полнотекстовый поиск по текстовым ответам
+
+Индексируются ответы без ссылки на вариант: текстовые ответы и тексты удалённых вариантов. В SQLite индекс -
+виртуальная таблица FTS5 questionnaire_answer_fts с содержимым из таблицы ответов, её обновляют триггеры
+на таблице ответов в той же транзакции, что и запись ответов. В PostgreSQL - GIN-индекс по
+to_tsvector(answer_text). Поэтому индекс актуален при любой записи ответов: регистрация, разбор очереди,
+перенос в архив, удаление вариантов. Индекс создаёт миграция 0009_answer_search.
+
+SQLite перестраивает таблицу при большинстве изменений её полей в миграциях и при этом удаляет её триггеры,
+поэтому после каждого migrate (сигнал post_migrate) отсутствующие триггеры создаются заново, а индекс
+пересобирается.
+
+Запрос - слова через пробел, ищутся ответы со всеми словами; слово со звёздочкой на конце ищется как начало
+слова: "удобн*" найдёт "удобно" и "удобный".
+"""
+import re
+from collections import OrderedDict
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import Max
+from .models import Answer, Question
+
+# Конфигурация текстового поиска PostgreSQL, должна совпадать с конфигурацией индекса из миграции
+SEARCH_CONFIG = getattr(settings, 'QUESTIONNAIRE_SEARCH_CONFIG', 'russian')
+
+FTS_TABLE = 'questionnaire_answer_fts'
+
+HIT_FIELDS = ('id', 'interview_id', 'question_id', 'question_set_id', 'answer_text', 'score')
+
+SQLITE_SEARCH = "SELECT a.id, a.interview_id, a.question_id, q.question_set_id, a.answer_text, " \
+    "-bm25({fts}) AS score FROM {fts} JOIN {answer} a ON a.id = {fts}.rowid JOIN {question} q ON q.id = a.question_id " \
+    "WHERE {fts} MATCH %s{filters} ORDER BY score DESC, a.id LIMIT %s OFFSET %s"
+
+POSTGRESQL_SEARCH = "SELECT a.id, a.interview_id, a.question_id, q.question_set_id, a.answer_text, " \
+    "ts_rank(to_tsvector('{config}'::regconfig, a.answer_text), query) AS score " \
+    "FROM {answer} a JOIN {question} q ON q.id = a.question_id, to_tsquery('{config}'::regconfig, %s) query " \
+    "WHERE a.variant_id IS NULL AND to_tsvector('{config}'::regconfig, a.answer_text) @@ query{filters} " \
+    "ORDER BY score DESC, a.id LIMIT %s OFFSET %s"
+
+# Индексируются ответы без ссылки на вариант: текстовые ответы и тексты удалённых вариантов
+SQLITE_TRIGGERS = OrderedDict([
+    ('questionnaire_answer_fts_insert', "CREATE TRIGGER IF NOT EXISTS questionnaire_answer_fts_insert "
+        "AFTER INSERT ON {answer} WHEN new.variant_id IS NULL AND new.answer_text IS NOT NULL BEGIN "
+        "INSERT INTO {fts} (rowid, answer_text) VALUES (new.id, new.answer_text); END"),
+    ('questionnaire_answer_fts_delete', "CREATE TRIGGER IF NOT EXISTS questionnaire_answer_fts_delete "
+        "AFTER DELETE ON {answer} WHEN old.variant_id IS NULL AND old.answer_text IS NOT NULL BEGIN "
+        "INSERT INTO {fts} ({fts}, rowid, answer_text) VALUES ('delete', old.id, old.answer_text); END"),
+    ('questionnaire_answer_fts_update', "CREATE TRIGGER IF NOT EXISTS questionnaire_answer_fts_update "
+        "AFTER UPDATE OF answer_text, variant_id ON {answer} BEGIN "
+        "INSERT INTO {fts} ({fts}, rowid, answer_text) "
+        "SELECT 'delete', old.id, old.answer_text WHERE old.variant_id IS NULL AND old.answer_text IS NOT NULL; "
+        "INSERT INTO {fts} (rowid, answer_text) "
+        "SELECT new.id, new.answer_text WHERE new.variant_id IS NULL AND new.answer_text IS NOT NULL; END"),
+])
+
+SQLITE_FILL = "INSERT INTO {fts} (rowid, answer_text) SELECT id, answer_text FROM {answer} " \
+    "WHERE id > %s AND id <= %s AND variant_id IS NULL AND answer_text IS NOT NULL"
+
+
+def parse_query(query):
+    """
+    Слова запроса: [(слово, поиск по началу слова)]
+    """
+    return [(word, bool(prefix)) for word, prefix in re.findall(r'(\w+)(\*?)', query)]
+
+def build_sqlite_query(words):
+    return ' '.join('"%s"%s' % (word, '*' if prefix else '') for word, prefix in words)
+
+def build_postgresql_query(words):
+    return ' & '.join('%s%s' % (word, ':*' if prefix else '') for word, prefix in words)
+
+def search_answers(query, question_set_id=None, question_id=None, limit=100, offset=0):
+    """
+    Ответы, содержащие все слова запроса, по убыванию релевантности (score): список словарей HIT_FIELDS
+    """
+    words = parse_query(query)
+    if not words:
+        return []
+    connection = connections[router.db_for_read(Answer)]
+    if connection.vendor == 'sqlite':
+        sql, search_query = SQLITE_SEARCH, build_sqlite_query(words)
+    elif connection.vendor == 'postgresql':
+        sql, search_query = POSTGRESQL_SEARCH, build_postgresql_query(words)
+    else:
+        raise NotImplementedError('Полнотекстовый поиск поддерживается только для SQLite и PostgreSQL')
+    filters = ''
+    params = [search_query]
+    if question_set_id is not None:
+        filters += ' AND q.question_set_id = %s'
+        params.append(question_set_id)
+    if question_id is not None:
+        filters += ' AND a.question_id = %s'
+        params.append(question_id)
+    sql = sql.format(fts=FTS_TABLE, answer=Answer._meta.db_table, question=Question._meta.db_table, \
+        config=SEARCH_CONFIG, filters=filters)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit, offset])
+        return [dict(zip(HIT_FIELDS, row)) for row in cursor.fetchall()]
+
+def iter_rebuild_index(chunk_size=10000, using=DEFAULT_DB_ALIAS):
+    """
+    Пересобирает индекс SQLite порциями ответов по коду, каждая порция в своей транзакции.
+    Возвращает генератор кодов последнего проиндексированного ответа по порциям.
+
+    Ответы, изменённые во время пересборки, могут попасть в индекс дважды, поэтому пересобирать
+    индекс лучше без нагрузки - после восстановления базы или массовой загрузки в обход триггеров
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        # GIN-индекс поддерживает сам PostgreSQL, пересобирается он целиком
+        with connection.cursor() as cursor:
+            cursor.execute('REINDEX INDEX answer_text_search_idx')
+        return
+    if connection.vendor != 'sqlite':
+        raise NotImplementedError('Полнотекстовый поиск поддерживается только для SQLite и PostgreSQL')
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute("INSERT INTO {fts} ({fts}) VALUES ('delete-all')".format(fts=FTS_TABLE))
+    last_id = Answer.objects.using(using).aggregate(Max('id'))['id__max'] or 0
+    sql = SQLITE_FILL.format(fts=FTS_TABLE, answer=Answer._meta.db_table)
+    for start in range(0, last_id, chunk_size):
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(sql, [start, start + chunk_size])
+        yield min(start + chunk_size, last_id)
+
+def restore_sqlite_triggers(using=DEFAULT_DB_ALIAS):
+    """
+    Создаёт отсутствующие триггеры индекса SQLite и пересобирает индекс: ответы, записанные без триггеров,
+    в нём устарели. Возвращает True, если триггеры пришлось создавать. До миграции 0009 ничего не делает
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE name = %s OR (type = 'trigger' AND tbl_name = %s)", \
+            [FTS_TABLE, Answer._meta.db_table])
+        names = {row[0] for row in cursor.fetchall()}
+    if FTS_TABLE not in names or names.issuperset(SQLITE_TRIGGERS):
+        return False
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for sql in SQLITE_TRIGGERS.values():
+            cursor.execute(sql.format(fts=FTS_TABLE, answer=Answer._meta.db_table))
+    for _ in iter_rebuild_index(using=using):
+        pass
+    return True
+
+def restore_index_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Обработчик post_migrate: восстанавливает триггеры, удалённые перестройкой таблицы ответов
+    """
+    restore_sqlite_triggers(using)
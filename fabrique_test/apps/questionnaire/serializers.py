@@ -1,8 +1,12 @@
+import json
+from collections import OrderedDict
 from datetime import date, datetime
 from rest_framework import serializers
 from rest_framework.relations import SlugRelatedField
 from .models import Answer, Interview, QuestionSet, Question, AnswerVariant
 from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import F, Prefetch
 
 class QuestionSetSerializer(serializers.ModelSerializer):
     """
@@ -64,28 +68,88 @@ class QuestionWithAnswerVariantsSerializer(serializers.ModelSerializer):
         answer_variants = validated_data.pop(AnswerVariant.RELATED_NAME, [])
         for key, value in validated_data.items():
             setattr(instance, key, value)
-        instance.save()
-        # Редактируем варианты ответов, если нужно
-        if edit_answer_variants:
-            instance.answer_variants.all().delete()
-            answer_variants_array=[AnswerVariant(question=instance, answer_text=text) \
-                for text in answer_variants]
-            AnswerVariant.objects.bulk_create(answer_variants_array)
+        with transaction.atomic():
+            instance.save()
+            # Редактируем варианты ответов, если нужно: удаляем исчезнувшие и добавляем новые,
+            # не трогая сохранившиеся
+            if edit_answer_variants:
+                answer_variants = list(OrderedDict.fromkeys(answer_variants))
+                existing = {}
+                removed = []
+                for variant_id, text in instance.answer_variants.order_by('id').values_list('id', 'answer_text'):
+                    if text in existing or text not in answer_variants:
+                        removed.append(variant_id)
+                    else:
+                        existing[text] = variant_id
+                if removed:
+                    # Ответы с удаляемыми вариантами сохраняются как текстовые
+                    Answer.objects.filter(variant_id__in=removed).detach_variants()
+                    AnswerVariant.objects.filter(id__in=removed).delete()
+                AnswerVariant.objects.bulk_create([AnswerVariant(question=instance, answer_text=text) \
+                    for text in answer_variants if text not in existing])
+        return instance
+
+    def validate_answer_variants(self, value):
+        for text in value:
+            if not isinstance(text, str) or not text or \
+                len(text) > AnswerVariant._meta.get_field('answer_text').max_length:
+                raise serializers.ValidationError(
+                    "Вариант ответа должен быть непустой строкой не длиннее %d символов." % \
+                        AnswerVariant._meta.get_field('answer_text').max_length
+                )
+        return value
+
+class QuestionDocumentSerializer(QuestionWithAnswerVariantsSerializer):
+    """
+    Сериализатор вопроса в составе документа анкеты
+    """
+    class Meta(QuestionWithAnswerVariantsSerializer.Meta):
+        fields = ['id', 'question_text', 'answer_type', AnswerVariant.RELATED_NAME]
+
+class QuestionSetDocumentSerializer(QuestionSetSerializer):
+    """
+    Сериализатор анкеты целиком: с вопросами и вариантами ответов для пакетного импорта
+    """
+    questions = QuestionDocumentSerializer(many=True)
+    class Meta(QuestionSetSerializer.Meta):
+        fields = QuestionSetSerializer.Meta.fields + [Question.RELATED_NAME]
+
+    def create(self, validated_data):
+        """
+        Создаём анкету, все её вопросы и все варианты ответов тремя вставками в одной транзакции
+        """
+        questions = validated_data.pop(Question.RELATED_NAME)
+        with transaction.atomic():
+            instance = QuestionSet.objects.create(**validated_data)
+            Question.objects.bulk_create([Question(question_set=instance, question_text=question['question_text'], \
+                answer_type=question['answer_type']) for question in questions])
+            # bulk_create возвращает коды строк не на всех СУБД, поэтому перечитываем их по порядку вставки
+            question_ids = Question.objects.filter(question_set=instance).order_by('id').values_list('id', flat=True)
+            AnswerVariant.objects.bulk_create([AnswerVariant(question_id=question_id, answer_text=text) \
+                for question_id, question in zip(question_ids, questions) \
+                for text in OrderedDict.fromkeys(question.get(AnswerVariant.RELATED_NAME, []))])
         return instance
 
 class FilteredUserAnswerListSerializer(serializers.ListSerializer):
     """
     Сериализатор списка сериализатора FilteredUserAnswerSerializer
     """
+    ANSWERS_CONTEXT_KEY = 'interview_answers_by_question'
     def to_representation(self, data):
-        # Здесь как-то надо отсеить результат, чтобы он ограничивался interview_id из
-        # InterviewQuestionsWithAnswersSerializer, но я пока не разобрался как
+        # Ограничиваем ответы вопроса ответами текущего интервью, которые заранее
+        # разложены по вопросам в InterviewQuestionsWithAnswersSerializer
+        answers_by_question = self.context.get(self.ANSWERS_CONTEXT_KEY)
+        if answers_by_question is not None:
+            data = answers_by_question.get(data.instance.id, [])
         return super(FilteredUserAnswerListSerializer, self).to_representation(data)
 
 class FilteredUserAnswerSerializer(serializers.ModelSerializer):
     """
     Сериализатор фильтрованных ответов пользователя для вывода в списке интервью для пользователя
+
+    Ожидает ответы из Answer.objects.with_text()
     """
+    answer_text = serializers.CharField(source='text')
     class Meta:
         list_serializer_class = FilteredUserAnswerListSerializer
         model = Answer
@@ -100,8 +164,6 @@ class UserQuestionSerializer(serializers.ModelSerializer):
         model = Question
         fields = ['id', 'question_text', 'answer_type', Answer.RELATED_NAME]
         read_only_fields = ['id']
-    def to_representation(self, instance):
-        return super().to_representation(instance)
 
 class UserQuestionSetSerializer(serializers.ModelSerializer):
     """
@@ -113,14 +175,106 @@ class UserQuestionSetSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'description', 'start_date', 'end_date', Question.RELATED_NAME]
 
 class InterviewQuestionsWithAnswersSerializer(serializers.ModelSerializer):
-    question_set = UserQuestionSetSerializer()
     """
     Сериализатор вывода интервью с вопросами и ответами пользователя
+
+    Ожидает интервью из get_queryset(), где ответы интервью заранее загружены в prefetched_answers
     """
+    question_set = UserQuestionSetSerializer()
     class Meta:
         model = Interview
         fields = ['id', 'start_date', 'question_set']
+
+    @staticmethod
+    def get_queryset(interviews):
+        """
+        Загрузка интервью с анкетами, вопросами и ответами только этих интервью за три запроса
+        """
+        return interviews.select_related('question_set').prefetch_related(
+            Prefetch('question_set__' + Question.RELATED_NAME, queryset=Question.objects.order_by('id')),
+            Prefetch('answer_set', queryset=Answer.objects.with_text().order_by('id'), \
+                to_attr='prefetched_answers'),
+        ).order_by('id')
+
+    def to_representation(self, instance):
+        answers_by_question = {}
+        for answer in instance.prefetched_answers:
+            answers_by_question.setdefault(answer.question_id, []).append(answer)
+        self.context[FilteredUserAnswerListSerializer.ANSWERS_CONTEXT_KEY] = answers_by_question
+        return super().to_representation(instance)
     
+class InterviewQuestionsWithAnswersValues:
+    """
+    Быстрый вывод интервью с вопросами и ответами пользователя
+
+    Результат тот же, что у InterviewQuestionsWithAnswersSerializer(many=True), но словари строятся
+    прямо из .values() без экземпляров моделей и обхода полей сериализаторов. Три запроса: интервью
+    с анкетами, вопросы анкет и ответы интервью. Архивные интервью приносят ответы с собой,
+    а их анкеты читаются ещё одним запросом
+    """
+    FIELDS = ('id', 'start_date', 'question_set_id', 'question_set__title', 'question_set__description', \
+        'question_set__start_date', 'question_set__end_date')
+    QUESTION_SET_FIELDS = ('title', 'description', 'start_date', 'end_date')
+    datetime_field = serializers.DateTimeField()
+
+    @classmethod
+    def get_queryset(cls, interviews):
+        return interviews.values(*cls.FIELDS).order_by('id')
+
+    @classmethod
+    def get_archived_queryset(cls, archived_interviews):
+        return archived_interviews.values('id', 'start_date', 'question_set_id', archived_answers=F('answers'))\
+            .order_by('id')
+
+    @classmethod
+    def to_representation(cls, interviews):
+        """
+        interviews - список словарей из get_queryset() и get_archived_queryset()
+        """
+        if not interviews:
+            return []
+        format_datetime = cls.datetime_field.to_representation
+        archived_question_set_ids = {interview['question_set_id'] for interview in interviews \
+            if 'archived_answers' in interview}
+        if archived_question_set_ids:
+            question_sets = {question_set['id']: question_set for question_set in QuestionSet.objects.filter(\
+                id__in=archived_question_set_ids).values('id', *cls.QUESTION_SET_FIELDS)}
+            interviews = [interview if 'archived_answers' not in interview else dict(interview, **{ \
+                'question_set__' + field: question_sets.get(interview['question_set_id'], {}).get(field) \
+                for field in cls.QUESTION_SET_FIELDS}) for interview in interviews]
+        questions = {}
+        for question in Question.objects.filter(question_set_id__in={interview['question_set_id'] \
+            for interview in interviews}).order_by('id').values('id', 'question_set_id', 'question_text', \
+            'answer_type'):
+            questions.setdefault(question['question_set_id'], []).append(question)
+        answers = {}
+        for interview in interviews:
+            if 'archived_answers' in interview:
+                for question_id, texts in json.loads(interview['archived_answers']).items():
+                    answers[(interview['id'], int(question_id))] = [{'answer_text': text} for text in texts]
+        live_interview_ids = [interview['id'] for interview in interviews if 'archived_answers' not in interview]
+        if live_interview_ids:
+            for interview_id, question_id, answer_text in Answer.objects.with_text().filter(interview_id__in=\
+                live_interview_ids).order_by('id').values_list('interview_id', 'question_id', 'text'):
+                answers.setdefault((interview_id, question_id), []).append({'answer_text': answer_text})
+        return [{
+            'id': interview['id'],
+            'start_date': format_datetime(interview['start_date']),
+            'question_set': {
+                'id': interview['question_set_id'],
+                'title': interview['question_set__title'],
+                'description': interview['question_set__description'],
+                'start_date': format_datetime(interview['question_set__start_date']),
+                'end_date': format_datetime(interview['question_set__end_date']),
+                Question.RELATED_NAME: [{
+                    'id': question['id'],
+                    'question_text': question['question_text'],
+                    'answer_type': question['answer_type'],
+                    Answer.RELATED_NAME: answers.get((interview['id'], question['id']), []),
+                } for question in questions.get(interview['question_set_id'], [])],
+            },
+        } for interview in interviews]
+
 class InterviewSerializer(serializers.ModelSerializer):
     """
     Сериализатор интервью
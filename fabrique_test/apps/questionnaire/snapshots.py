@@ -0,0 +1,73 @@
+"""
+Готовые JSON-снимки вопросов анкет для прохождения опроса
+
+Снимок строится один раз на версию анкеты и хранится в кэше Django. Версия анкеты меняется
+при каждом изменении анкеты или её вопросов администратором, после чего старые снимки больше
+не читаются и вытесняются кэшем по таймауту.
+"""
+import hashlib
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+from .active import invalidate_active_question_sets
+from .models import AnswerVariant, Question
+from .serializers import QuestionWithAnswerVariantsSerializer
+from .routers import use_primary
+from .validators import invalidate_answer_variants
+
+VERSION_KEY = 'questionnaire:question_set_version:%s'
+SNAPSHOT_KEY = 'questionnaire:question_set_snapshot:%s:%s'
+
+SNAPSHOT_TIMEOUT = getattr(settings, 'QUESTIONNAIRE_SNAPSHOT_TIMEOUT', 24 * 60 * 60)
+
+
+def get_question_set_version(question_set_id):
+    """
+    Текущая версия анкеты. Если версии в кэше нет, заводим новую
+    """
+    key = VERSION_KEY % question_set_id
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+def invalidate_question_set(question_set_id):
+    """
+    Смена версии анкеты, после которой снимок будет построен заново
+    """
+    cache.set(VERSION_KEY % question_set_id, uuid.uuid4().hex, None)
+
+def invalidate_question_sets(question_set_ids, question_ids=()):
+    """
+    Сброс закэшированных данных анкет после их изменения: снимков вопросов (и правил ответов, которые
+    хранятся под той же версией), списка активных анкет и вариантов ответов вопросов question_ids
+    """
+    for question_set_id in set(question_set_ids):
+        invalidate_question_set(question_set_id)
+    invalidate_active_question_sets()
+    if question_ids:
+        invalidate_answer_variants(question_ids)
+
+@use_primary()
+def build_snapshot(question_set_id):
+    """
+    Сериализация вопросов анкеты так же, как это делает API. Возвращает (содержимое, ETag)
+    """
+    questions = Question.objects.filter(question_set=question_set_id).order_by('id')\
+        .prefetch_related(AnswerVariant.RELATED_NAME)
+    serializer = QuestionWithAnswerVariantsSerializer(questions, many=True)
+    content = JSONRenderer().render(serializer.data)
+    return content, '"%s"' % hashlib.md5(content).hexdigest()
+
+def get_question_set_snapshot(question_set_id):
+    """
+    Снимок вопросов анкеты из кэша. Возвращает (содержимое, ETag)
+    """
+    key = SNAPSHOT_KEY % (question_set_id, get_question_set_version(question_set_id))
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_snapshot(question_set_id)
+        cache.set(key, snapshot, SNAPSHOT_TIMEOUT)
+    return snapshot
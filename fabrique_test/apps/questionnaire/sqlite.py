@@ -0,0 +1,56 @@
+"""
+Работа на SQLite под нагрузкой
+
+При открытии соединения включаются журнал WAL (чтение не блокирует запись), synchronous=NORMAL
+и отображение файла базы в память. Запись в SQLite всё равно идёт по одной транзакции за раз:
+ожидание блокировки ограничено параметром timeout в OPTIONS базы, а короткие транзакции записи
+ответов и старта интервью при ошибке "database is locked" повторяются целиком.
+"""
+import random
+import time
+from collections import OrderedDict
+from functools import wraps
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+PRAGMAS = getattr(settings, 'QUESTIONNAIRE_SQLITE_PRAGMAS', OrderedDict([
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+]))
+
+# Сколько раз выполнять транзакцию при блокировке базы и пауза перед первым повтором, секунды
+LOCK_ATTEMPTS = getattr(settings, 'QUESTIONNAIRE_LOCK_ATTEMPTS', 5)
+LOCK_RETRY_DELAY = getattr(settings, 'QUESTIONNAIRE_LOCK_RETRY_DELAY', 0.05)
+
+
+def configure_connection(sender, connection, **kwargs):
+    """
+    Обработчик сигнала connection_created
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in PRAGMAS.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+def is_locked_error(error):
+    return 'database is locked' in str(error) or 'database table is locked' in str(error)
+
+def retry_on_lock(function):
+    """
+    Выполняет функцию в транзакции и повторяет её, если база заблокирована другим процессом.
+    Внутри внешней транзакции повторять нельзя, поэтому там ошибка передаётся выше
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        for attempt in range(LOCK_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return function(*args, **kwargs)
+            except OperationalError as e:
+                if attempt + 1 >= LOCK_ATTEMPTS or connection.in_atomic_block or not is_locked_error(e):
+                    raise
+            # Случайная добавка к паузе разводит одновременно повторяющих процессы
+            time.sleep(LOCK_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
@@ -1,3 +1,1196 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connection, models
+from django.db.models import Max
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from unittest import skipUnless
+from unittest.mock import patch
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from .active import invalidate_active_question_sets
+from . import analytics
+from .analytics import AnswerColumns, BitMasks, NumpyMasks
+from .answers import _delete_interviews
+from .archive import archive_question_set
+from . import search
+from .asgi import WsgiToAsgi, build_environ
+from .metrics import registry
+from .middleware import AdmissionControlMiddleware, QueryTimingMiddleware, ReplicaPinningMiddleware
+from .routers import ReplicaRouter, use_primary
+from .sqlite import retry_on_lock
+from .validators import validate_answers
+from .models import Answer, AnswerVariant, ArchivedInterview, ArchivedQuestionSet, Interview, Question, \
+    QuestionSet
+from .renderers import FastJSONRenderer, orjson
+from .results import get_question_set_results, rebuild_results
+from .serializers import InterviewQuestionsWithAnswersSerializer, InterviewQuestionsWithAnswersValues
 
-# Create your tests here.
+
+class UserInterviewsViewTest(TestCase):
+    """
+    Вывод интервью пользователя с ответами
+    """
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.question_sets = []
+        for number in range(3):
+            question_set = QuestionSet.objects.create(title='Анкета %d' % number, \
+                description='описание', start_date=now - timedelta(days=1))
+            for question_number in range(3):
+                question = Question.objects.create(question_set=question_set, \
+                    question_text='Вопрос %d' % question_number, answer_type=Question.AnswerType.ONEVARIANT)
+                AnswerVariant.objects.bulk_create([AnswerVariant(question=question, answer_text=text) \
+                    for text in ('да', 'нет')])
+            self.question_sets.append(question_set)
+
+    def create_interview(self, question_set, interviewee_id, answer_text):
+        interview = Interview.objects.create(question_set=question_set, interviewee_id=interviewee_id, \
+            start_date=timezone.now())
+        # ответы с выбором хранятся ссылкой на вариант
+        Answer.objects.bulk_create([Answer(interview=interview, question=question, \
+            variant=question.answer_variants.get(answer_text=answer_text)) for question in question_set.questions.all()])
+        return interview
+
+    def test_only_own_interview_answers(self):
+        self.create_interview(self.question_sets[0], 1, 'да')
+        self.create_interview(self.question_sets[0], 2, 'нет')
+        response = self.client.get('/api/user_interviews/1/')
+        self.assertEqual(response.status_code, 200)
+        interviews = response.json()['results']
+        self.assertEqual(len(interviews), 1)
+        for question in interviews[0]['question_set']['questions']:
+            self.assertEqual(question['answers'], [{'answer_text': 'да'}])
+
+    def test_constant_number_of_queries(self):
+        for question_set in self.question_sets:
+            self.create_interview(question_set, 1, 'да')
+        # интервью с анкетами, архивные интервью, вопросы, ответы
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/user_interviews/1/')
+        self.assertEqual(len(response.json()['results']), 3)
+
+    def test_keyset_pages(self):
+        interview_ids = [self.create_interview(question_set, 1, 'да').id for question_set in self.question_sets]
+        response = self.client.get('/api/user_interviews/1/', {'page_size': 2}).json()
+        self.assertEqual([interview['id'] for interview in response['results']], interview_ids[:2])
+        response = self.client.get(response['next']).json()
+        self.assertEqual([interview['id'] for interview in response['results']], interview_ids[2:])
+        self.assertIsNone(response['next'])
+
+
+    def test_fast_output_matches_serializer(self):
+        self.question_sets[1].description = 'кавычки " \\ и разделитель \u2028 строк'
+        self.question_sets[1].end_date = timezone.now() + timedelta(days=1)
+        self.question_sets[1].save()
+        for question_set in self.question_sets:
+            self.create_interview(question_set, 1, 'да')
+        self.create_interview(self.question_sets[1], 1, 'нет')
+        # ответ, оставшийся текстовым после удаления варианта
+        Answer.objects.create(interview=Interview.objects.last(), question=self.question_sets[1].questions.last(), \
+            answer_text='может быть')
+        interviews = Interview.objects.filter(interviewee_id=1)
+        expected = JSONRenderer().render(InterviewQuestionsWithAnswersSerializer(\
+            InterviewQuestionsWithAnswersSerializer.get_queryset(interviews), many=True).data)
+        values = list(InterviewQuestionsWithAnswersValues.get_queryset(interviews))
+        content = FastJSONRenderer().render(InterviewQuestionsWithAnswersValues.to_representation(values))
+        self.assertEqual(content, expected)
+        self.assertIn(b'\\u2028', content)
+
+
+@skipUnless(orjson, 'orjson не установлен')
+class FastJSONRendererTest(SimpleTestCase):
+    """
+    Вывод через orjson побайтно совпадает с JSONRenderer
+    """
+    def test_matches_json_renderer(self):
+        data = {'results': [{'id': 1, 'title': 'кавычки " \\ \u2028 \u2029 \n \t \x00', 'flag': True, \
+            'end_date': None, 'start_date': timezone.now(), 'items': [], 'nested': {'answers': [{}]}}], \
+            'next': 'http://testserver/?cursor=abc&page_size=2', 'count': 10 ** 18}
+        expected = JSONRenderer().render(data)
+        # Результат не должен быть получен откатом на JSONRenderer
+        with patch.object(JSONRenderer, 'render', side_effect=AssertionError):
+            content = FastJSONRenderer().render(data)
+        self.assertEqual(content, expected)
+
+
+class InterviewQuestionsViewTest(TestCase):
+    """
+    Выдача вопросов интервью из снимка анкеты
+    """
+    def setUp(self):
+        cache.clear()
+        self.question_set = QuestionSet.objects.create(title='Анкета', description='описание', \
+            start_date=timezone.now() - timedelta(days=1))
+        self.question = Question.objects.create(question_set=self.question_set, question_text='Цвет?', \
+            answer_type=Question.AnswerType.ONEVARIANT)
+        AnswerVariant.objects.create(question=self.question, answer_text='красный')
+        self.interview = Interview.objects.create(question_set=self.question_set, interviewee_id=1, \
+            start_date=timezone.now())
+        self.url = '/api/interview_questions/%d/' % self.interview.id
+
+    def test_snapshot_served_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json(), [{'id': self.question.id, 'question_set': self.question_set.id, \
+            'question_text': 'Цвет?', 'answer_type': 'ONEVARIANT', 'answer_variants': ['красный']}])
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_admin_write_changes_snapshot(self):
+        etag = self.client.get(self.url)['ETag']
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        response = self.client.patch('/api/question/%d/' % self.question.id, \
+            {'answer_variants': ['синий']}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['answer_variants'], ['синий'])
+
+
+class InterviewContextTest(TestCase):
+    """
+    Регистрация ответов по контексту интервью в кэше
+    """
+    def setUp(self):
+        cache.clear()
+        invalidate_active_question_sets()
+        self.question_set = QuestionSet.objects.create(title='Анкета', description='описание', \
+            start_date=timezone.now() - timedelta(days=1), end_date=timezone.now() + timedelta(days=1))
+        self.question = Question.objects.create(question_set=self.question_set, question_text='Цвет?', \
+            answer_type=Question.AnswerType.ONEVARIANT)
+        AnswerVariant.objects.create(question=self.question, answer_text='красный')
+        response = self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+            'interviewee_id': 1}, content_type='application/json')
+        self.interview_id = response.json()['id']
+
+    def register(self, answers, question_id=None):
+        return self.client.post('/api/register_answer/', {'interview_id': self.interview_id, \
+            'question_id': question_id or self.question.id, 'answers': answers}, content_type='application/json')
+
+    def test_only_writes_reach_database(self):
+        self.register(['красный'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.register(['красный'])
+        self.assertEqual(response.status_code, 200)
+        for table in ('interview', 'question', 'answervariant'):
+            self.assertFalse([query for query in queries \
+                if 'FROM "questionnaire_%s"' % table in query['sql']], table)
+        self.assertEqual(Answer.objects.filter(interview_id=self.interview_id).count(), 1)
+
+    def test_checks(self):
+        other = Question.objects.create(question_set=QuestionSet.objects.create(title='Другая', \
+            description='описание', start_date=timezone.now()), question_text='?', \
+            answer_type=Question.AnswerType.TEXT)
+        self.assertEqual(self.register(['текст'], other.id).status_code, 400)
+        self.assertEqual(self.register(['синий']).status_code, 400)
+        self.assertEqual(self.client.post('/api/register_answer/', {'interview_id': 0, \
+            'question_id': self.question.id, 'answers': ['красный']}, content_type='application/json')\
+            .status_code, 404)
+
+    def test_admin_write_changes_context(self):
+        self.register(['красный'])
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.client.patch('/api/question/%d/' % self.question.id, {'answer_variants': ['синий']}, \
+            content_type='application/json')
+        self.client.logout()
+        self.assertEqual(self.register(['красный']).status_code, 400)
+        self.assertEqual(self.register(['синий']).status_code, 200)
+
+    def test_restored_after_eviction(self):
+        cache.clear()
+        self.assertEqual(self.register(['красный']).status_code, 200)
+
+
+class RegisterAnswersBatchViewTest(TestCase):
+    """
+    Пакетная регистрация ответов на несколько вопросов интервью
+    """
+    def setUp(self):
+        cache.clear()
+        invalidate_active_question_sets()
+        self.question_set = QuestionSet.objects.create(title='Анкета', description='описание', \
+            start_date=timezone.now() - timedelta(days=1), end_date=timezone.now() + timedelta(days=1))
+        self.color = Question.objects.create(question_set=self.question_set, question_text='Цвет?', \
+            answer_type=Question.AnswerType.ONEVARIANT)
+        AnswerVariant.objects.bulk_create([AnswerVariant(question=self.color, answer_text=text) \
+            for text in ('красный', 'синий')])
+        self.comment = Question.objects.create(question_set=self.question_set, question_text='Почему?', \
+            answer_type=Question.AnswerType.TEXT)
+        self.user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_login(self.user)
+        self.interview_id = self.start(0)
+
+    def start(self, interviewee_id):
+        return self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+            'interviewee_id': interviewee_id}, content_type='application/json').json()['id']
+
+    def register(self, answers, interview_id=None):
+        return self.client.post('/api/register_answers/', {'interview_id': interview_id or self.interview_id, \
+            'answers': answers}, content_type='application/json')
+
+    def get_answers(self):
+        return sorted(Answer.objects.filter(interview_id=self.interview_id)\
+            .values_list('question_id', 'variant__answer_text', 'answer_text'))
+
+    def test_register(self):
+        response = self.register([{'question_id': self.color.id, 'answers': ['синий']}, \
+            {'question_id': self.comment.id, 'answers': ['нравится']}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_answers(), [(self.color.id, 'синий', None), (self.comment.id, None, 'нравится')])
+        # повторная отправка заменяет ответы только на переданные вопросы
+        self.assertEqual(self.register([{'question_id': self.color.id, 'answers': ['красный']}]).status_code, 200)
+        self.assertEqual(self.get_answers(), [(self.color.id, 'красный', None), (self.comment.id, None, 'нравится')])
+
+    def test_all_or_nothing(self):
+        response = self.register([{'question_id': self.comment.id, 'answers': ['нравится']}, \
+            {'question_id': self.color.id, 'answers': ['зелёный']}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), [str(self.color.id)])
+        self.assertEqual(self.get_answers(), [])
+
+    def test_invalid_items(self):
+        other = Question.objects.create(question_set=QuestionSet.objects.create(title='Другая', \
+            description='описание', start_date=timezone.now()), question_text='?', \
+            answer_type=Question.AnswerType.TEXT)
+        valid = {'question_id': self.comment.id, 'answers': ['нравится']}
+        response = self.register([valid, {'question_id': other.id, 'answers': ['текст']}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(other.id), response.json())
+        response = self.register([valid, {'question_id': self.comment.id, 'answers': ['ещё раз']}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {str(self.comment.id): ["Ответы на вопрос переданы повторно."]})
+        response = self.register([valid, ['не объект']])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('None', response.json())
+        self.assertEqual(self.register([]).status_code, 400)
+        self.assertEqual(self.get_answers(), [])
+
+    def test_owner(self):
+        self.client.force_login(get_user_model().objects.create_user('other', 'other@example.com', 'password'))
+        response = self.register([{'question_id': self.comment.id, 'answers': ['нравится']}])
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.get_answers(), [])
+        # анонимное интервью доступно по его коду
+        self.assertEqual(self.register([{'question_id': self.comment.id, 'answers': ['нравится']}], \
+            self.start(1)).status_code, 200)
+
+
+class ActiveQuestionSetsViewTest(TestCase):
+    """
+    Список активных анкет и старт интервью по индексу активных анкет
+    """
+    def setUp(self):
+        cache.clear()
+        invalidate_active_question_sets()
+        now = timezone.now()
+        self.active = QuestionSet.objects.create(title='Активная', description='описание', \
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+        QuestionSet.objects.create(title='Завершённая', description='описание', \
+            start_date=now - timedelta(days=2), end_date=now - timedelta(days=1))
+        self.future = QuestionSet.objects.create(title='Будущая', description='описание', \
+            start_date=now + timedelta(days=1))
+
+    def test_served_from_memory(self):
+        response = self.client.get('/api/active_question_sets/')
+        self.assertEqual([question_set['id'] for question_set in response.json()['results']], [self.active.id])
+        with self.assertNumQueries(0):
+            self.client.get('/api/active_question_sets/')
+
+    def test_start_interview_only_for_active(self):
+        response = self.client.post('/api/start_interview/', {'question_set_id': self.future.id, \
+            'interviewee_id': 1}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/start_interview/', {'question_set_id': self.active.id, \
+                'interviewee_id': 1}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        # Проверка активности анкеты не обращается к базе
+        self.assertFalse([query for query in queries if 'FROM "questionnaire_questionset"' in query['sql']])
+
+    def test_admin_write_invalidates(self):
+        self.client.get('/api/active_question_sets/')
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.client.patch('/api/question_set/%d/' % self.active.id, {'end_date': \
+            (timezone.now() - timedelta(seconds=1)).isoformat()}, content_type='application/json')
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/active_question_sets/').json()['results'], [])
+
+
+class QuestionSetResultsTest(TestCase):
+    """
+    Итоги анкеты на накопительных счётчиках
+    """
+    def setUp(self):
+        cache.clear()
+        invalidate_active_question_sets()
+        self.question_set = QuestionSet.objects.create(title='Анкета', description='описание', \
+            start_date=timezone.now() - timedelta(days=1))
+        self.color = Question.objects.create(question_set=self.question_set, question_text='Цвета?', \
+            answer_type=Question.AnswerType.MULTIVARIANT)
+        AnswerVariant.objects.bulk_create([AnswerVariant(question=self.color, answer_text=text) \
+            for text in ('красный', 'синий')])
+        self.name = Question.objects.create(question_set=self.question_set, question_text='Имя?', \
+            answer_type=Question.AnswerType.TEXT)
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def answer(self, interview_id, question, answers):
+        response = self.client.post('/api/register_answer/', {'interview_id': interview_id, \
+            'question_id': question.id, 'answers': answers}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def get_results(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/question_set/%d/results/' % self.question_set.id)
+        self.client.logout()
+        return response.json()
+
+    def test_incremental_counters_match_rebuild(self):
+        interview_ids = [self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+            'interviewee_id': number}, content_type='application/json').json()['id'] for number in (1, 2, 3)]
+        self.answer(interview_ids[0], self.color, ['красный', 'синий'])
+        self.answer(interview_ids[0], self.color, ['синий'])
+        self.answer(interview_ids[0], self.name, ['Иван'])
+        self.answer(interview_ids[1], self.color, ['синий'])
+        results = self.get_results()
+        self.assertEqual(results['interviews'], 3)
+        self.assertEqual(results['completed'], 1)
+        self.assertEqual([(step['answered_questions'], step['interviews'], step['reached']) \
+            for step in results['funnel']], [(0, 1, 3), (1, 1, 2), (2, 1, 1)])
+        color = results['questions'][0]
+        self.assertEqual(color['respondents'], 2)
+        self.assertEqual([variant['answers'] for variant in color['answer_variants']], [0, 2])
+        progress = list(Interview.objects.order_by('id').values_list('answered_questions', 'completed'))
+        self.assertEqual(progress, [(2, True), (1, False), (0, False)])
+        Interview.objects.update(answered_questions=0, completed=False)
+        call_command('rebuild_results', stdout=io.StringIO())
+        self.assertEqual(self.get_results(), results)
+        self.assertEqual(list(Interview.objects.order_by('id').values_list('answered_questions', 'completed')), \
+            progress)
+
+    def test_question_changes(self):
+        interview_ids = [self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+            'interviewee_id': number}, content_type='application/json').json()['id'] for number in (1, 2, 3)]
+        self.answer(interview_ids[0], self.color, ['красный'])
+        self.answer(interview_ids[0], self.name, ['Иван'])
+        self.answer(interview_ids[1], self.color, ['синий'])
+        self.answer(interview_ids[2], self.name, ['Пётр'])
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.delete('/api/question/%d/' % self.name.id).status_code, 204)
+        # ответы удалённого вопроса вычтены из итогов, ответившие на оставшийся вопрос завершили интервью
+        results = self.get_results()
+        self.assertEqual((results['interviews'], results['completed']), (3, 2))
+        self.assertEqual([(step['answered_questions'], step['interviews']) for step in results['funnel']], \
+            [(0, 1), (1, 2)])
+        progress = list(Interview.objects.order_by('id').values_list('answered_questions', 'completed'))
+        self.assertEqual(progress, [(1, True), (1, True), (0, False)])
+        rebuild_results(self.question_set)
+        self.assertEqual(self.get_results(), results)
+        self.assertEqual(list(Interview.objects.order_by('id').values_list('answered_questions', 'completed')), \
+            progress)
+        # на новый вопрос ещё никто не ответил
+        self.client.force_login(self.admin)
+        response = self.client.post('/api/question/', {'question_set': self.question_set.id, \
+            'question_text': 'Возраст?', 'answer_type': 'TEXT', 'answer_variants': []}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_results()['completed'], 0)
+        self.assertEqual(list(Interview.objects.order_by('id').values_list('answered_questions', 'completed')), \
+            [(1, False), (1, False), (0, False)])
+
+    def test_unanswered_questions(self):
+        interview_id = self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+            'interviewee_id': 1}, content_type='application/json').json()['id']
+        url = '/api/interview_unanswered/%d/' % interview_id
+        self.assertEqual([question['id'] for question in self.client.get(url).json()['questions']], \
+            [self.color.id, self.name.id])
+        self.answer(interview_id, self.name, ['Иван'])
+        # прогресс интервью и коды отвеченных вопросов
+        with self.assertNumQueries(2):
+            response = self.client.get(url).json()
+        self.assertEqual((response['answered_questions'], response['completed']), (1, False))
+        self.assertEqual(response['questions'], [{'id': self.color.id, 'question_set': self.question_set.id, \
+            'question_text': 'Цвета?', 'answer_type': 'MULTIVARIANT', 'answer_variants': ['красный', 'синий']}])
+        self.answer(interview_id, self.color, ['синий'])
+        response = self.client.get(url).json()
+        self.assertEqual((response['answered_questions'], response['completed'], response['questions']), \
+            (2, True, []))
+        self.assertEqual(self.client.get('/api/interview_unanswered/0/').status_code, 404)
+
+    def test_variant_references(self):
+        interview_id = self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+            'interviewee_id': 1}, content_type='application/json').json()['id']
+        self.answer(interview_id, self.color, ['красный', 'синий'])
+        self.answer(interview_id, self.name, ['Иван'])
+        self.assertEqual(list(Answer.objects.order_by('id').values_list('variant__answer_text', 'answer_text')), \
+            [('красный', None), ('синий', None), (None, 'Иван')])
+        # переименование варианта видно в ответах, удалённый вариант остаётся в ответе текстом
+        AnswerVariant.objects.filter(answer_text='синий').update(answer_text='голубой')
+        self.client.force_login(self.admin)
+        self.client.patch('/api/question/%d/' % self.color.id, {'answer_variants': ['голубой', 'белый']}, \
+            content_type='application/json')
+        self.client.logout()
+        answers = self.client.get('/api/user_interviews/1/').json()['results'][0]['question_set']['questions']
+        self.assertEqual([answer['answer_text'] for answer in answers[0]['answers']], ['красный', 'голубой'])
+        self.assertEqual(list(Answer.objects.order_by('id').values_list('variant__answer_text', 'answer_text')), \
+            [(None, 'красный'), ('голубой', None), (None, 'Иван')])
+        results = self.get_results()
+        call_command('rebuild_results', stdout=io.StringIO())
+        self.assertEqual(self.get_results(), results)
+        self.assertEqual([variant['answers'] for variant in results['questions'][0]['answer_variants']], [1, 0])
+
+    def test_archive(self):
+        interview_ids = [self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+            'interviewee_id': 1}, content_type='application/json').json()['id'] for _ in range(3)]
+        self.answer(interview_ids[0], self.color, ['красный', 'синий'])
+        self.answer(interview_ids[0], self.name, ['Иван'])
+        self.answer(interview_ids[2], self.name, ['Пётр'])
+        self.client.force_login(self.admin)
+        self.client.patch('/api/question_set/%d/' % self.question_set.id, {'end_date': \
+            (timezone.now() - timedelta(days=31)).isoformat()}, content_type='application/json')
+        export_before = self.client.get('/api/export_answers/', {'output': 'ndjson'})
+        export_before = b''.join(export_before.streaming_content)
+        self.client.logout()
+        results = self.get_results()
+        interviews = self.client.get('/api/user_interviews/1/').json()
+        self.assertEqual(len(interviews['results']), 3)
+        call_command('archive_question_sets', '--batch-size', '2', stdout=io.StringIO())
+        self.assertFalse(Interview.objects.exists())
+        self.assertFalse(Answer.objects.exists())
+        archive = ArchivedQuestionSet.objects.get()
+        self.assertEqual((archive.interviews, archive.answers, archive.finished is not None), (3, 4, True))
+        self.assertEqual(list(ArchivedInterview.objects.order_by('id').values_list('id', 'answered_questions')), \
+            [(interview_ids[0], 2), (interview_ids[1], 0), (interview_ids[2], 1)])
+        # итоги не меняются, а пересчёт их не обнуляет
+        self.assertEqual(self.get_results(), results)
+        call_command('rebuild_results', stdout=io.StringIO())
+        self.assertEqual(self.get_results(), results)
+        self.assertEqual(self.client.get('/api/user_interviews/1/', {'include_archived': 0}).json()['results'], [])
+        # рабочие и архивные интервью, анкеты архивных интервью и вопросы; ответы архивных - в их строках
+        with self.assertNumQueries(4):
+            archived = self.client.get('/api/user_interviews/1/').json()
+        self.assertEqual(archived, interviews)
+        # вопросы и прогресс архивного интервью
+        self.assertEqual([question['id'] for question in self.client.get('/api/interview_questions/%d/' % \
+            interview_ids[0]).json()], [self.color.id, self.name.id])
+        progress = self.client.get('/api/interview_unanswered/%d/' % interview_ids[2]).json()
+        self.assertEqual((progress['id'], progress['answered_questions'], progress['completed']), \
+            (interview_ids[2], 1, False))
+        self.assertEqual([question['id'] for question in progress['questions']], [self.color.id])
+        self.assertEqual(self.client.get('/api/interview_unanswered/%d/' % (max(interview_ids) + 1)).status_code, 404)
+        self.client.force_login(self.admin)
+        export_after = self.client.get('/api/export_answers/', {'output': 'ndjson'})
+        self.assertEqual(b''.join(export_after.streaming_content), export_before)
+        # архивные интервью удаляются вместе с анкетой
+        response = self.client.delete('/api/question_set/%d/' % self.question_set.id)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(ArchivedInterview.objects.exists() or ArchivedQuestionSet.objects.exists())
+        self.assertEqual(self.client.get('/api/user_interviews/1/').json()['results'], [])
+
+    def test_analytics(self):
+        interview_ids = [self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+            'interviewee_id': number}, content_type='application/json').json()['id'] for number in (1, 2, 3)]
+        self.answer(interview_ids[0], self.color, ['красный', 'синий'])
+        self.answer(interview_ids[0], self.name, ['Иван'])
+        self.answer(interview_ids[1], self.color, ['синий'])
+        red, blue = AnswerVariant.objects.filter(question=self.color).order_by('id').values_list('id', flat=True)
+        url = '/api/question_set/%d/analytics/' % self.question_set.id
+        self.client.force_login(self.admin)
+        with patch.object(AnswerColumns, 'load', autospec=True, side_effect=AnswerColumns.load) as load:
+            response = self.client.get(url, {'rows': self.color.id, 'columns': self.color.id}).json()
+            self.assertEqual((response['interviews'], response['completed'], response['segment']), (3, 1, []))
+            self.assertEqual([(question['id'], question['respondents']) for question in response['questions']], \
+                [(self.color.id, 2), (self.name.id, 1)])
+            self.assertEqual(response['crosstab']['counts'], [[1, 1], [1, 2]])
+            # сегмент: выбравшие синий; данные уже в памяти
+            segment = self.client.get(url, {'segment': blue}).json()
+            self.assertEqual((segment['interviews'], segment['completed'], segment['completion_rate']), (2, 1, 0.5))
+            self.assertEqual([variant['answers'] for variant in segment['questions'][0]['answer_variants']], [1, 2])
+            self.assertEqual(self.client.get(url, {'segment': [blue, red]}).json()['interviews'], 1)
+            self.assertEqual(load.call_count, 1)
+            # новый ответ меняет версию ответов анкеты
+            self.answer(interview_ids[2], self.color, ['красный'])
+            self.assertEqual(self.client.get(url, {'segment': red}).json()['interviews'], 2)
+            self.assertEqual(load.call_count, 2)
+            # как и новое интервью без ответов
+            self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+                'interviewee_id': 4}, content_type='application/json')
+            response = self.client.get(url).json()
+            self.assertEqual((response['interviews'], response['completion_rate']), (4, 0.25))
+            self.assertEqual(load.call_count, 3)
+        self.assertEqual(self.client.get(url, {'segment': 0}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'rows': self.color.id}).status_code, 400)
+        # архивные интервью загружаются вместе с рабочими
+        response = self.client.get(url, {'rows': self.color.id, 'columns': self.name.id}).json()
+        QuestionSet.objects.filter(id=self.question_set.id).update(end_date=timezone.now() - timedelta(days=1))
+        archive_question_set(self.question_set.id)
+        self.assertEqual(self.client.get(url, {'rows': self.color.id, 'columns': self.name.id}).json(), response)
+
+    @skipUnless(analytics.numpy, 'NumPy не установлен')
+    def test_analytics_masks(self):
+        red, blue = AnswerVariant.objects.filter(question=self.color).order_by('id').values_list('id', flat=True)
+        # 70 интервью: маски длиннее одного 64-битного слова
+        answers = []
+        for number in range(70):
+            interview = Interview.objects.create(question_set=self.question_set, interviewee_id=number, \
+                start_date=timezone.now(), completed=bool(number % 5))
+            answers += [Answer(interview=interview, question=self.color, variant_id=variant_id) \
+                for variant_id in [[red], [blue], [red, blue]][number % 3]]
+            if number % 5:
+                answers.append(Answer(interview=interview, question=self.name, answer_text='Иван'))
+        Answer.objects.bulk_create(answers)
+        results = []
+        for numpy in (analytics.numpy, None):
+            with patch.object(analytics, 'numpy', numpy):
+                columns = AnswerColumns(self.question_set.id)
+            self.assertIsInstance(columns.masks, NumpyMasks if numpy is not None else BitMasks)
+            results.append([columns.get_summary(columns.get_segment(segment)) for segment in ([], [red], [red, blue])] \
+                + [columns.get_crosstab(columns.get_segment([blue]), self.color.id, self.color.id)])
+        self.assertEqual(results[0], results[1])
+        self.assertEqual((results[0][0]['interviews'], results[0][2]['interviews']), (70, 23))
+        # маска занимает бит на интервью
+        self.assertEqual(NumpyMasks(70).full().nbytes, 16)
+
+    @override_settings(QUESTIONNAIRE_ANSWER_INGESTION='queue')
+    def test_queued_answers(self):
+        interview_id = self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+            'interviewee_id': 1}, content_type='application/json').json()['id']
+        for answers in (['красный'], ['красный', 'синий']):
+            response = self.client.post('/api/register_answer/', {'interview_id': interview_id, \
+                'question_id': self.color.id, 'answers': answers}, content_type='application/json')
+            self.assertEqual(response.status_code, 202)
+        self.assertFalse(Answer.objects.exists())
+        call_command('drain_answer_queue', stdout=io.StringIO())
+        self.assertEqual(sorted(Answer.objects.with_text().values_list('text', flat=True)), ['красный', 'синий'])
+        self.assertEqual(self.get_results()['questions'][0]['respondents'], 1)
+
+
+class ExportAnswersTest(TestCase):
+    """
+    Потоковая выгрузка ответов
+    """
+    def setUp(self):
+        self.question_set = QuestionSet.objects.create(title='Анкета', description='описание', \
+            start_date=timezone.now() - timedelta(days=1))
+        self.questions = [Question.objects.create(question_set=self.question_set, question_text=text, \
+            answer_type=Question.AnswerType.TEXT) for text in ('Имя?', 'Город?')]
+        self.interviews = [Interview.objects.create(question_set=self.question_set, interviewee_id=number, \
+            start_date=timezone.now()) for number in (1, 2, 3)]
+        Answer.objects.bulk_create([
+            Answer(interview=self.interviews[0], question=self.questions[0], answer_text='Иван'),
+            Answer(interview=self.interviews[0], question=self.questions[1], answer_text='Москва'),
+            Answer(interview=self.interviews[2], question=self.questions[1], answer_text='Казань'),
+        ])
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def get_content(self, params):
+        response = self.client.get('/api/export_answers/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        lines = self.get_content({'question_set': self.question_set.id}).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].endswith('%d. Имя?,%d. Город?' % (self.questions[0].id, self.questions[1].id)))
+        self.assertTrue(lines[1].endswith(',Иван,Москва'))
+        self.assertTrue(lines[2].endswith(',,'))
+        self.assertTrue(lines[3].endswith(',,Казань'))
+
+    def test_gzipped_ndjson(self):
+        content = gzip.decompress(self.get_content({'output': 'ndjson', 'gzip': '1'}))
+        rows = [json.loads(line) for line in content.decode('utf-8').splitlines()]
+        self.assertEqual([row['id'] for row in rows], [interview.id for interview in self.interviews])
+        self.assertEqual(rows[2]['answers'], {str(self.questions[1].id): ['Казань']})
+
+
+class SearchAnswersTest(TestCase):
+    """
+    Полнотекстовый поиск по текстовым ответам
+    """
+    def setUp(self):
+        self.question_set = QuestionSet.objects.create(title='Анкета', description='описание', \
+            start_date=timezone.now() - timedelta(days=1))
+        self.other_set = QuestionSet.objects.create(title='Другая', description='описание', \
+            start_date=timezone.now() - timedelta(days=1))
+        self.review = Question.objects.create(question_set=self.question_set, question_text='Отзыв?', \
+            answer_type=Question.AnswerType.TEXT)
+        self.color = Question.objects.create(question_set=self.question_set, question_text='Цвет?', \
+            answer_type=Question.AnswerType.ONEVARIANT)
+        self.variant = AnswerVariant.objects.create(question=self.color, answer_text='удобный')
+        self.other = Question.objects.create(question_set=self.other_set, question_text='Отзыв?', \
+            answer_type=Question.AnswerType.TEXT)
+        interview = Interview.objects.create(question_set=self.question_set, interviewee_id=1, \
+            start_date=timezone.now())
+        other_interview = Interview.objects.create(question_set=self.other_set, interviewee_id=1, \
+            start_date=timezone.now())
+        self.answers = Answer.objects.bulk_create([
+            Answer(interview=interview, question=self.review, answer_text='Удобно, но дорого'),
+            Answer(interview=interview, question=self.review, answer_text='удобно удобно удобно'),
+            Answer(interview=interview, question=self.color, variant=self.variant),
+            Answer(interview=other_interview, question=self.other, answer_text='Неудобно и дорого'),
+            Answer(interview=other_interview, question=self.other, answer_text='Очень удобно'),
+        ])
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def search(self, **params):
+        response = self.client.get('/api/search_answers/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_ids(self, **params):
+        return [hit['id'] for hit in self.search(**params)['results']]
+
+    def test_ranked_hits(self):
+        answer_ids = [answer.id for answer in Answer.objects.order_by('id')]
+        response = self.search(q='УДОБНО')
+        self.assertEqual(response['results'][0], {'id': answer_ids[1], 'interview_id': self.answers[1].interview_id, \
+            'question_id': self.review.id, 'question_set_id': self.question_set.id, \
+            'answer_text': 'удобно удобно удобно', 'score': response['results'][0]['score']})
+        self.assertEqual(sorted(hit['id'] for hit in response['results']), \
+            [answer_ids[0], answer_ids[1], answer_ids[4]])
+        self.assertGreater(response['results'][0]['score'], response['results'][-1]['score'])
+        self.assertEqual(self.get_ids(q='удобно дорого'), [answer_ids[0]])
+        self.assertEqual(sorted(self.get_ids(q='дорог*')), [answer_ids[0], answer_ids[3]])
+        self.assertEqual(sorted(self.get_ids(q='удобно', question_set=self.question_set.id)), answer_ids[:2])
+        self.assertEqual(self.get_ids(q='удобно', question=self.other.id), [answer_ids[4]])
+        first = self.search(q='удобно', page_size=2)
+        self.assertEqual(len(first['results']), 2)
+        second = self.client.get(first['next']).json()
+        self.assertEqual((second['next'], len(second['results'])), (None, 1))
+        self.assertEqual(self.client.get('/api/search_answers/', {'q': ' '}).status_code, 400)
+
+    def test_index_follows_answers(self):
+        answer_ids = [answer.id for answer in Answer.objects.order_by('id')]
+        Answer.objects.filter(id=answer_ids[1]).update(answer_text='дешево')
+        Answer.objects.filter(id=answer_ids[4]).delete()
+        self.assertEqual(self.get_ids(q='удобно'), [answer_ids[0]])
+        self.assertEqual(self.get_ids(q='дешево'), [answer_ids[1]])
+        # ответ удалённого варианта становится текстовым и попадает в поиск
+        self.assertEqual(self.get_ids(q='удобный'), [])
+        Answer.objects.filter(variant=self.variant).detach_variants()
+        self.assertEqual(self.get_ids(q='удобный'), [answer_ids[2]])
+        results = self.search(q='удобн*')
+        call_command('rebuild_search_index', '--chunk-size', '2', stdout=io.StringIO())
+        self.assertEqual(self.search(q='удобн*'), results)
+
+
+class SearchIndexTriggersTest(TransactionTestCase):
+    """
+    Триггеры индекса поиска после перестройки таблицы ответов миграцией SQLite
+    """
+    def get_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", \
+                [Answer._meta.db_table])
+            return sorted(row[0] for row in cursor.fetchall())
+
+    def alter_answer_text(self, max_length):
+        """
+        Изменение поля, при котором SQLite перестраивает таблицу, и завершение migrate
+        """
+        old_field = Answer._meta.get_field('answer_text')
+        new_field = models.CharField('текст ответа', max_length=max_length, blank=True, null=True)
+        new_field.set_attributes_from_name('answer_text')
+        new_field.model = Answer
+        with connection.schema_editor() as editor:
+            editor.alter_field(Answer, old_field, new_field)
+        self.assertEqual(self.get_triggers(), [])
+        emit_post_migrate_signal(0, False, connection.alias)
+
+    @skipUnless(connection.vendor == 'sqlite', 'триггеры индекса есть только в SQLite')
+    def test_restored_after_table_rebuild(self):
+        triggers = self.get_triggers()
+        self.assertEqual(len(triggers), 3)
+        question_set = QuestionSet.objects.create(title='Анкета', description='описание', start_date=timezone.now())
+        question = Question.objects.create(question_set=question_set, question_text='Отзыв?', \
+            answer_type=Question.AnswerType.TEXT)
+        interview = Interview.objects.create(question_set=question_set, interviewee_id=1, start_date=timezone.now())
+        first = Answer.objects.create(interview=interview, question=question, answer_text='удобно')
+        self.alter_answer_text(200)
+        self.addCleanup(self.alter_answer_text, 50)
+        self.assertEqual(self.get_triggers(), triggers)
+        second = Answer.objects.create(interview=interview, question=question, answer_text='удобно и дёшево')
+        Answer.objects.filter(id=first.id).update(answer_text='дорого')
+        self.assertEqual([hit['id'] for hit in search.search_answers('удобно')], [second.id])
+        self.assertEqual([hit['id'] for hit in search.search_answers('дорого')], [first.id])
+
+
+class AdminTest(TestCase):
+    """
+    Админка на больших таблицах
+    """
+    def setUp(self):
+        cache.clear()
+        self.question_set = QuestionSet.objects.create(title='Анкета', description='описание', \
+            start_date=timezone.now() - timedelta(days=1))
+        self.question = Question.objects.create(question_set=self.question_set, question_text='Цвет?', \
+            answer_type=Question.AnswerType.ONEVARIANT)
+        self.red, self.blue = AnswerVariant.objects.bulk_create([AnswerVariant(question=self.question, \
+            answer_text=text) for text in ('красный', 'синий')])
+        self.red, self.blue = AnswerVariant.objects.order_by('id')
+        self.interviews = [Interview.objects.create(question_set=self.question_set, interviewee_id=number, \
+            start_date=timezone.now()) for number in range(6)]
+        Answer.objects.bulk_create([Answer(interview=interview, question=self.question, variant=self.red) \
+            for interview in self.interviews])
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.questions_url = '/api/interview_questions/%d/' % self.interviews[0].id
+
+    def test_changelists_without_full_counts(self):
+        for url in ('/admin/questionnaire/interview/', '/admin/questionnaire/answer/'):
+            # сессия, пользователь, анкеты для фильтра, количество строк и строки вместе со связанными объектами
+            with self.assertNumQueries(5):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['cl'].result_count, 6)
+            self.assertIsNone(response.context['cl'].full_result_count)
+        with patch('questionnaire.admin.EXACT_COUNT_LIMIT', 2):
+            # без фильтров - оценка по таблице, с фильтром - не больше точно посчитанного
+            response = self.client.get('/admin/questionnaire/answer/')
+            self.assertEqual(response.context['cl'].result_count, Answer.objects.aggregate(Max('id'))['id__max'])
+            response = self.client.get('/admin/questionnaire/interview/', {'completed__exact': 0})
+            self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_inline_variants(self):
+        Answer.objects.create(interview=self.interviews[0], question=self.question, variant=self.blue)
+        self.client.get(self.questions_url)
+        prefix = AnswerVariant.RELATED_NAME
+        response = self.client.post('/admin/questionnaire/question/%d/change/' % self.question.id, {
+            'question_set': self.question_set.id, 'question_text': 'Цвет?', 'answer_type': 'ONEVARIANT',
+            prefix + '-TOTAL_FORMS': 3, prefix + '-INITIAL_FORMS': 2,
+            prefix + '-MIN_NUM_FORMS': 0, prefix + '-MAX_NUM_FORMS': 1000,
+            prefix + '-0-id': self.red.id, prefix + '-0-question': self.question.id,
+            prefix + '-0-answer_text': 'красный', prefix + '-0-DELETE': 'on',
+            prefix + '-1-id': self.blue.id, prefix + '-1-question': self.question.id,
+            prefix + '-1-answer_text': 'голубой',
+            prefix + '-2-question': self.question.id, prefix + '-2-answer_text': 'белый',
+        })
+        self.assertEqual(response.status_code, 302)
+        # ответы удалённого и переименованного вариантов остаются текстом, как при изменении через API;
+        # снимок вопросов обновлён
+        self.assertEqual(set(Answer.objects.values_list('variant', 'answer_text')), \
+            {(None, 'красный'), (None, 'синий')})
+        self.assertEqual(self.client.get(self.questions_url).json()[0]['answer_variants'], ['голубой', 'белый'])
+        white = AnswerVariant.objects.get(answer_text='белый')
+        Answer.objects.create(interview=self.interviews[1], question=self.question, variant=white)
+        response = self.client.post('/admin/questionnaire/answervariant/%d/change/' % white.id, \
+            {'question': self.question.id, 'answer_text': 'серый'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Answer.objects.filter(variant=white).exists())
+        self.assertTrue(Answer.objects.filter(interview=self.interviews[1], answer_text='белый').exists())
+
+    def test_rebuild_results(self):
+        # ответы из setUp записаны в обход счётчиков
+        response = self.client.post('/admin/questionnaire/questionset/', {'action': 'rebuild_results', \
+            '_selected_action': [self.question_set.id]})
+        self.assertEqual(response.status_code, 302)
+        results = get_question_set_results(self.question_set)
+        self.assertEqual((results['interviews'], results['questions'][0]['answer_variants'][0]['answers']), (6, 6))
+
+    def test_delete_keeps_results(self):
+        rebuild_results(self.question_set)
+        response = self.client.post('/admin/questionnaire/interview/', {'action': 'delete_rows', 'post': 'yes', \
+            '_selected_action': [self.interviews[0].id]})
+        self.assertEqual(response.status_code, 302)
+        answer = Answer.objects.get(interview=self.interviews[1])
+        response = self.client.post('/admin/questionnaire/answer/%d/delete/' % answer.id, {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        # удалённое уже вычтено из итогов и прогресса: пересчёт ничего не меняет
+        results = get_question_set_results(self.question_set)
+        progress = list(Interview.objects.order_by('id').values_list('answered_questions', 'completed'))
+        self.assertEqual((results['interviews'], results['questions'][0]['respondents'], progress[0]), \
+            (5, 4, (0, False)))
+        rebuild_results(self.question_set)
+        self.assertEqual(get_question_set_results(self.question_set), results)
+        self.assertEqual(list(Interview.objects.order_by('id').values_list('answered_questions', 'completed')), \
+            progress)
+
+    def test_delete_question(self):
+        rebuild_results(self.question_set)
+        response = self.client.post('/admin/questionnaire/question/', {'action': 'delete_rows', 'post': 'yes', \
+            '_selected_action': [self.question.id]})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Answer.objects.exists())
+        self.assertEqual([(step['answered_questions'], step['interviews']) \
+            for step in get_question_set_results(self.question_set)['funnel']], [(0, 6)])
+        self.assertEqual(set(Interview.objects.values_list('answered_questions', 'completed')), {(0, False)})
+
+    def test_delete_question_set(self):
+        # контекст интервью в кэше
+        response = self.client.post('/api/register_answer/', {'interview_id': self.interviews[0].id, \
+            'question_id': self.question.id, 'answers': ['синий']}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        ArchivedInterview.objects.create(id=1000, question_set=self.question_set, start_date=timezone.now(), \
+            last_activity=timezone.now(), answers='{}')
+        with patch('questionnaire.answers.DELETE_CHUNK_SIZE', 4), \
+            patch('questionnaire.answers._delete_interviews', wraps=_delete_interviews) as delete_interviews:
+            response = self.client.post('/admin/questionnaire/questionset/', {'action': 'delete_rows', \
+                'post': 'yes', '_selected_action': [self.question_set.id]})
+        self.assertEqual(response.status_code, 302)
+        # интервью удалены двумя порциями, а не сборщиком удаляемых объектов
+        self.assertEqual([len(call[0][0]) for call in delete_interviews.call_args_list], [4, 2])
+        self.assertFalse(QuestionSet.objects.exists() or Interview.objects.exists() or Answer.objects.exists() \
+            or ArchivedInterview.objects.exists())
+        self.assertEqual(self.client.post('/api/register_answer/', {'interview_id': self.interviews[0].id, \
+            'question_id': self.question.id, 'answers': ['синий']}, content_type='application/json').status_code, 404)
+
+    def test_delete_rows(self):
+        url = '/admin/questionnaire/interview/'
+        with patch('questionnaire.admin.EXACT_COUNT_LIMIT', 2), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'action': 'delete_rows', 'select_across': '1', 'index': 0, \
+                '_selected_action': [self.interviews[0].id]})
+        self.assertContains(response, 'name="select_across" value="1"')
+        # выбранные строки считаются не дальше предела, как в списке
+        self.assertContains(response, 'больше 2')
+        self.assertTrue(all('LIMIT' in query['sql'] for query in queries.captured_queries if 'COUNT(' in query['sql']))
+        response = self.client.post(url, {'action': 'delete_rows', 'select_across': '1', 'post': 'yes', \
+            '_selected_action': [self.interviews[0].id]})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Interview.objects.exists())
+        self.assertFalse(Answer.objects.exists())
+        response = self.client.post('/admin/questionnaire/answervariant/', {'action': 'delete_rows', \
+            'post': 'yes', '_selected_action': [self.red.id]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(AnswerVariant.objects.values_list('answer_text', flat=True)), ['синий'])
+
+
+@override_settings(QUESTIONNAIRE_THROTTLE_RATES={
+    'start_interview': {'ip': '4/m', 'interviewee': '2/m'},
+    'register_answer': {'interviewee': '1/m'},
+})
+class ThrottlingTest(TestCase):
+    """
+    Лимиты запросов респондентов и ограничение одновременных запросов
+    """
+    def setUp(self):
+        cache.clear()
+        invalidate_active_question_sets()
+        self.question_set = QuestionSet.objects.create(title='Анкета', description='описание', \
+            start_date=timezone.now() - timedelta(days=1))
+        self.question = Question.objects.create(question_set=self.question_set, question_text='Имя?', \
+            answer_type=Question.AnswerType.TEXT)
+
+    def start(self, interviewee_id, **extra):
+        return self.client.post('/api/start_interview/', {'question_set_id': self.question_set.id, \
+            'interviewee_id': interviewee_id}, content_type='application/json', **extra)
+
+    def test_start_interview(self):
+        self.assertEqual([self.start(1).status_code for _ in range(3)], [200, 200, 429])
+        # Лимит адреса общий для всех интервьюируемых
+        self.assertEqual([self.start(2).status_code for _ in range(2)], [200, 429])
+        response = self.start(3, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.start(1, REMOTE_ADDR='10.0.0.1').status_code, 429)
+        self.assertGreater(int(self.start(4).get('Retry-After')), 0)
+        self.assertEqual(Interview.objects.count(), 4)
+
+    def test_register_answer(self):
+        interview_id = self.start(1).json()['id']
+        data = {'interview_id': interview_id, 'question_id': self.question.id, 'answers': ['Иван']}
+        self.assertEqual(self.client.post('/api/register_answer/', data, content_type='application/json')\
+            .status_code, 200)
+        self.assertEqual(self.client.post('/api/register_answer/', data, content_type='application/json')\
+            .status_code, 429)
+
+    def test_unknown_interview(self):
+        data = {'interview_id': 999999, 'question_id': self.question.id, 'answers': ['Иван']}
+        # Интервью ищется один раз на запрос, а его отсутствие запоминается в кэше
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/register_answer/', data, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        # Перебор кодов интервью учитывается в лимите интервьюируемого по адресу клиента
+        data['interview_id'] = 999998
+        self.assertEqual(self.client.post('/api/register_answer/', data, content_type='application/json')\
+            .status_code, 429)
+        cache.clear()
+        data['interview_id'] = 999999
+        self.client.post('/api/register_answer/', data, content_type='application/json')
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/register_answer/', data, content_type='application/json', \
+                REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_concurrency_cap(self):
+        with override_settings(QUESTIONNAIRE_MAX_CONCURRENT_REQUESTS=1):
+            middleware = AdmissionControlMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get('/')
+        self.assertEqual(middleware(request).status_code, 200)
+        middleware.slots.acquire()
+        response = middleware(request)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        middleware.slots.release()
+        self.assertEqual(middleware(request).status_code, 200)
+
+
+class QueryTimingMiddlewareTest(TestCase):
+    """
+    Заголовок Server-Timing и метрики запросов к API
+    """
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.question_set = QuestionSet.objects.create(title='Анкета', description='описание', \
+            start_date=timezone.now() - timedelta(days=1))
+        self.interview = Interview.objects.create(question_set=self.question_set, interviewee_id=1, \
+            start_date=timezone.now())
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get('/api/user_interviews/1/')
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="queries=4 duplicates=0"$')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+        metrics = self.client.get('/api/metrics/').content.decode('utf-8')
+        self.assertIn('questionnaire_request_duration_seconds_count{view="UserInterviewsView",method="GET"} 1', \
+            metrics)
+        self.assertIn('questionnaire_request_queries_total{view="UserInterviewsView",method="GET"} 4', metrics)
+
+    def test_label_values(self):
+        for method in ('PURGE', 'X"\\\n'):
+            registry.observe('View"\\\n', method, 0.001, 0, 0, 0)
+        metrics = registry.render()
+        self.assertIn('questionnaire_request_duration_seconds_count{view="View\\"\\\\\\n",method="OTHER"} 2', \
+            metrics)
+        self.assertNotIn('PURGE', metrics)
+
+    def test_duplicate_queries_logged(self):
+        def get_response(request):
+            for _ in range(3):
+                list(Interview.objects.filter(id=self.interview.id))
+            return HttpResponse()
+        middleware = QueryTimingMiddleware(get_response)
+        with self.assertLogs('questionnaire.requests', 'WARNING') as logs, \
+            patch.object(QueryTimingMiddleware, 'duplicate_queries_log', 3):
+            response = middleware(RequestFactory().get('/api/any/'))
+        self.assertIn('queries=3 duplicates=2', response['Server-Timing'])
+        self.assertIn('Повторяющиеся запросы', logs.output[0])
+        self.assertIn('3 раз: SELECT', logs.output[0])
+
+
+class RetryOnLockTest(TransactionTestCase):
+    """
+    Повтор транзакции записи при блокировке базы
+    """
+    def test_retries_locked_transaction(self):
+        calls = []
+
+        @retry_on_lock
+        def write():
+            calls.append(QuestionSet.objects.create(title='Анкета', description='описание', \
+                start_date=timezone.now()))
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return len(calls)
+
+        with patch('questionnaire.sqlite.LOCK_RETRY_DELAY', 0):
+            self.assertEqual(write(), 3)
+        # Изменения неудачных попыток откатываются
+        self.assertEqual(QuestionSet.objects.count(), 1)
+        calls.clear()
+        with patch('questionnaire.sqlite.LOCK_ATTEMPTS', 2), patch('questionnaire.sqlite.LOCK_RETRY_DELAY', 0):
+            self.assertRaises(OperationalError, write)
+        self.assertEqual(len(calls), 2)
+
+
+class WsgiToAsgiTest(TransactionTestCase):
+    """
+    Запросы через ASGI-приложение поверх WSGI-обработчика Django
+    """
+    def setUp(self):
+        cache.clear()
+        invalidate_active_question_sets()
+        self.question_set = QuestionSet.objects.create(title='Анкета', description='описание', \
+            start_date=timezone.now() - timedelta(days=1))
+        self.application = WsgiToAsgi(get_wsgi_application(), threads=2)
+        self.addCleanup(self.application.executor.shutdown)
+
+    def request(self, method, path, data=None):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        # Тело приходит двумя сообщениями, как от клиента с медленной сетью
+        messages = [{'type': 'http.request', 'body': body[:5], 'more_body': True}, \
+            {'type': 'http.request', 'body': body[5:]}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': [ \
+            (b'host', b'testserver'), (b'content-type', b'application/json')]}
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.application(scope, receive, send))
+        finally:
+            loop.close()
+        return sent[0]['status'], json.loads(b''.join(message.get('body', b'') for message in sent[1:]).decode())
+
+    def test_requests(self):
+        status, content = self.request('GET', '/api/active_question_sets/')
+        self.assertEqual(status, 200)
+        self.assertEqual([question_set['id'] for question_set in content['results']], [self.question_set.id])
+        status, content = self.request('POST', '/api/start_interview/', \
+            {'question_set_id': self.question_set.id, 'interviewee_id': 7})
+        self.assertEqual(status, 200)
+        self.assertEqual(Interview.objects.using('default').get(id=content['id']).interviewee_id, 7)
+
+    def test_body_size_limit(self):
+        application = WsgiToAsgi(get_wsgi_application(), threads=1, max_body_size=10)
+        self.addCleanup(application.executor.shutdown)
+        # По заголовку длины - до чтения тела, при передаче частями - на куске, превысившем предел
+        for headers, messages in (
+            ([(b'content-length', b'11')], [{'type': 'http.request', 'body': b'12345678901'}]),
+            ([], [{'type': 'http.request', 'body': b'12345', 'more_body': True}, \
+                {'type': 'http.request', 'body': b'678901', 'more_body': True}, \
+                {'type': 'http.request', 'body': b'2'}]),
+        ):
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message)
+
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(application({'type': 'http', 'method': 'POST', \
+                    'path': '/api/start_interview/', 'headers': headers}, receive, send))
+            finally:
+                loop.close()
+            self.assertEqual(sent[0]['status'], 413)
+            self.assertEqual(len(messages), 1)
+        self.assertFalse(Interview.objects.exists())
+
+    def test_repeated_headers(self):
+        environ = build_environ({'type': 'http', 'method': 'GET', 'path': '/', 'headers': [
+            (b'cookie', b'sessionid=1'), (b'cookie', b'questionnaire_primary=1'),
+            (b'accept', b'text/html'), (b'accept', b'application/json')]}, b'')
+        self.assertEqual(environ['HTTP_COOKIE'], 'sessionid=1; questionnaire_primary=1')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,application/json')
+
+
+@patch.object(ReplicaRouter, 'replicas', ['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+    """
+    Чтение с реплик и чтение своих записей из основной базы
+    """
+    def get_read_database(self, request):
+        databases = []
+
+        def get_response(request):
+            databases.append(ReplicaRouter().db_for_read(Interview))
+            return HttpResponse()
+        return databases, ReplicaPinningMiddleware(get_response)(request)
+
+    def test_routing(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Interview), 'replica')
+        self.assertEqual(router.db_for_write(Interview), 'default')
+        with use_primary():
+            self.assertEqual(router.db_for_read(Interview), 'default')
+
+    def test_pinned_after_write(self):
+        databases, response = self.get_read_database(RequestFactory().post('/api/start_interview/'))
+        self.assertEqual(databases, ['default'])
+        cookie = response.cookies[ReplicaPinningMiddleware.cookie_name]
+        request = RequestFactory().get('/api/user_interviews/1/')
+        self.assertEqual(self.get_read_database(request)[0], ['replica'])
+        request.COOKIES[cookie.key] = cookie.value
+        self.assertEqual(self.get_read_database(request)[0], ['default'])
+
+
+class QuestionSetDocumentTest(TestCase):
+    """
+    Пакетный импорт, копирование анкет и правка вариантов ответов
+    """
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.document = {
+            'title': 'Анкета', 'description': 'описание', 'start_date': '2021-08-16T07:14:34Z', 'end_date': None,
+            'questions': [
+                {'question_text': 'Цвет?', 'answer_type': 'ONEVARIANT', 'answer_variants': ['красный', 'синий']},
+                {'question_text': 'Имя?', 'answer_type': 'TEXT'},
+                {'question_text': 'Еда?', 'answer_type': 'MULTIVARIANT', 'answer_variants': ['суп', 'каша']},
+            ],
+        }
+
+    def import_document(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/question_set/import/', self.document, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        # анкета, вопросы, варианты ответов
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 3)
+        return response.json()
+
+    def strip_ids(self, document):
+        document = dict(document)
+        document.pop('id')
+        document['questions'] = [dict((key, value) for key, value in question.items() if key != 'id') \
+            for question in document['questions']]
+        return document
+
+    def test_import(self):
+        document = self.import_document()
+        expected = dict(self.document)
+        expected['questions'] = [dict(question, answer_variants=question.get('answer_variants', [])) \
+            for question in self.document['questions']]
+        self.assertEqual(self.strip_ids(document), expected)
+
+    def test_clone(self):
+        document = self.import_document()
+        response = self.client.post('/api/question_set/%d/clone/' % document['id'], {'title': 'Копия'}, \
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        clone = response.json()
+        self.assertNotEqual(clone['id'], document['id'])
+        self.assertEqual(self.strip_ids(clone), dict(self.strip_ids(document), title='Копия'))
+
+    def test_update_keeps_unchanged_variants(self):
+        question = self.import_document()['questions'][0]
+        kept_id = AnswerVariant.objects.get(question=question['id'], answer_text='синий').id
+        response = self.client.patch('/api/question/%d/' % question['id'], \
+            {'answer_variants': ['синий', 'зелёный']}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(AnswerVariant.objects.filter(question=question['id']).order_by('id')\
+            .values_list('id', 'answer_text'))[0], (kept_id, 'синий'))
+        self.assertEqual(sorted(response.json()['answer_variants']), ['зелёный', 'синий'])
+
+
+class ValidateAnswersTest(SimpleTestCase):
+    """
+    Проверка ответов на вопрос
+    """
+    variants = {'a': 1, 'b': 2, 'c': 3}
+
+    def test_deduplicates_keeping_order(self):
+        self.assertEqual(validate_answers(Question.AnswerType.MULTIVARIANT, ['c', 'a', 'c', 'b', 'a'], \
+            self.variants), ['c', 'a', 'b'])
+
+    def test_rejects_invalid_answers(self):
+        for answer_type, answers in (
+            (Question.AnswerType.ONEVARIANT, ['d']),
+            (Question.AnswerType.ONEVARIANT, ['a', 'b']),
+            (Question.AnswerType.TEXT, ['x' * 51]),
+            (Question.AnswerType.TEXT, 'текст'),
+            (Question.AnswerType.MULTIVARIANT, [1]),
+        ):
+            with self.assertRaises(ValidationError):
+                validate_answers(answer_type, answers, self.variants)
@@ -0,0 +1,141 @@
+"""
+Ограничение частоты запросов респондентов
+
+Лимиты задаются в QUESTIONNAIRE_THROTTLE_RATES для каждого представления (атрибут throttle_scope)
+и каждого ключа: 'ip' - адрес клиента, 'interviewee' - интервьюируемый, 'question_set' - анкета.
+Лимит 'N/период' - корзина токенов ёмкостью N, которая наполняется со скоростью N за период:
+клиент может сделать N запросов подряд, а дальше - не чаще, чем позволяет скорость наполнения.
+Корзины хранятся в кэше Django и общие для всех процессов. Кэш не даёт атомарного
+чтения-изменения-записи, поэтому при одновременных запросах лимит может быть превышен на несколько
+запросов, как и у встроенных ограничителей DRF.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from rest_framework.throttling import BaseThrottle
+from .interview_context import get_request_interview_context
+
+BUCKET_KEY = 'questionnaire:throttle:%s:%s:%s'
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """
+    Лимит '30/min' в (ёмкость корзины, токенов в секунду). None - без ограничения
+    """
+    if rate is None:
+        return None
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Корзина токенов на значение ключа. Наследники задают key и get_ident_value
+    """
+    key = None
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate = parse_rate(getattr(settings, 'QUESTIONNAIRE_THROTTLE_RATES', {}).get(scope, {}).get(self.key))
+        if rate is None:
+            return True
+        value = self.get_ident_value(request, view)
+        if value is None:
+            return True
+        capacity, refill = rate
+        cache_key = BUCKET_KEY % (scope, self.key, value)
+        now = time.time()
+        tokens, updated = cache.get(cache_key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill)
+        self.wait_seconds = None
+        if tokens < 1:
+            self.wait_seconds = (1 - tokens) / refill
+            return False
+        # Корзина хранится, пока не наполнится снова, дальше она неотличима от новой
+        cache.set(cache_key, (tokens - 1, now), int((capacity - tokens + 1) / refill) + 1)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+    def get_ident_value(self, request, view):
+        raise NotImplementedError
+
+
+class IPThrottle(TokenBucketThrottle):
+    """
+    По адресу клиента (с учётом NUM_PROXIES из настроек DRF)
+    """
+    key = 'ip'
+
+    def get_ident_value(self, request, view):
+        return self.get_ident(request)
+
+
+def get_request_value(request, name):
+    """
+    Целое значение поля тела запроса. None, если его нет или оно не целое: ошибку вернёт само представление
+    """
+    data = request.data if isinstance(request.data, dict) else {}
+    try:
+        return int(data[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def get_request_context(request):
+    """
+    Контекст интервью запроса на регистрацию ответа. None для старта интервью и ненайденного интервью
+    """
+    if get_request_value(request, 'interview_id') is None:
+        return None
+    try:
+        return get_request_interview_context(request)
+    except Http404:
+        return None
+
+
+class IntervieweeThrottle(TokenBucketThrottle):
+    """
+    По интервьюируемому: interviewee_id анонимного интервью или пользователь Django.
+    Запросы к ненайденному интервью учитываются по пользователю или адресу клиента, иначе
+    перебор кодов интервью обходил бы этот лимит
+    """
+    key = 'interviewee'
+
+    def get_ident_value(self, request, view):
+        context = get_request_context(request)
+        if context is not None:
+            interviewee_id, user_id = context.interviewee_id, context.loggedin_user_id
+        elif get_request_value(request, 'interview_id') is not None:
+            if request.user.is_authenticated:
+                return 'user-%s' % request.user.id
+            return 'address-%s' % self.get_ident(request)
+        else:
+            interviewee_id, user_id = get_request_value(request, 'interviewee_id'), None
+            if interviewee_id == 0:
+                user_id = request.user.id
+        if interviewee_id:
+            return 'anonymous-%s' % interviewee_id
+        if user_id is not None:
+            return 'user-%s' % user_id
+        return None
+
+
+class QuestionSetThrottle(TokenBucketThrottle):
+    """
+    По анкете: общий лимит всех респондентов одной анкеты
+    """
+    key = 'question_set'
+
+    def get_ident_value(self, request, view):
+        context = get_request_context(request)
+        if context is not None:
+            return context.question_set_id
+        return get_request_value(request, 'question_set_id')
+
+
+RESPONDENT_THROTTLES = [IPThrottle, IntervieweeThrottle, QuestionSetThrottle]
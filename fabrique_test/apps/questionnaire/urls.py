@@ -13,6 +13,11 @@ urlpatterns = [
     path('active_question_sets/', views.ActiveQuestionSetsView.as_view()),
     path('start_interview/', views.StartInterviewView.as_view()),
     path('interview_questions/<int:interview_id>/', views.InterviewQuestionsView.as_view()),
+    path('interview_unanswered/<int:interview_id>/', views.UnansweredQuestionsView.as_view()),
     path('register_answer/', views.RegisterAnswerView.as_view()),
+    path('register_answers/', views.RegisterAnswersBatchView.as_view()),
     path('user_interviews/<int:interviewee_id>/', views.UserInterviewsView.as_view()),
+    path('export_answers/', views.ExportAnswersView.as_view()),
+    path('search_answers/', views.SearchAnswersView.as_view()),
+    path('metrics/', views.MetricsView.as_view()),
 ]
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""
+Проверка ответов на вопросы
+
+Допустимые варианты ответа вопроса кэшируются словарём {текст варианта: код варианта},
+так что проверка ответа - поиск в хэш-таблице без обращения к базе.
+"""
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import serializers
+from .models import Answer, AnswerVariant, Question
+from .routers import use_primary
+
+VARIANTS_KEY = 'questionnaire:question_variants:%s'
+
+VARIANTS_TIMEOUT = getattr(settings, 'QUESTIONNAIRE_VARIANTS_TIMEOUT', 60 * 60)
+
+MAX_ANSWER_LENGTH = Answer._meta.get_field('answer_text').max_length
+
+SINGLE_ANSWER_TYPES = (Question.AnswerType.TEXT, Question.AnswerType.ONEVARIANT)
+VARIANT_ANSWER_TYPES = (Question.AnswerType.ONEVARIANT, Question.AnswerType.MULTIVARIANT)
+
+
+def get_answer_variants_many(question_ids):
+    """
+    Варианты ответов вопросов: {код вопроса: {текст варианта: код варианта}}
+    """
+    keys = {question_id: VARIANTS_KEY % question_id for question_id in question_ids}
+    cached = cache.get_many(keys.values())
+    variants = {question_id: cached[key] for question_id, key in keys.items() if key in cached}
+    missing = [question_id for question_id in keys if question_id not in variants]
+    if missing:
+        for question_id in missing:
+            variants[question_id] = {}
+        with use_primary():
+            for variant_id, question_id, answer_text in AnswerVariant.objects.filter(question_id__in=missing)\
+                .order_by('id').values_list('id', 'question_id', 'answer_text'):
+                variants[question_id].setdefault(answer_text, variant_id)
+        cache.set_many({keys[question_id]: variants[question_id] for question_id in missing}, VARIANTS_TIMEOUT)
+    return variants
+
+def get_answer_variants(question_id):
+    return get_answer_variants_many([question_id])[question_id]
+
+def invalidate_answer_variants(question_ids):
+    cache.delete_many([VARIANTS_KEY % question_id for question_id in question_ids])
+
+def validate_answers(answer_type, answers, answer_variants):
+    """
+    Проверка ответов на вопрос с типом ответа answer_type. answer_variants - допустимые варианты ответа.
+    Возвращает ответы без повторов в исходном порядке
+    """
+    if not isinstance(answers, list) or \
+        any(not isinstance(answer, str) or len(answer) > MAX_ANSWER_LENGTH for answer in answers):
+        raise serializers.ValidationError(
+            "Ответы передаются списком строк не длиннее %d символов." % MAX_ANSWER_LENGTH
+        )
+    # Проверяем соответствие количества ответов
+    if answer_type in SINGLE_ANSWER_TYPES and len(answers) != 1:
+        raise serializers.ValidationError(
+            "При типе ответа TEXT или ONEVARIANT должен быть ровно один ответ."
+        )
+    # Проверяем соответствие ответа перечню вариантов ответа вопроса, если надо
+    if answer_type in VARIANT_ANSWER_TYPES:
+        for answer in answers:
+            if answer not in answer_variants:
+                raise serializers.ValidationError(
+                    "В вопросах с типом ответа ONEVARIANT или MULTIVARIANT можно использовать" +
+                    " ответы только из приведенного переченя."
+                )
+    # Удаляем повторяющиеся ответы
+    return list(OrderedDict.fromkeys(answers))
@@ -1,28 +1,60 @@
-from datetime import datetime
+import json
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework import viewsets, permissions
-from .models import Answer, Interview, Question, QuestionSet, AnswerVariant, Answer
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from .models import Answer, ArchivedInterview, Interview, Question, QuestionSet, AnswerVariant, Answer
 from .serializers import QuestionSetSerializer, QuestionWithAnswerVariantsSerializer,\
-    InterviewSerializer, InterviewQuestionsWithAnswersSerializer
+    InterviewSerializer, InterviewQuestionsWithAnswersValues, QuestionSetDocumentSerializer
 from rest_framework import serializers
-from django.db.models import Q
 from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.http import parse_etags
+from .active import active_question_sets
+from .analytics import get_question_set_analytics, invalidate_answers
+from . import export, search
+from .bulk import clone_question_set
+from .ingestion import enqueue_answers, is_queued
+from .metrics import registry
+from .pagination import KeysetPagination, OffsetPagination
+from .answers import delete_question_sets, delete_questions, replace_answers, update_completion
+from .renderers import get_renderer_classes
+from .results import get_question_set_results, register_interview_start
+from .sqlite import retry_on_lock
+from .throttling import RESPONDENT_THROTTLES
+from .interview_context import get_interview_context, get_interview_question_set_id, \
+    get_request_interview_context, remember_interview
+from .snapshots import get_question_set_snapshot, invalidate_question_sets
+from .validators import validate_answers
 
 class ActiveQuestionSetsView(APIView):
     """
     Представление для получения пользователем активных списков вопросов (анкет)
     """
+    renderer_classes = get_renderer_classes()
+
     def get(self, request):
         """
         Используем GET для получения результата без входных параметров, отсеив неактивные опросы
         """
-        now = datetime.now()
-        active_question_sets = QuestionSet.objects.exclude(
-            Q(end_date__lt = now) | Q(start_date__gt = now)
-        )
-        serializer = QuestionSetSerializer(active_question_sets, many=True)
-        return Response(serializer.data)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(active_question_sets.get_data(), request, view=self)
+        return paginator.get_paginated_response(page)
+
+@retry_on_lock
+def create_interview(**fields):
+    """
+    Создаём интервью и учитываем его в воронке итогов анкеты одной короткой транзакцией.
+    Новое интервью меняет и аналитику анкеты: число интервью и долю завершённых
+    """
+    interview = Interview.objects.create(**fields)
+    register_interview_start(interview.question_set_id)
+    invalidate_answers([interview.question_set_id])
+    return interview
 
 class StartInterviewView(APIView):
     """
@@ -35,6 +67,9 @@ class StartInterviewView(APIView):
     interviewee_id = 0 - использовать аутентификацию Django
     interviewee_id != 0 - анонимное прохождение опроса
     """
+    throttle_classes = RESPONDENT_THROTTLES
+    throttle_scope = 'start_interview'
+
     def post(self, request):
         """
         Используем POST для обработки запроса старта интервью
@@ -50,17 +85,18 @@ class StartInterviewView(APIView):
         else:
             loggedin_user = None
         # Не позволяем пользователю зарегистрировать интервью на неактивный опрос
-        now = datetime.now()
-        if not QuestionSet.objects.filter(
-            Q(id=question_set_id, start_date__lt=now), Q(end_date__isnull=True)|Q(end_date__gt=now)
-        ):
-        #if question_set.start_date > now or (question_set.end_date and question_set.end_date < now):
+        try:
+            question_set_id = int(question_set_id)
+        except (TypeError, ValueError):
+            question_set_id = None
+        if not active_question_sets.is_active(question_set_id):
             raise serializers.ValidationError(
                 "Выбран неактивный опрос"
             )
-        interview = Interview(interviewee_id=interviewee_id, loggedin_user=loggedin_user, \
-            question_set=QuestionSet.objects.get(id=question_set_id), start_date=datetime.now())
-        interview.save()
+        interview = create_interview(interviewee_id=interviewee_id, loggedin_user=loggedin_user, \
+            question_set_id=question_set_id, start_date=timezone.now())
+        remember_interview(interview.id, interview.question_set_id, interview.loggedin_user_id, \
+            interview.interviewee_id, active_question_sets.get_end_date(question_set_id))
         serializer = InterviewSerializer(interview)
         return Response(serializer.data)
 
@@ -72,66 +108,161 @@ class InterviewQuestionsView(APIView):
         """
         Показалось разумным, что пользователь должен иметь получить список вопросов по тому
         интервью, что он зарегистрировал
+
+        Отдаём готовый снимок вопросов анкеты из кэша, без обращения к базе. Вопросы интервью,
+        перенесённого в архив, отдаются из снимка его анкеты: анкета и вопросы в архив не переносятся
         """
-        interview = Interview.objects.get(id=interview_id)
-        question_set = interview.question_set
-        questions = Question.objects.filter(question_set=question_set)
-        serializer = QuestionWithAnswerVariantsSerializer(questions, many=True)
-        return Response(serializer.data)
+        try:
+            question_set_id = get_interview_question_set_id(interview_id)
+        except Http404:
+            question_set_id = get_object_or_404(ArchivedInterview.objects.only('question_set_id'), \
+                id=interview_id).question_set_id
+        content, etag = get_question_set_snapshot(question_set_id)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+def get_context_question(context, question_id):
+    """
+    Тип ответа и варианты ответов вопроса проходимого опроса: (код вопроса, тип ответа, варианты).
+    Если вопроса в опросе нет, None
+    """
+    try:
+        question_id = int(question_id)
+    except (TypeError, ValueError):
+        return None
+    if question_id not in context.questions:
+        return None
+    return (question_id,) + context.questions[question_id]
+
+def check_interview_owner(request, interview):
+    """
+    Проверяем соответствие пользователя, если интервью неанонимное
+    """
+    if interview.loggedin_user_id != None and interview.interviewee_id == None \
+        and request.user.id != interview.loggedin_user_id:
+        raise PermissionDenied
 
 class RegisterAnswerView(APIView):
     """
     Представление регистрации ответа интервьюируемого
+
+    Владелец интервью, вопросы опроса и варианты ответов берутся из контекста интервью в кэше,
+    к базе обращаемся только для записи ответов
     """
+    throttle_classes = RESPONDENT_THROTTLES
+    throttle_scope = 'register_answer'
+
     def post(self, request):
-        question_id = request.data.get('question_id')
-        interview_id = request.data.get('interview_id')
         answers = request.data.get('answers')
-        # Проверяем соответствие пользователя, если интервью неанонимное
-        interview = Interview.objects.get(id=interview_id)
-        if interview.loggedin_user != None and interview.interviewee_id == None \
-            and request.user != interview.loggedin_user:
-            raise PermissionDenied
+        context = get_request_interview_context(request)
+        check_interview_owner(request, context)
         # Проверяем наличие такого вопроса в проходимом опросе
-        try:
-            question = Question.objects.get(id=question_id, question_set=interview.question_set)
-        except:
+        question = get_context_question(context, request.data.get('question_id'))
+        if question is None:
             raise serializers.ValidationError(
                 "Можно отвечать на вопросы только из зарегистрированного опроса."
             )
-        # Проверяем соответствие количества ответов
-        if (question.answer_type == Question.AnswerType.TEXT or \
-            question.answer_type == Question.AnswerType.ONEVARIANT) and len(answers) != 1:
-            raise serializers.ValidationError(
-                "При типе ответа TEXT или ONEVARIANT должен быть ровно один ответ."
-            )
-        # Проверяем соответствие ответа перечню вариантов ответа вопроса, если надо
-        if question.answer_type == Question.AnswerType.ONEVARIANT or \
-            question.answer_type == Question.AnswerType.MULTIVARIANT:
-            answer_variants = AnswerVariant.objects.filter(question=question)\
-                .values_list('answer_text', flat=True)
-            for answer in answers:
-                if answer not in answer_variants:
-                    raise serializers.ValidationError(
-                        "В вопросах с типом ответа ONEVARIANT или MULTIVARIANT можно использовать" +
-                        " ответы только из приведенного переченя."
-                    )
-        # Удаляем повторяющиеся ответы
-        not_dupl_answers = []
-        for answer in answers:
-            if answer not in not_dupl_answers:
-                not_dupl_answers.append(answer)
+        question_id, answer_type, answer_variants = question
+        not_dupl_answers = validate_answers(answer_type, answers, answer_variants)
+        if is_queued():
+            enqueue_answers(context.id, {question_id: not_dupl_answers})
+            return Response({ "answer": "queued" }, status=status.HTTP_202_ACCEPTED)
         # Заменяем существующие ответы в этом интервью на этот вопрос
-        Answer.objects.filter(interview__id=interview_id, question__id=question_id).delete()
-        new_answers = [ Answer(question=question, interview=interview, answer_text=answer) for answer in not_dupl_answers ]
-        Answer.objects.bulk_create(new_answers)
+        replace_answers(context, {question_id: not_dupl_answers}, {question_id: answer_variants})
         return Response({ "answer": "ready" }) # ?????
-            
+
+class RegisterAnswersBatchView(APIView):
+    """
+    Представление пакетной регистрации ответов интервьюируемого на несколько вопросов интервью
+
+    Входные данные: interview_id, answers
+    answers - список объектов {"question_id": код_вопроса, "answers": [ответы]}
+    """
+    throttle_classes = RESPONDENT_THROTTLES
+    throttle_scope = 'register_answer'
+
+    def post(self, request):
+        items = request.data.get('answers')
+        if not isinstance(items, list) or not items:
+            raise serializers.ValidationError(
+                "Нужно передать непустой список ответов answers."
+            )
+        # Вопросы опроса и варианты ответов берём из контекста интервью в кэше
+        context = get_request_interview_context(request)
+        check_interview_owner(request, context)
+        errors = {}
+        answers_by_question = {}
+        variant_ids = {}
+        for item in items:
+            question_id = item.get('question_id') if isinstance(item, dict) else None
+            question = get_context_question(context, question_id)
+            if question is None:
+                errors[str(question_id)] = [
+                    "Можно отвечать на вопросы только из зарегистрированного опроса."
+                ]
+                continue
+            question_id, answer_type, variant_ids[question_id] = question
+            if question_id in answers_by_question:
+                errors[str(question_id)] = ["Ответы на вопрос переданы повторно."]
+                continue
+            try:
+                answers_by_question[question_id] = validate_answers(answer_type, item.get('answers'), \
+                    variant_ids[question_id])
+            except serializers.ValidationError as e:
+                errors[str(question_id)] = e.detail
+        # Ничего не сохраняем, если хотя бы один ответ не прошёл проверку
+        if errors:
+            raise serializers.ValidationError(errors)
+        if is_queued():
+            enqueue_answers(context.id, answers_by_question)
+            return Response({ "answer": "queued" }, status=status.HTTP_202_ACCEPTED)
+        replace_answers(context, answers_by_question, variant_ids)
+        return Response({ "answer": "ready" })
+
+class UnansweredQuestionsView(APIView):
+    """
+    Представление для продолжения интервью: прогресс прохождения и вопросы без ответов
+
+    Вопросы берутся из снимка анкеты, из базы читаются только прогресс интервью и коды отвеченных вопросов.
+    Ответы, ещё стоящие в очереди отложенной записи, не учитываются. Интервью, перенесённое в архив,
+    читается из архива
+    """
+    progress_fields = ('id', 'answered_questions', 'completed', 'last_activity')
+
+    def get(self, request, interview_id):
+        try:
+            context = get_interview_context(interview_id)
+        except Http404:
+            return self.get_archived(request, interview_id)
+        check_interview_owner(request, context)
+        progress = get_object_or_404(Interview.objects.values(*self.progress_fields), id=context.id)
+        answered = set(Answer.objects.filter(interview_id=context.id).values_list('question_id', flat=True))
+        return self.get_response(progress, context.question_set_id, answered)
+
+    def get_archived(self, request, interview_id):
+        interview = get_object_or_404(ArchivedInterview.objects.only('question_set_id', 'loggedin_user_id', \
+            'interviewee_id', 'answers', *self.progress_fields), id=interview_id)
+        check_interview_owner(request, interview)
+        progress = {field: getattr(interview, field) for field in self.progress_fields}
+        answered = {int(question_id) for question_id in json.loads(interview.answers)}
+        return self.get_response(progress, interview.question_set_id, answered)
+
+    def get_response(self, progress, question_set_id, answered):
+        content, _ = get_question_set_snapshot(question_set_id)
+        progress['questions'] = [question for question in json.loads(content.decode('utf-8')) \
+            if question['id'] not in answered]
+        return Response(progress)
 
 class UserInterviewsView(APIView):
     """
     Представление для вывода пользовательских интервью
     """
+    renderer_classes = get_renderer_classes()
+
     def get(self, request, interviewee_id):
         # Если interviewee_id = 0, то проверяем авторизацию
         if interviewee_id==0:
@@ -139,23 +270,209 @@ class UserInterviewsView(APIView):
                 raise PermissionDenied
             else:
                 interviews = Interview.objects.filter(loggedin_user=request.user)
+                archived = ArchivedInterview.objects.filter(loggedin_user=request.user)
         else:
             interviews = Interview.objects.filter(interviewee_id=interviewee_id)
-        serializer = InterviewQuestionsWithAnswersSerializer(interviews, many=True)
-        return Response(serializer.data)
+            archived = ArchivedInterview.objects.filter(interviewee_id=interviewee_id)
+        interviews = InterviewQuestionsWithAnswersValues.get_queryset(interviews)
+        paginator = KeysetPagination()
+        # Интервью прошедших анкет из архива выводятся вместе с рабочими; include_archived=0 убирает
+        # лишний запрос к базе архива, когда нужны только текущие опросы
+        if request.query_params.get('include_archived') in ('0', 'false'):
+            page = paginator.paginate_queryset(interviews, request, view=self)
+        else:
+            page = paginator.paginate_querysets([interviews, \
+                InterviewQuestionsWithAnswersValues.get_archived_queryset(archived)], request, view=self)
+        return paginator.get_paginated_response(InterviewQuestionsWithAnswersValues.to_representation(page))
+
+class ExportAnswersView(APIView):
+    """
+    Потоковая выгрузка ответов интервью. Только для админов
+
+    Параметры: output (csv или ndjson), question_set, date_from, date_to, gzip
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        output_format = request.query_params.get('output', 'csv')
+        if output_format not in export.FORMATS:
+            raise serializers.ValidationError("Формат выгрузки: csv или ndjson.")
+        question_set_id = request.query_params.get('question_set')
+        try:
+            question_set_id = int(question_set_id) if question_set_id else None
+            date_from, date_to = [export.parse_datetime_value(request.query_params[name]) \
+                if request.query_params.get(name) else None for name in ('date_from', 'date_to')]
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        gzip = request.query_params.get('gzip') in ('1', 'true')
+        response = StreamingHttpResponse(export.export_answers(output_format, question_set_id, \
+            date_from, date_to, gzip), content_type='application/gzip' if gzip \
+            else export.CONTENT_TYPES[output_format])
+        response['Content-Disposition'] = 'attachment; filename="%s"' % \
+            export.get_filename(output_format, gzip)
+        return response
+
+class SearchAnswersView(APIView):
+    """
+    Полнотекстовый поиск по текстовым ответам. Только для админов
+
+    Параметры: q (слова запроса, "слово*" - по началу слова), question_set, question, page_size, offset
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        if not search.parse_query(query):
+            raise serializers.ValidationError({'q': ["Укажите слова для поиска."]})
+        paginator = OffsetPagination()
+        question_set_id = paginator.get_int_param(request, 'question_set', None)
+        question_id = paginator.get_int_param(request, 'question', None)
+        page = paginator.paginate_function(lambda limit, offset: search.search_answers(query, question_set_id, \
+            question_id, limit, offset), request, view=self)
+        return paginator.get_paginated_response(page)
+
+class InvalidateQuestionSetMixin:
+    """
+    Сброс закэшированных данных анкет при изменении их администратором
+    """
+    def get_question_set_ids(self, instance):
+        return [instance.id]
 
-class QuestionSetViewSet(viewsets.ModelViewSet):
+    def get_question_ids(self, instance):
+        return []
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        self.invalidate(self.get_question_set_ids(serializer.instance))
+
+    def perform_update(self, serializer):
+        question_set_ids = self.get_question_set_ids(serializer.instance)
+        super().perform_update(serializer)
+        self.invalidate(question_set_ids + self.get_question_set_ids(serializer.instance), \
+            self.get_question_ids(serializer.instance))
+
+    def perform_destroy(self, instance):
+        question_set_ids = self.get_question_set_ids(instance)
+        question_ids = self.get_question_ids(instance)
+        self.delete_data(instance)
+        self.invalidate(question_set_ids, question_ids)
+
+    def delete_data(self, instance):
+        instance.delete()
+
+    def invalidate(self, question_set_ids, question_ids=()):
+        invalidate_question_sets(question_set_ids, question_ids)
+
+class QuestionSetViewSet(InvalidateQuestionSetMixin, viewsets.ModelViewSet):
     """
     CRUD для QuestionSet. Только для админов
     """
     queryset = QuestionSet.objects.all()
     serializer_class = QuestionSetSerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = KeysetPagination
+
+    def delete_data(self, instance):
+        # Интервью с ответами удаляются порциями, а не сборщиком удаляемых объектов вместе с анкетой
+        delete_question_sets([instance.id])
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_document(self, request):
+        """
+        Создание анкеты целиком: с вопросами и вариантами ответов
+        """
+        serializer = QuestionSetDocumentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        instance = serializer.save()
+        self.invalidate([instance.id])
+        return Response(self.get_document(instance.id), status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'])
+    def clone(self, request, pk=None):
+        """
+        Копия анкеты с вопросами и вариантами ответов. Переданные поля анкеты заменяются в копии
+        """
+        question_set = self.get_object()
+        serializer = QuestionSetSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        clone = clone_question_set(question_set, **serializer.validated_data)
+        self.invalidate([clone.id])
+        return Response(self.get_document(clone.id), status=status.HTTP_201_CREATED)
+
+    def get_document(self, question_set_id):
+        question_set = QuestionSet.objects.prefetch_related(
+            Prefetch(Question.RELATED_NAME, queryset=Question.objects.order_by('id')),
+            Question.RELATED_NAME + '__' + AnswerVariant.RELATED_NAME,
+        ).get(id=question_set_id)
+        return QuestionSetDocumentSerializer(question_set).data
+
+    @action(detail=True, methods=['get'])
+    def results(self, request, pk=None):
+        """
+        Итоги анкеты по накопленным счётчикам
+        """
+        return Response(get_question_set_results(self.get_object()))
+
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        """
+        Итоги сегмента анкеты и таблица сопряжённости двух вопросов по загруженным в память ответам
+        """
+        question_set = self.get_object()
+        try:
+            segment = [int(variant_id) for variant_id in request.query_params.getlist('segment')]
+            rows, columns = [int(request.query_params[name]) if request.query_params.get(name) else None \
+                for name in ('rows', 'columns')]
+        except ValueError:
+            raise serializers.ValidationError("Коды вопросов и вариантов ответа - целые числа.")
+        try:
+            return Response(get_question_set_analytics(question_set.id, segment, rows, columns))
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
 
-class QuestionViewSet(viewsets.ModelViewSet):
+class QuestionViewSet(InvalidateQuestionSetMixin, viewsets.ModelViewSet):
     """
     CRUD для Question. Только для админов
     """
     queryset = Question.objects.all()
     serializer_class = QuestionWithAnswerVariantsSerializer
-    permission_classes = [permissions.IsAdminUser]
\ No newline at end of file
+    permission_classes = [permissions.IsAdminUser]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        """
+        Вопросы с вариантами ответов, в списке можно отобрать вопросы одной анкеты параметром question_set
+        """
+        queryset = super().get_queryset().prefetch_related(AnswerVariant.RELATED_NAME)
+        question_set = self.request.query_params.get('question_set')
+        if self.action == 'list' and question_set:
+            try:
+                queryset = queryset.filter(question_set=int(question_set))
+            except ValueError:
+                raise serializers.ValidationError({'question_set': ["Ожидается целое число."]})
+        return queryset
+
+    def get_question_set_ids(self, instance):
+        return [instance.question_set_id]
+
+    def get_question_ids(self, instance):
+        return [instance.id]
+
+    def perform_create(self, serializer):
+        # Новый вопрос не отвечен ни в одном интервью: завершённые интервью анкеты больше не завершены
+        with transaction.atomic():
+            super().perform_create(serializer)
+            update_completion([serializer.instance.question_set_id])
+
+    def delete_data(self, instance):
+        # Ответы на вопрос вычитаются из итогов и прогресса интервью до удаления вопроса
+        delete_questions([instance.id])
+
+class MetricsView(APIView):
+    """
+    Метрики запросов к API текущего процесса в текстовом формате Prometheus. Только для админов
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,26 @@
+"""
+ASGI config for fabrique_test project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Django before 3.0 has no ASGI handler, so the WSGI application is served through
+questionnaire.asgi.WsgiToAsgi, which runs views in a thread pool.
+
+Run with any ASGI server, for example:
+    uvicorn fabrique_test.asgi:application
+"""
+
+import os
+
+import django
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fabrique_test.settings')
+
+if django.VERSION >= (3, 0):
+    from django.core.asgi import get_asgi_application
+    application = get_asgi_application()
+else:
+    # Настройки добавляют каталог приложений в sys.path, поэтому импорт - после инициализации Django
+    wsgi_application = get_wsgi_application()
+    from questionnaire.asgi import WsgiToAsgi
+    application = WsgiToAsgi(wsgi_application)
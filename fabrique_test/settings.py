@@ -34,7 +34,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    'questionnaire',
+    'questionnaire.apps.QuestionnaireConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -45,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'questionnaire.middleware.QueryTimingMiddleware',
+    'questionnaire.middleware.AdmissionControlMiddleware',
+    'questionnaire.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,8 +83,39 @@ WSGI_APPLICATION = 'fabrique_test.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # SQLite, в котором транзакции сразу берут блокировку записи (questionnaire/backends/sqlite3)
+        'ENGINE': 'questionnaire.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Соединение переиспользуется между запросами, ожидание блокировки записи - до 20 секунд
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+}
+
+# Реплики только для чтения. Для проверки на одной машине можно указать в переменной окружения
+# QUESTIONNAIRE_SQLITE_REPLICAS пути к копиям файла базы через запятую
+for number, name in enumerate(filter(None, os.environ.get('QUESTIONNAIRE_SQLITE_REPLICAS', '').split(','))):
+    DATABASES['replica%d' % (number + 1)] = dict(DATABASES['default'], NAME=name, TEST={'MIRROR': 'default'})
+
+# QUESTIONNAIRE_SQLITE_ARCHIVE - путь к отдельному файлу базы для архива интервью прошедших анкет
+# (см. questionnaire/archive.py). Таблицы архива в нём создаёт команда migrate --database archive
+if os.environ.get('QUESTIONNAIRE_SQLITE_ARCHIVE'):
+    DATABASES['archive'] = dict(DATABASES['default'], NAME=os.environ['QUESTIONNAIRE_SQLITE_ARCHIVE'])
+QUESTIONNAIRE_ARCHIVE_DATABASE = 'archive' if 'archive' in DATABASES else 'default'
+
+DATABASE_ROUTERS = ['questionnaire.routers.ArchiveRouter', 'questionnaire.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fabrique_test',
     }
 }
 
@@ -123,3 +157,83 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Questionnaire
+
+# Время хранения снимка вопросов анкеты в кэше, секунды
+QUESTIONNAIRE_SNAPSHOT_TIMEOUT = 24 * 60 * 60
+
+# Предельное время жизни индекса активных анкет в памяти процесса, секунды
+QUESTIONNAIRE_ACTIVE_INDEX_TIMEOUT = 60
+
+# Размер страницы списков по умолчанию и наибольший размер страницы, который можно запросить
+QUESTIONNAIRE_PAGE_SIZE = 100
+QUESTIONNAIRE_MAX_PAGE_SIZE = 1000
+
+# Время хранения допустимых вариантов ответа вопроса в кэше, секунды
+QUESTIONNAIRE_VARIANTS_TIMEOUT = 60 * 60
+
+# Запись ответов: 'sync' - сразу в таблицу ответов, 'queue' - в очередь, которую разбирает
+# команда drain_answer_queue (ответ API 202)
+QUESTIONNAIRE_ANSWER_INGESTION = 'sync'
+
+# Заголовок Server-Timing с временем ответа, временем в базе и количеством запросов к базе
+QUESTIONNAIRE_SERVER_TIMING = True
+
+# Запросы к API дольше стольких миллисекунд пишутся в журнал questionnaire.requests вместе с самыми
+# долгими запросами к базе (None - не писать), как и запросы, где один SQL повторился столько раз
+QUESTIONNAIRE_SLOW_REQUEST_MS = 500
+QUESTIONNAIRE_DUPLICATE_QUERIES_LOG = 10
+
+# Настройки соединений SQLite (см. questionnaire/sqlite.py) и повтор транзакций записи ответов
+# и старта интервью при ошибке "database is locked": количество попыток и пауза перед первым повтором
+QUESTIONNAIRE_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+}
+QUESTIONNAIRE_LOCK_ATTEMPTS = 5
+QUESTIONNAIRE_LOCK_RETRY_DELAY = 0.05
+
+# Базы, из которых читают запросы вне транзакций (см. questionnaire/routers.py; все, кроме основной
+# и архива), и сколько секунд после записи клиент читает из основной базы, пока реплики догоняют
+QUESTIONNAIRE_READ_REPLICAS = [alias for alias in DATABASES \
+    if alias not in ('default', QUESTIONNAIRE_ARCHIVE_DATABASE)]
+QUESTIONNAIRE_REPLICA_PIN_SECONDS = 10
+
+# Потоков для выполнения представлений при запуске через ASGI (fabrique_test/asgi.py) на Django 2.2
+QUESTIONNAIRE_ASGI_THREADS = 16
+# Наибольшее тело запроса через ASGI, байт: тело собирается в памяти, больший запрос получает 413
+QUESTIONNAIRE_ASGI_MAX_BODY_SIZE = 2621440
+
+# Сколько секунд (но не дольше окончания анкеты) в кэше хранится контекст интервью для регистрации
+# ответов без обращения к базе (см. questionnaire/interview_context.py)
+QUESTIONNAIRE_INTERVIEW_CONTEXT_TIMEOUT = 24 * 60 * 60
+# Сколько секунд в кэше хранится отметка, что интервью с таким кодом нет
+QUESTIONNAIRE_MISSING_INTERVIEW_TIMEOUT = 60
+
+# Лимиты запросов респондентов (см. questionnaire/throttling.py): для каждого представления и ключа
+# ('ip', 'interviewee', 'question_set') - 'N/период', где период - s, m, h или d. Отсутствующий ключ не ограничен
+QUESTIONNAIRE_THROTTLE_RATES = {
+    'start_interview': {'ip': '30/m', 'interviewee': '5/m', 'question_set': '3000/m'},
+    'register_answer': {'ip': '600/m', 'interviewee': '120/m'},
+}
+
+# Сколько запросов процесс обрабатывает одновременно; сверх этого сразу отвечает 429 (None - без ограничения)
+QUESTIONNAIRE_MAX_CONCURRENT_REQUESTS = 64
+
+# Через сколько дней после окончания анкеты команда archive_question_sets переносит её интервью в архив
+QUESTIONNAIRE_ARCHIVE_AFTER_DAYS = 30
+
+# Конфигурация полнотекстового поиска PostgreSQL для индекса ответов (см. questionnaire/search.py).
+# Используется миграцией 0009_answer_search при создании индекса, менять её нужно вместе с индексом
+QUESTIONNAIRE_SEARCH_CONFIG = 'russian'
+
+# Аналитика ответов (см. questionnaire/analytics.py): сколько анкет держать загруженными в памяти процесса
+# и сколько секунд хранить посчитанные итоги в кэше (они сбрасываются и раньше - при новых ответах)
+QUESTIONNAIRE_ANALYTICS_MAX_LOADED = 4
+QUESTIONNAIRE_ANALYTICS_TIMEOUT = 60 * 60
+
+# До скольки строк списки админки считаются точно; больше - оценка по статистике таблицы (см. questionnaire/admin.py)
+QUESTIONNAIRE_ADMIN_EXACT_COUNT_LIMIT = 10000